@@ -29,6 +29,7 @@ from conda_store_server._internal.action.get_conda_prefix_stats import (  # noqa
 )
 from conda_store_server._internal.action.install_lockfile import (  # noqa
     action_install_lockfile,
+    action_install_lockfile_incremental,
 )
 from conda_store_server._internal.action.install_specification import (  # noqa
     action_install_specification,
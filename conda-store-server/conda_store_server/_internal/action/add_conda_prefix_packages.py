@@ -6,12 +6,107 @@ import hashlib
 import json
 import os
 import pathlib
+import typing
 
+import filelock
 from conda.core.prefix_data import PrefixData
 
 from conda_store_server import api
 from conda_store_server._internal import action
 
+PACKAGE_HASH_CACHE_FILENAME = "conda-store-hashes.json"
+
+
+def hash_file(filename: str, chunk_size: int = 2**20) -> typing.Tuple[str, str]:
+    """Returns the md5 and sha256 of a file, reading it in a single pass"""
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    with open(filename, "rb") as f:
+        while chunk := f.read(chunk_size):
+            md5.update(chunk)
+            sha256.update(chunk)
+    return md5.hexdigest(), sha256.hexdigest()
+
+
+class PackageHashCache:
+    """Hashes of package tarballs stored next to them in the package cache
+
+    Entries are keyed by the path, size and modification time of the
+    tarball, so builds sharing a package cache only hash a tarball once
+    """
+
+    def __init__(self, pkgs_dir: str):
+        self.filename = os.path.join(pkgs_dir, PACKAGE_HASH_CACHE_FILENAME)
+        self.entries = self._load()
+        self.modified = False
+
+    def _load(self) -> typing.Dict:
+        try:
+            with open(self.filename) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _key(filename: str) -> str:
+        stat = os.stat(filename)
+        return f"{filename}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def get(self, filename: str) -> typing.Tuple[str, str]:
+        key = self._key(filename)
+        if key not in self.entries:
+            self.entries[key] = hash_file(filename)
+            self.modified = True
+        md5, sha256 = self.entries[key]
+        return md5, sha256
+
+    def save(self):
+        if not self.modified:
+            return
+
+        try:
+            with filelock.FileLock(f"{self.filename}.lock"):
+                # merge with entries written by concurrent builds and drop
+                # the entries of tarballs which no longer exist
+                entries = {**self._load(), **self.entries}
+                entries = {
+                    key: value
+                    for key, value in entries.items()
+                    if os.path.exists(key.rsplit(":", 2)[0])
+                }
+                tmp_filename = f"{self.filename}.tmp"
+                with open(tmp_filename, "w") as f:
+                    json.dump(entries, f)
+                os.replace(tmp_filename, self.filename)
+        except OSError:
+            # the package cache may be read-only, the cache is only an
+            # optimization
+            pass
+
+
+def get_package_hashes(record, hash_caches: typing.Dict) -> typing.Tuple[str, str]:
+    """Returns the md5 and sha256 of the tarball of a package in a prefix
+
+    The hashes recorded in repodata_record.json in the package cache are
+    used when both are present, otherwise the tarball is hashed
+    """
+    repodata_record = os.path.join(
+        record.extracted_package_dir, "info", "repodata_record.json"
+    )
+    try:
+        with open(repodata_record) as f:
+            repodata = json.load(f)
+        if repodata.get("md5") and repodata.get("sha256"):
+            return repodata["md5"], repodata["sha256"]
+    except (OSError, ValueError):
+        pass
+
+    filename = record.package_tarball_full_path
+    pkgs_dir = os.path.dirname(filename)
+    if pkgs_dir not in hash_caches:
+        hash_caches[pkgs_dir] = PackageHashCache(pkgs_dir)
+    return hash_caches[pkgs_dir].get(filename)
+
 
 def list_conda_prefix_packages(conda_prefix: pathlib.Path):
     """
@@ -19,11 +114,13 @@ def list_conda_prefix_packages(conda_prefix: pathlib.Path):
 
     """
     packages = []
+    hash_caches = {}
 
     prefix_data = PrefixData(str(conda_prefix))
     prefix_data.load()
 
     for record in prefix_data.iter_records():
+        md5, sha256 = get_package_hashes(record, hash_caches)
         package = {
             "build": record.build,
             "build_number": record.build_number,
@@ -31,12 +128,8 @@ def list_conda_prefix_packages(conda_prefix: pathlib.Path):
             "depends": list(record.depends),
             "license": record.license,
             "license_family": record.license_family,
-            "md5": hashlib.md5(
-                open(record.package_tarball_full_path, "rb").read()
-            ).hexdigest(),
-            "sha256": hashlib.sha256(
-                open(record.package_tarball_full_path, "rb").read()
-            ).hexdigest(),
+            "md5": md5,
+            "sha256": sha256,
             "name": record.name,
             "size": getattr(record, "size", 0),
             "subdir": record.subdir,
@@ -54,6 +147,9 @@ def list_conda_prefix_packages(conda_prefix: pathlib.Path):
             package["description"] = info.get("description")
 
         packages.append(package)
+
+    for hash_cache in hash_caches.values():
+        hash_cache.save()
     return packages
 
 
@@ -67,9 +163,6 @@ def action_add_conda_prefix_packages(
     build = api.get_build(db, build_id=build_id)
     packages = list_conda_prefix_packages(conda_prefix)
 
-    for package in packages:
-        conda_package_build = api.create_or_ignore_conda_package(db, package)
-        if conda_package_build is None:
-            continue  # pypi package
-        build.package_builds.append(conda_package_build)
-        db.commit()
+    package_build_ids = api.create_or_ignore_conda_packages(db, packages)
+    api.add_build_conda_package_builds(db, build.id, package_build_ids)
+    db.commit()
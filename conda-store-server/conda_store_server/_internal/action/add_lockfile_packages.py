@@ -47,9 +47,6 @@ def action_add_lockfile_packages(
     solve = api.get_solve(db, solve_id=solve_id)
     packages = list_lockfile_packages(conda_lock_spec)
 
-    for package in packages:
-        conda_package_build = api.create_or_ignore_conda_package(db, package)
-        if conda_package_build is None:
-            continue  # pypi package
-        solve.package_builds.append(conda_package_build)
-        db.commit()
+    package_build_ids = api.create_or_ignore_conda_packages(db, packages)
+    api.add_solve_conda_package_builds(db, solve.id, package_build_ids)
+    db.commit()
@@ -20,6 +20,10 @@ def action(f: typing.Callable):
     def wrapper(*args, stdout=None, stderr=None, **kwargs):
         action_context = ActionContext(stdout=stdout, stderr=stderr)
         with contextlib.ExitStack() as stack:
+            # write out buffered output once the action completes or fails
+            stack.callback(action_context.stderr.flush)
+            stack.callback(action_context.stdout.flush)
+
             # redirect stdout -> action_context.stdout
             stack.enter_context(contextlib.redirect_stdout(action_context.stdout))
 
@@ -3,11 +3,16 @@
 # license that can be found in the LICENSE file.
 
 import json
+import os
 import pathlib
+import shutil
 import sys
 import typing
 
-from conda_store_server._internal import action
+from conda.core.portability import update_prefix
+from conda.models.enums import FileMode, PathType
+
+from conda_store_server._internal import action, conda_utils
 
 
 @action.action
@@ -34,3 +39,163 @@ def action_install_lockfile(
     ]
 
     context.run_command(command, check=True)
+
+
+def diff_lockfile_packages(
+    base_conda_lock_spec: typing.Dict,
+    conda_lock_spec: typing.Dict,
+    platform: str,
+) -> typing.Tuple[typing.List[str], typing.List[typing.Dict]]:
+    """Returns the names of the packages to remove from an environment
+    installed from base_conda_lock_spec and the packages to install into it
+    to match conda_lock_spec
+
+    Packages which changed are both removed and installed
+    """
+    for spec in [base_conda_lock_spec, conda_lock_spec]:
+        if any(package["manager"] != "conda" for package in spec["package"]):
+            raise ValueError("incremental installs only support conda packages")
+
+    def conda_packages(spec):
+        return {
+            package["name"]: package
+            for package in spec["package"]
+            if package["platform"] == platform
+        }
+
+    base_packages = conda_packages(base_conda_lock_spec)
+    packages = conda_packages(conda_lock_spec)
+
+    removals = sorted(
+        name
+        for name, package in base_packages.items()
+        if name not in packages or packages[name]["url"] != package["url"]
+    )
+    additions = [
+        package
+        for name, package in packages.items()
+        if name not in base_packages or base_packages[name]["url"] != package["url"]
+    ]
+    return removals, additions
+
+
+def clone_conda_prefix(base_conda_prefix: pathlib.Path, conda_prefix: pathlib.Path):
+    """Clone a conda prefix by hardlinking the files of its packages
+
+    Files which embed the path of the prefix are copied and the path is
+    replaced, the same as conda does when linking a package. Files are
+    copied when hardlinks are not possible, e.g. across filesystems
+    """
+    # Relative paths of the files which contain the prefix and their mode
+    prefix_files = {}
+    for filename in (base_conda_prefix / "conda-meta").glob("*.json"):
+        with filename.open() as f:
+            record = json.load(f)
+        for path in record.get("paths_data", {}).get("paths", []):
+            if path.get("prefix_placeholder"):
+                prefix_files[os.path.normpath(path["_path"])] = FileMode(
+                    path.get("file_mode", "text")
+                )
+            elif path.get("path_type") in (
+                PathType.unix_python_entry_point.value,
+                PathType.windows_python_entry_point_script.value,
+            ):
+                prefix_files[os.path.normpath(path["_path"])] = FileMode.text
+
+    conda_prefix.mkdir(parents=True)
+    for root, dirnames, filenames in os.walk(base_conda_prefix):
+        relative_root = os.path.relpath(root, base_conda_prefix)
+        for name in dirnames + filenames:
+            source = os.path.join(root, name)
+            relative_path = os.path.normpath(os.path.join(relative_root, name))
+            destination = os.path.join(conda_prefix, relative_path)
+
+            if os.path.islink(source):
+                target = os.readlink(source)
+                if os.path.isabs(target) and pathlib.Path(target).is_relative_to(
+                    base_conda_prefix
+                ):
+                    target = os.path.join(
+                        conda_prefix, os.path.relpath(target, base_conda_prefix)
+                    )
+                os.symlink(target, destination)
+            elif os.path.isdir(source):
+                os.mkdir(destination)
+                shutil.copystat(source, destination)
+            elif relative_path in prefix_files:
+                shutil.copy2(source, destination)
+                update_prefix(
+                    destination,
+                    str(conda_prefix),
+                    placeholder=str(base_conda_prefix),
+                    mode=prefix_files[relative_path],
+                )
+            elif relative_path.startswith("conda-meta"):
+                # conda modifies some of these files in place, e.g. history
+                shutil.copy2(source, destination)
+            else:
+                try:
+                    os.link(source, destination)
+                except OSError:
+                    shutil.copy2(source, destination)
+
+
+@action.action
+def action_install_lockfile_incremental(
+    context,
+    conda_command: str,
+    conda_lock_spec: typing.Dict,
+    conda_prefix: pathlib.Path,
+    base_conda_lock_spec: typing.Dict,
+    base_conda_prefix: pathlib.Path,
+):
+    """Install a lockfile by cloning the prefix of a previous build and
+    applying only the packages which differ between the lockfiles
+
+    The packages must already be in the package cache, see
+    action_fetch_and_extract_conda_packages
+    """
+    if not conda_utils.is_conda_prefix(base_conda_prefix):
+        raise ValueError(f"{base_conda_prefix} is not a conda environment")
+
+    removals, additions = diff_lockfile_packages(
+        base_conda_lock_spec, conda_lock_spec, conda_utils.conda_platform()
+    )
+
+    context.log.info(
+        f"cloning {base_conda_prefix} to {conda_prefix}: "
+        f"{len(removals)} packages to remove, {len(additions)} to install"
+    )
+    clone_conda_prefix(base_conda_prefix, conda_prefix)
+
+    if removals:
+        command = [
+            conda_command,
+            "remove",
+            "--yes",
+            "--offline",
+            "--force",
+            "--prefix",
+            str(conda_prefix),
+            *removals,
+        ]
+        context.run_command(command, check=True)
+
+    if additions:
+        explicit_filename = pathlib.Path.cwd() / "explicit.txt"
+        with explicit_filename.open("w") as f:
+            f.write("@EXPLICIT\n")
+            for package in additions:
+                f.write(f"{package['url']}#{package['hash']['md5']}\n")
+
+        command = [
+            conda_command,
+            "install",
+            "--yes",
+            "--offline",
+            "--prefix",
+            str(conda_prefix),
+            "--file",
+            str(explicit_filename),
+        ]
+        context.run_command(command, check=True)
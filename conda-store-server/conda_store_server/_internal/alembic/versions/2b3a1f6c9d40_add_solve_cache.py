@@ -0,0 +1,65 @@
+# Copyright (c) conda-store development team. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+"""add solve cache
+
+Revision ID: 2b3a1f6c9d40
+Revises: bf065abf375b
+Create Date: 2026-10-17 10:12:41.208537
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "2b3a1f6c9d40"
+down_revision = "bf065abf375b"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "solve_cache",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("key", sa.Unicode(length=64), nullable=False),
+        sa.Column("lockfile", sa.JSON(), nullable=False),
+        sa.Column("created_on", sa.DateTime(), nullable=True),
+        sa.Column("last_used_on", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("key"),
+    )
+    op.create_index(
+        op.f("ix_solve_cache_last_used_on"),
+        "solve_cache",
+        ["last_used_on"],
+        unique=False,
+    )
+
+    with op.batch_alter_table("conda_store_configuration") as batch_op:
+        batch_op.add_column(
+            sa.Column(
+                "solve_cache_hits", sa.BigInteger(), nullable=True, server_default="0"
+            )
+        )
+        batch_op.add_column(
+            sa.Column(
+                "solve_cache_misses",
+                sa.BigInteger(),
+                nullable=True,
+                server_default="0",
+            )
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("conda_store_configuration") as batch_op:
+        batch_op.drop_column("solve_cache_misses")
+        batch_op.drop_column("solve_cache_hits")
+
+    op.drop_index(op.f("ix_solve_cache_last_used_on"), table_name="solve_cache")
+    op.drop_table("solve_cache")
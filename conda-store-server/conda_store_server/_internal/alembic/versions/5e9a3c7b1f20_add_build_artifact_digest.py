@@ -0,0 +1,36 @@
+# Copyright (c) conda-store development team. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+"""add build artifact digest
+
+Revision ID: 5e9a3c7b1f20
+Revises: d4e8b2f1a7c6
+Create Date: 2026-10-17 16:21:09.413527
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "5e9a3c7b1f20"
+down_revision = "d4e8b2f1a7c6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("build_artifact") as batch_op:
+        batch_op.add_column(sa.Column("digest", sa.Unicode(length=64), nullable=True))
+        batch_op.create_index(
+            batch_op.f("ix_build_artifact_digest"), ["digest"], unique=False
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("build_artifact") as batch_op:
+        batch_op.drop_index(batch_op.f("ix_build_artifact_digest"))
+        batch_op.drop_column("digest")
@@ -0,0 +1,32 @@
+# Copyright (c) conda-store development team. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+"""add build stage durations
+
+Revision ID: 7c1e5a2d8f13
+Revises: 2b3a1f6c9d40
+Create Date: 2026-10-17 13:40:05.512306
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "7c1e5a2d8f13"
+down_revision = "2b3a1f6c9d40"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("build") as batch_op:
+        batch_op.add_column(sa.Column("stage_durations", sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("build") as batch_op:
+        batch_op.drop_column("stage_durations")
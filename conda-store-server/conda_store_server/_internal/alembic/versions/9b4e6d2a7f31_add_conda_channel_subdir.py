@@ -0,0 +1,41 @@
+# Copyright (c) conda-store development team. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+"""add conda channel subdir
+
+Revision ID: 9b4e6d2a7f31
+Revises: c6d2e8f4a1b9
+Create Date: 2026-10-17 22:05:13.804471
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "9b4e6d2a7f31"
+down_revision = "c6d2e8f4a1b9"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "conda_channel_subdir",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("channel_id", sa.Integer(), nullable=False),
+        sa.Column("subdir", sa.Unicode(length=64), nullable=False),
+        sa.Column("filename", sa.Unicode(length=64), nullable=True),
+        sa.Column("etag", sa.Unicode(length=255), nullable=True),
+        sa.Column("last_modified", sa.Unicode(length=64), nullable=True),
+        sa.ForeignKeyConstraint(["channel_id"], ["conda_channel.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("channel_id", "subdir", name="_channel_subdir_uc"),
+    )
+
+
+def downgrade():
+    op.drop_table("conda_channel_subdir")
@@ -0,0 +1,34 @@
+# Copyright (c) conda-store development team. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+"""add build artifact content encoding
+
+Revision ID: a3f7d9e2c5b8
+Revises: 5e9a3c7b1f20
+Create Date: 2026-10-17 18:40:52.206814
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "a3f7d9e2c5b8"
+down_revision = "5e9a3c7b1f20"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("build_artifact") as batch_op:
+        batch_op.add_column(
+            sa.Column("content_encoding", sa.Unicode(length=16), nullable=True)
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("build_artifact") as batch_op:
+        batch_op.drop_column("content_encoding")
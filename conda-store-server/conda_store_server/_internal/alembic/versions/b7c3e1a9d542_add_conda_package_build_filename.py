@@ -0,0 +1,47 @@
+# Copyright (c) conda-store development team. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+"""add conda package build filename
+
+Revision ID: b7c3e1a9d542
+Revises: f81c3b5d9e04
+Create Date: 2026-10-17 09:09:00.724144
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "b7c3e1a9d542"
+down_revision = "f81c3b5d9e04"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("conda_package_build") as batch_op:
+        batch_op.add_column(sa.Column("filename", sa.Unicode(255), nullable=True))
+
+    # forget the cache headers of the indexed channels, so that the next
+    # update downloads the whole repodata and fills in the filename of the
+    # package builds indexed so far
+    conda_channel_subdir = sa.table(
+        "conda_channel_subdir",
+        sa.column("etag"),
+        sa.column("last_modified"),
+        sa.column("repodata_hash"),
+    )
+    op.execute(
+        conda_channel_subdir.update().values(
+            etag=None, last_modified=None, repodata_hash=None
+        )
+    )
+
+
+def downgrade():
+    with op.batch_alter_table("conda_package_build") as batch_op:
+        batch_op.drop_column("filename")
@@ -0,0 +1,58 @@
+# Copyright (c) conda-store development team. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+"""add build artifact unique constraint
+
+Revision ID: c6d2e8f4a1b9
+Revises: a3f7d9e2c5b8
+Create Date: 2026-10-17 21:12:36.518204
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "c6d2e8f4a1b9"
+down_revision = "a3f7d9e2c5b8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # concurrent writers could register the same artifact more than once,
+    # keep the first row of each (build_id, key, artifact_type)
+    build_artifact = sa.table(
+        "build_artifact",
+        sa.column("id"),
+        sa.column("build_id"),
+        sa.column("key"),
+        sa.column("artifact_type"),
+    )
+    first_build_artifact = (
+        sa.select(sa.func.min(build_artifact.c.id).label("id"))
+        .group_by(
+            build_artifact.c.build_id,
+            build_artifact.c.key,
+            build_artifact.c.artifact_type,
+        )
+        .subquery("first_build_artifact")
+    )
+    op.execute(
+        build_artifact.delete().where(
+            build_artifact.c.id.not_in(sa.select(first_build_artifact.c.id))
+        )
+    )
+
+    with op.batch_alter_table("build_artifact") as batch_op:
+        batch_op.create_unique_constraint(
+            "_build_key_artifact_type_uc", ["build_id", "key", "artifact_type"]
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("build_artifact") as batch_op:
+        batch_op.drop_constraint("_build_key_artifact_type_uc", type_="unique")
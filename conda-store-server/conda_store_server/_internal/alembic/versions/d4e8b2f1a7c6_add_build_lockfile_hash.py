@@ -0,0 +1,38 @@
+# Copyright (c) conda-store development team. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+"""add build lockfile hash
+
+Revision ID: d4e8b2f1a7c6
+Revises: 7c1e5a2d8f13
+Create Date: 2026-10-17 15:02:37.871904
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "d4e8b2f1a7c6"
+down_revision = "7c1e5a2d8f13"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("build") as batch_op:
+        batch_op.add_column(
+            sa.Column("lockfile_hash", sa.Unicode(length=64), nullable=True)
+        )
+        batch_op.create_index(
+            batch_op.f("ix_build_lockfile_hash"), ["lockfile_hash"], unique=False
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("build") as batch_op:
+        batch_op.drop_index(batch_op.f("ix_build_lockfile_hash"))
+        batch_op.drop_column("lockfile_hash")
@@ -0,0 +1,66 @@
+# Copyright (c) conda-store development team. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+"""add build stage duration bucket
+
+Revision ID: d5a8f2c6e913
+Revises: b7c3e1a9d542
+Create Date: 2026-10-17 09:09:02.895970
+
+"""
+
+import json
+
+import sqlalchemy as sa
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "d5a8f2c6e913"
+down_revision = "b7c3e1a9d542"
+branch_labels = None
+depends_on = None
+
+# api.BUILD_STAGE_DURATION_BUCKETS when the histograms were introduced
+BUCKETS = [1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600]
+
+
+def upgrade():
+    build_stage_duration_bucket = op.create_table(
+        "build_stage_duration_bucket",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("stage", sa.Unicode(length=64), nullable=False),
+        sa.Column("le", sa.Unicode(length=16), nullable=False),
+        sa.Column("count", sa.BigInteger(), nullable=False),
+        sa.Column("sum", sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("stage", "le", name="_stage_le_uc"),
+    )
+
+    # start the running histograms from the durations of past builds
+    build = sa.table("build", sa.column("stage_durations", sa.JSON))
+    histograms = {}
+    connection = op.get_bind()
+    for (stage_durations,) in connection.execute(sa.select(build.c.stage_durations)):
+        if isinstance(stage_durations, str):
+            stage_durations = json.loads(stage_durations)
+        for stage, duration in (stage_durations or {}).items():
+            le = next((str(le) for le in BUCKETS if duration <= le), "+Inf")
+            bucket = histograms.setdefault((stage, le), {"count": 0, "sum": 0.0})
+            bucket["count"] += 1
+            bucket["sum"] += duration
+
+    if histograms:
+        op.bulk_insert(
+            build_stage_duration_bucket,
+            [
+                {"stage": stage, "le": le, **bucket}
+                for (stage, le), bucket in histograms.items()
+            ],
+        )
+
+
+def downgrade():
+    op.drop_table("build_stage_duration_bucket")
@@ -0,0 +1,34 @@
+# Copyright (c) conda-store development team. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+"""add conda channel subdir repodata hash
+
+Revision ID: e2a9c4f7b6d3
+Revises: 9b4e6d2a7f31
+Create Date: 2026-10-17 23:31:48.126905
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "e2a9c4f7b6d3"
+down_revision = "9b4e6d2a7f31"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("conda_channel_subdir") as batch_op:
+        batch_op.add_column(
+            sa.Column("repodata_hash", sa.Unicode(length=64), nullable=True)
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("conda_channel_subdir") as batch_op:
+        batch_op.drop_column("repodata_hash")
@@ -0,0 +1,34 @@
+# Copyright (c) conda-store development team. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+"""add conda channel subdir fetch metrics
+
+Revision ID: f81c3b5d9e04
+Revises: e2a9c4f7b6d3
+Create Date: 2026-10-18 09:14:27.630582
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "f81c3b5d9e04"
+down_revision = "e2a9c4f7b6d3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("conda_channel_subdir") as batch_op:
+        batch_op.add_column(sa.Column("fetch_duration", sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column("fetched_on", sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("conda_channel_subdir") as batch_op:
+        batch_op.drop_column("fetched_on")
+        batch_op.drop_column("fetch_duration")
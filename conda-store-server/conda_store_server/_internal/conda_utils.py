@@ -9,15 +9,25 @@ executing conda commands
 """
 
 import bz2
-import datetime
+import concurrent.futures
+import functools
+import hashlib
 import json
+import logging
+import os
 import pathlib
 import subprocess
 import tempfile
+import time
+import typing
 
 import requests
+import urllib3
 import yaml
 import yarl
+import zstandard
+
+logger = logging.getLogger(__name__)
 
 
 def normalize_channel_name(channel_alias, channel):
@@ -33,7 +43,12 @@ def conda_list(prefix, executable: str = "conda"):
     return json.loads(subprocess.check_output(args))
 
 
+@functools.cache
 def conda_root_package_dir() -> pathlib.Path:
+    """Returns the first package cache directory of conda
+
+    The result is cached since this runs ``conda info`` in a subprocess
+    """
     args = ["conda", "info", "--json"]
     conf = json.loads(subprocess.check_output(args))
     prefix: pathlib.Path = pathlib.Path(conf["pkgs_dirs"][0])
@@ -134,10 +149,389 @@ def get_channel_url(channel: str) -> yarl.URL:
     return channel_replacements.get(str(normalized_channel_url), yarl.URL(channel))
 
 
+# Size of the chunks in which repodata is downloaded and parsed
+REPODATA_CHUNK_SIZE = 2**20
+
+
+class _JSONStreamReader:
+    """Incremental reader of a JSON document from a text file
+
+    Only the values which are decoded are held in memory, together with a
+    buffer of about ``chunk_size`` characters.
+    """
+
+    def __init__(self, f: typing.TextIO, chunk_size: int = REPODATA_CHUNK_SIZE):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._buffer = ""
+        self._position = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        chunk = self._f.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._position :] + chunk
+        self._position = 0
+        return True
+
+    def _skip_whitespace(self):
+        while True:
+            while (
+                self._position < len(self._buffer)
+                and self._buffer[self._position] in " \t\n\r"
+            ):
+                self._position += 1
+            if self._position < len(self._buffer) or not self._fill():
+                return
+
+    def consume(self, character: str) -> bool:
+        """Skip ``character`` if it is the next non whitespace character"""
+        self._skip_whitespace()
+        if self._buffer[self._position : self._position + 1] == character:
+            self._position += 1
+            return True
+        return False
+
+    def expect(self, character: str):
+        if not self.consume(character):
+            raise ValueError(f"invalid json, expected {character!r}")
+
+    def decode(self):
+        """Decode the next JSON value"""
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._position)
+                # a number at the end of the buffer may continue in the
+                # next chunk, the document always continues after a value
+                if end < len(self._buffer) or self._eof:
+                    self._position = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+
+def iter_json_object(
+    f: typing.TextIO, key: str, chunk_size: int = REPODATA_CHUNK_SIZE
+) -> typing.Iterator[typing.Tuple[str, typing.Any]]:
+    """Yield the items of the object at ``key`` of the JSON document in ``f``
+
+    The items are decoded one at a time, so that documents such as the
+    repodata of large channels are never held in memory as a whole.
+    """
+    reader = _JSONStreamReader(f, chunk_size)
+    reader.expect("{")
+    while not reader.consume("}"):
+        if reader.decode() == key:
+            reader.expect(":")
+            reader.expect("{")
+            while not reader.consume("}"):
+                item_key = reader.decode()
+                reader.expect(":")
+                yield item_key, reader.decode()
+                reader.consume(",")
+        else:
+            reader.expect(":")
+            reader.decode()
+        reader.consume(",")
+
+
+@functools.cache
+def http_session(
+    retries: int = 3, backoff_factor: float = 0.5, pool_maxsize: int = 10
+) -> requests.Session:
+    """HTTP session shared by the channel updates of a process
+
+    Connections are kept alive and reused across channels and subdirs
+    hosted on the same server. Connection errors and responses with a
+    transient error status are retried ``retries`` times, with an
+    exponential backoff of ``backoff_factor`` seconds, doubled on each
+    retry, unless the server sends Retry-After.
+    """
+    retry = urllib3.util.Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        raise_on_status=False,
+    )
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_maxsize, pool_maxsize=pool_maxsize, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def download_file(
+    url: str,
+    filename: str,
+    headers: typing.Dict[str, str] = None,
+    decompressor=None,
+    digest=None,
+    session: requests.Session = None,
+) -> typing.Mapping[str, str] | None:
+    """Download ``url`` to ``filename`` in chunks, decompressing on the fly
+
+    ``digest`` is a hashlib object updated with the written content.
+    Returns the response headers, or None if the server responded 304
+    Not Modified.
+    """
+    session = session or http_session()
+    with session.get(url, headers=headers, stream=True) as response:
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+
+        with open(filename, "wb") as f:
+            for chunk in response.iter_content(REPODATA_CHUNK_SIZE):
+                if decompressor:
+                    chunk = decompressor.decompress(chunk)
+                if digest:
+                    digest.update(chunk)
+                f.write(chunk)
+    return response.headers
+
+
+def conditional_headers(cache_headers: typing.Dict) -> typing.Dict[str, str]:
+    """Headers of a conditional request for a previously downloaded file"""
+    # https://developer.mozilla.org/en-US/docs/Web/HTTP/Conditional_requests
+    headers = {}
+    if cache_headers.get("etag"):
+        headers["If-None-Match"] = cache_headers["etag"]
+    if cache_headers.get("last_modified"):
+        headers["If-Modified-Since"] = cache_headers["last_modified"]
+    return headers
+
+
+def repodata_hash():
+    """Hash identifying the versions of repodata.json in JLAP patches"""
+    return hashlib.blake2b(digest_size=32)
+
+
+# Variants of repodata.json in order of preference, with the decompressor
+# to apply while they are downloaded
+REPODATA_FILENAMES = {
+    "repodata.json.zst": lambda: zstandard.ZstdDecompressor().decompressobj(),
+    "repodata.json.bz2": bz2.BZ2Decompressor,
+}
+
+JLAP_FILENAME = "repodata.jlap"
+
+
+class JLAPError(ValueError):
+    """The repodata cannot be brought up to date from a JLAP file"""
+
+
+def parse_jlap(content: bytes) -> typing.Tuple[typing.List[typing.Dict], typing.Dict]:
+    """Patches and metadata of a JLAP file, once its checksum is verified
+
+    A JLAP file starts with a hex encoded initialization vector, followed
+    by json patches between versions of repodata.json, a metadata line
+    with the ``latest`` version, and the checksum of all previous lines.
+    Each line is chained into the checksum with blake2b, keyed by the
+    checksum of the previous lines, as in ``conda.gateways.repodata.jlap``.
+    """
+    lines = content.split(b"\n")
+    if lines and lines[-1] == b"":
+        lines.pop()
+    if len(lines) < 3:
+        raise JLAPError("truncated jlap file")
+
+    checksum = bytes.fromhex(lines[0].decode("utf-8"))
+    for line in lines[1:-1]:
+        checksum = hashlib.blake2b(line, key=checksum, digest_size=32).digest()
+    if checksum.hex() != lines[-1].decode("utf-8"):
+        raise JLAPError("invalid jlap checksum")
+
+    return [json.loads(line) for line in lines[1:-2]], json.loads(lines[-2])
+
+
+def apply_jlap_patches(
+    patches: typing.List[typing.Dict], latest: str, current: str
+) -> typing.Tuple[typing.Dict[str, typing.Dict], typing.Set[str]]:
+    """Package records added and removed between two versions of repodata
+
+    Only operations on whole records of ``packages`` can be applied
+    without the previous repodata, JLAPError is raised for any other
+    change to the packages or when the patches do not lead from
+    ``current`` to ``latest``.
+    """
+    added = {}
+    removed = set()
+    for patch in patches:
+        if current == latest:
+            break
+        if patch.get("from") != current:
+            continue
+
+        for operation in patch["patch"]:
+            path = [
+                part.replace("~1", "/").replace("~0", "~")
+                for part in operation["path"].split("/")[1:]
+            ]
+            if not path or path[0] != "packages":
+                # other keys, e.g. packages.conda, are not indexed
+                continue
+            if len(path) != 2 or operation["op"] not in ("add", "replace", "remove"):
+                raise JLAPError(
+                    f"cannot apply {operation['op']} of {operation['path']}"
+                )
+
+            if operation["op"] == "remove":
+                added.pop(path[1], None)
+                removed.add(path[1])
+            else:
+                added[path[1]] = operation["value"]
+                removed.discard(path[1])
+        current = patch["to"]
+
+    if current != latest:
+        raise JLAPError(f"no jlap patches from {current} to {latest}")
+    return added, removed
+
+
+def download_subdir_jlap(
+    subdir_url: yarl.URL,
+    filename: str,
+    cache_headers: typing.Dict,
+    session: requests.Session = None,
+) -> typing.Dict | None:
+    """Update the repodata of a subdir from its JLAP file
+
+    The added package records are written to ``filename`` in the format
+    of repodata.json. Returns None if the channel has no JLAP file, which
+    hosts such as S3 report with either 403 or 404.
+    """
+    headers = {}
+    if cache_headers.get("filename") == JLAP_FILENAME:
+        headers = conditional_headers(cache_headers)
+
+    session = session or http_session()
+    response = session.get(subdir_url / JLAP_FILENAME, headers=headers)
+    if response.status_code in (403, 404):
+        return None
+    if response.status_code == 304:
+        return {"modified": False, "cache_headers": cache_headers, "removed": set()}
+    response.raise_for_status()
+
+    patches, metadata = parse_jlap(response.content)
+    added, removed = apply_jlap_patches(
+        patches, metadata["latest"], cache_headers["repodata_hash"]
+    )
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump({"packages": added}, f)
+
+    return {
+        "modified": bool(added or removed),
+        "cache_headers": {
+            "filename": JLAP_FILENAME,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "repodata_hash": metadata["latest"],
+        },
+        "removed": removed,
+    }
+
+
+def download_subdir_repodata(
+    subdir_url: yarl.URL,
+    filename: str,
+    cache_headers: typing.Dict = None,
+    session: requests.Session = None,
+) -> typing.Dict:
+    """Download the repodata of a subdir unless it has not been modified
+
+    ``cache_headers`` are the ``filename``, ``etag``, ``last_modified``
+    and ``repodata_hash`` returned by the previous download of the subdir.
+
+    When the version of the previously downloaded repodata is known, only
+    the package records added and removed since are downloaded from the
+    JLAP file of the subdir. Otherwise, or when the JLAP file cannot be
+    applied, the full repodata is downloaded. ``repodata.json.zst`` is
+    preferred and ``repodata.json.bz2`` is used by channels which do not
+    provide it, i.e. answer 403 or 404. The same file as the previous
+    download is requested with a conditional request, so that an
+    unmodified subdir costs a single 304 round trip.
+
+    Returns whether the repodata has been ``modified``, in which case the
+    package records are written to ``filename``, the new ``cache_headers``
+    and the filenames of the ``removed`` package records.
+    """
+    cache_headers = cache_headers or {}
+
+    if cache_headers.get("repodata_hash"):
+        try:
+            result = download_subdir_jlap(
+                subdir_url, filename, cache_headers, session=session
+            )
+        except (JLAPError, requests.RequestException, ValueError, KeyError) as e:
+            # JLAP is only an optimization, any failure to use it must not
+            # prevent updating the channel
+            logger.warning(f"falling back to full repodata of {subdir_url}: {e!r}")
+            cache_headers = {}
+        else:
+            if result is not None:
+                return result
+            # the channel does not provide jlap, which is only probed again
+            # after the next full download
+            cache_headers = {**cache_headers, "repodata_hash": None}
+
+    repodata_filenames = list(REPODATA_FILENAMES)
+    if cache_headers.get("filename") in REPODATA_FILENAMES:
+        repodata_filenames.remove(cache_headers["filename"])
+        repodata_filenames.insert(0, cache_headers["filename"])
+
+    for i, repodata_filename in enumerate(repodata_filenames):
+        headers = {}
+        if repodata_filename == cache_headers.get("filename"):
+            headers = conditional_headers(cache_headers)
+
+        digest = repodata_hash()
+        try:
+            response_headers = download_file(
+                subdir_url / repodata_filename,
+                filename,
+                headers=headers,
+                decompressor=REPODATA_FILENAMES[repodata_filename](),
+                digest=digest,
+                session=session,
+            )
+        except requests.HTTPError as e:
+            # hosts such as S3 answer 403 rather than 404 for missing files
+            if e.response.status_code in (403, 404) and i < len(repodata_filenames) - 1:
+                continue
+            raise
+
+        if response_headers is None:
+            return {"modified": False, "cache_headers": cache_headers, "removed": set()}
+        return {
+            "modified": True,
+            "cache_headers": {
+                "filename": repodata_filename,
+                "etag": response_headers.get("ETag"),
+                "last_modified": response_headers.get("Last-Modified"),
+                "repodata_hash": digest.hexdigest(),
+            },
+            "removed": set(),
+        }
+
+
 def download_repodata(
     channel: str,
-    last_update: datetime.datetime = None,
+    directory: str,
     subdirs=None,
+    cache_headers: typing.Dict[str, typing.Dict] = None,
+    session: requests.Session = None,
+    max_workers: int = 4,
 ):
     """Download repodata for channel only if changed since last update
 
@@ -146,35 +540,75 @@ def download_repodata(
     osx-64, win-32, win-64, zos-z (possibly others).
 
     Check ``conda.base.constants.KNOWN_SUBDIRS`` for the full list.
+
+    Each subdir is fetched using its entry in ``cache_headers``, see
+    ``download_subdir_repodata``, and the new cache headers of all subdirs
+    are returned under ``cache_headers``. The package records of each
+    modified architecture are written to ``directory`` and the filename is
+    returned instead of the parsed repodata, see ``iter_json_object`` to
+    read them. The filenames of the package records removed from an
+    architecture are returned under ``removed``. The channeldata is only
+    downloaded when a subdir has been modified and only the summary and
+    description of its packages are kept.
+
+    Up to ``max_workers`` subdirs are fetched concurrently through
+    ``session``, see ``http_session``. The duration of the fetch of each
+    subdir is returned under ``fetch_durations``.
     """
     subdirs = set(subdirs or [conda_platform(), "noarch"])
+    cache_headers = cache_headers or {}
+    session = session or http_session()
 
     channel_url = get_channel_url(channel)
 
-    headers = {}
-    if last_update:
-        # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/If-Modified-Since
-        # only download channeldata.json if it has been modified since
-        # last update to minimize bandwidth usage of channel updates
-        # most static web servers obey this header otherwise it will
-        # be ignored
-        headers["If-Modified-Since"] = last_update.strftime("%a, %d %b %Y %H:%M:%S GMT")
-
-    response = requests.get(channel_url / "channeldata.json", headers=headers)
-    if response.status_code == 304:  # 304 Not Modified since last_update
-        return {"architectures": {}}
-    response.raise_for_status()
-
-    repodata = response.json()
-    repodata["architectures"] = {}
-    for subdir in subdirs:
-        response = requests.get(
-            channel_url / subdir / "repodata.json.bz2", headers=headers
+    def fetch(subdir):
+        start = time.monotonic()
+        result = download_subdir_repodata(
+            channel_url / subdir,
+            os.path.join(directory, f"{subdir}-repodata.json"),
+            cache_headers.get(subdir),
+            session=session,
         )
-        if response.status_code == 304:  # 304 Not Modified since last_update
-            continue
-        response.raise_for_status()
-        repodata["architectures"][subdir] = json.loads(bz2.decompress(response.content))
+        duration = time.monotonic() - start
+        logger.info(
+            f"fetched {channel_url / subdir} in {duration:.2f}s "
+            f"({'modified' if result['modified'] else 'not modified'})"
+        )
+        return result, duration
+
+    repodata = {
+        "packages": {},
+        "architectures": {},
+        "removed": {},
+        "cache_headers": {},
+        "fetch_durations": {},
+    }
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for subdir, (result, duration) in zip(
+            sorted(subdirs), executor.map(fetch, sorted(subdirs)), strict=True
+        ):
+            repodata["cache_headers"][subdir] = result["cache_headers"]
+            repodata["fetch_durations"][subdir] = duration
+            if result["modified"]:
+                repodata["architectures"][subdir] = os.path.join(
+                    directory, f"{subdir}-repodata.json"
+                )
+                repodata["removed"][subdir] = result["removed"]
+
+    if not repodata["architectures"]:
+        return repodata
+
+    channeldata_filename = os.path.join(directory, "channeldata.json")
+    download_file(
+        channel_url / "channeldata.json", channeldata_filename, session=session
+    )
+    with open(channeldata_filename, encoding="utf-8") as f:
+        for name, package in iter_json_object(f, "packages"):
+            repodata["packages"][name] = {
+                "summary": package.get("summary"),
+                "description": package.get("description"),
+            }
+    os.remove(channeldata_filename)
     return repodata
 
 
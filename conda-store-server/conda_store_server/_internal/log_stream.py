@@ -0,0 +1,215 @@
+# Copyright (c) conda-store development team. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+"""Live tailing of build logs
+
+Workers publish every chunk written to a build log to a Redis stream,
+together with the byte offset of the chunk within the log. The server
+follows that stream so clients can watch a running build without
+re-downloading the stored log object. Without Redis, logs stored in
+``LocalStorage`` are tailed directly from disk.
+"""
+
+import asyncio
+import os
+import time
+import typing
+
+from starlette.concurrency import run_in_threadpool
+
+from conda_store_server import api, storage
+from conda_store_server._internal import schema
+
+
+def redis_stream_key(build_id: int) -> str:
+    return f"conda-store:build-logs:{build_id}"
+
+
+def redis_size_key(build_id: int) -> str:
+    return f"conda-store:build-logs-size:{build_id}"
+
+
+def publish_logs(conda_store, build_id: int, logs: bytes):
+    """Publish a chunk of a build log to the Redis stream of the build
+
+    Callers must serialize writes to the same build log, otherwise the
+    recorded offsets may not match the order of the stream entries
+    """
+    if conda_store.config.redis_url is None or not logs:
+        return
+
+    ttl = conda_store.config.build_logs_stream_ttl
+    end = conda_store.redis.incrby(redis_size_key(build_id), len(logs))
+
+    # Trimmed entries are still in the stored log, which readers fall back
+    # to for offsets before the start of the stream
+    pipeline = conda_store.redis.pipeline()
+    pipeline.xadd(
+        redis_stream_key(build_id),
+        {"offset": end - len(logs), "data": logs},
+        maxlen=conda_store.config.build_logs_stream_maxlen,
+        approximate=True,
+    )
+    pipeline.expire(redis_stream_key(build_id), ttl)
+    pipeline.expire(redis_size_key(build_id), ttl)
+    pipeline.execute()
+
+
+def expire_logs(conda_store, build_id: int):
+    """Shorten the lifetime of the Redis stream of a build which has finished
+
+    Followers only need the stream until they have caught up with the end
+    of the log, after which the stored log is the only copy needed
+    """
+    if conda_store.config.redis_url is None:
+        return
+
+    ttl = conda_store.config.build_logs_stream_completed_ttl
+    pipeline = conda_store.redis.pipeline()
+    pipeline.expire(redis_stream_key(build_id), ttl)
+    pipeline.expire(redis_size_key(build_id), ttl)
+    pipeline.execute()
+
+
+def can_follow_logs(conda_store) -> bool:
+    return conda_store.config.redis_url is not None or isinstance(
+        conda_store.storage, storage.LocalStorage
+    )
+
+
+class RedisLogReader:
+    def __init__(self, conda_store, build_id: int, log_key: str):
+        self.conda_store = conda_store
+        self.build_id = build_id
+        self.log_key = log_key
+        self.last_id = "0-0"
+
+    def _read_stored(self, start: int, end: int) -> bytes:
+        """Bytes ``start`` to ``end`` of the stored log
+
+        Appends may not be merged into the stored object yet, e.g. the
+        segments of S3Storage, in which case the log is compacted and read
+        again. Raises rather than skipping bytes the client never gets.
+        """
+        storage = self.conda_store.storage
+        for attempt in range(2):
+            if attempt:
+                storage.compact(self.log_key)
+            try:
+                chunk = b"".join(storage.get_stream(self.log_key, start, end))
+            except Exception:
+                # e.g. a range past the end of a stored object which is behind
+                chunk = b""
+            if len(chunk) == end - start:
+                return chunk
+        raise RuntimeError(
+            f"bytes {start} to {end} of the log of build {self.build_id} are missing"
+        )
+
+    def read(self, offset: int) -> bytes:
+        response = self.conda_store.redis.xread(
+            {redis_stream_key(self.build_id): self.last_id}, count=1000
+        )
+
+        chunks = []
+        for _, entries in response:
+            for entry_id, fields in entries:
+                self.last_id = entry_id
+                entry_offset = int(fields[b"offset"])
+                entry = fields[b"data"]
+
+                # The stream may start after the requested offset, e.g. for
+                # builds started before Redis was configured, in which case
+                # the missing range is read once from storage
+                if entry_offset > offset:
+                    chunks.append(self._read_stored(offset, entry_offset))
+                    offset = entry_offset
+
+                if entry_offset + len(entry) <= offset:
+                    continue
+                chunks.append(entry[offset - entry_offset :])
+                offset = entry_offset + len(entry)
+        return b"".join(chunks)
+
+    def read_remaining(self, offset: int) -> bytes:
+        chunk = self.read(offset)
+        if self.last_id != "0-0":
+            return chunk
+
+        # Nothing was ever published for this build, e.g. the stream has
+        # expired, so the stored log is the only source. Pending appends
+        # are merged first so the end of the log is not cut off
+        storage = self.conda_store.storage
+        try:
+            storage.compact(self.log_key)
+            return b"".join(storage.get_stream(self.log_key, offset))
+        except Exception as e:
+            self.conda_store.log.warning(
+                f"failed to read the log of build {self.build_id}", exc_info=e
+            )
+            return b""
+
+
+class LocalStorageLogReader:
+    def __init__(self, conda_store, build_id: int, log_key: str):
+        self.filename = os.path.join(conda_store.storage.storage_path, log_key)
+
+    def read(self, offset: int) -> bytes:
+        try:
+            with open(self.filename, "rb") as f:
+                f.seek(offset)
+                return f.read()
+        except FileNotFoundError:
+            return b""
+
+    def read_remaining(self, offset: int) -> bytes:
+        return self.read(offset)
+
+
+def _build_running(conda_store, build_id: int) -> bool:
+    with conda_store.get_db() as db:
+        status = api.get_build(db, build_id).status
+    return status in (schema.BuildStatus.QUEUED, schema.BuildStatus.BUILDING)
+
+
+async def follow_logs(
+    conda_store,
+    build_id: int,
+    log_key: str,
+    offset: int = 0,
+    poll_interval: float = 1.0,
+    status_interval: float = 10.0,
+) -> typing.AsyncIterator[bytes]:
+    """Yield the log of a build from ``offset`` until the build has finished
+
+    Reads from Redis, storage and the database are blocking so they are run
+    in the threadpool. The status of the build is checked at most every
+    ``status_interval`` seconds while no new output is available.
+    """
+    if conda_store.config.redis_url is not None:
+        reader = RedisLogReader(conda_store, build_id, log_key)
+    else:
+        reader = LocalStorageLogReader(conda_store, build_id, log_key)
+
+    # The first check happens as soon as the reader has caught up, so
+    # following a finished build returns right away
+    status_checked_on = time.monotonic() - status_interval
+    while True:
+        chunk = await run_in_threadpool(reader.read, offset)
+        if chunk:
+            offset += len(chunk)
+            yield chunk
+            continue
+
+        if time.monotonic() - status_checked_on >= status_interval:
+            running = await run_in_threadpool(_build_running, conda_store, build_id)
+            status_checked_on = time.monotonic()
+            if not running:
+                # Picks up anything written just before the status changed
+                chunk = await run_in_threadpool(reader.read_remaining, offset)
+                if chunk:
+                    yield chunk
+                return
+
+        await asyncio.sleep(poll_interval)
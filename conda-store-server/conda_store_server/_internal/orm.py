@@ -3,12 +3,15 @@
 # license that can be found in the LICENSE file.
 
 import datetime
+import io
+import itertools
 import json
 import logging
 import os
 import pathlib
 import shutil
 import sys
+import tempfile
 from functools import partial
 from typing import List
 
@@ -18,15 +21,22 @@ from sqlalchemy import (
     Boolean,
     Column,
     DateTime,
+    Float,
     ForeignKey,
+    Integer,
+    MetaData,
     Table,
     Text,
     Unicode,
     UnicodeText,
     UniqueConstraint,
-    and_,
     create_engine,
-    or_,
+    exists,
+    func,
+    literal,
+    select,
+    true,
+    update,
 )
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import (
@@ -267,6 +277,13 @@ class Build(Base):
     ended_on: Mapped[datetime.datetime] = mapped_column(DateTime, default=None)
     deleted_on: Mapped[datetime.datetime] = mapped_column(DateTime, default=None)
 
+    # Seconds spent in each stage of the build, e.g. {"lock": 12.3}
+    stage_durations: Mapped[dict] = mapped_column(JSON, default=None)
+
+    # Hash of the packages of the lockfile, builds with the same hash
+    # install identical environments
+    lockfile_hash: Mapped[str] = mapped_column(Unicode(64), default=None, index=True)
+
     # Only used by build_key_version 3, not necessary for earlier versions
     hash: Mapped[str] = mapped_column(Unicode(32), default=None)
 
@@ -446,6 +463,12 @@ class BuildArtifact(Base):
 
     __tablename__ = "build_artifact"
 
+    __table_args__ = (
+        UniqueConstraint(
+            "build_id", "key", "artifact_type", name="_build_key_artifact_type_uc"
+        ),
+    )
+
     id: Mapped[int] = mapped_column(primary_key=True)
 
     build_id: Mapped[int] = mapped_column(ForeignKey("build.id"))
@@ -456,6 +479,13 @@ class BuildArtifact(Base):
 
     key: Mapped[str] = mapped_column(Unicode(255))
 
+    # sha256 of the blob holding the content of content addressed artifacts,
+    # see Storage.content_addressed
+    digest: Mapped[str | None] = mapped_column(Unicode(64), index=True)
+
+    # compression of the stored artifact, see Storage.compression
+    content_encoding: Mapped[str | None] = mapped_column(Unicode(16))
+
 
 class Environment(Base):
     """Pointer to the current build and specification for a given
@@ -495,230 +525,319 @@ class CondaChannel(Base):
     name: Mapped[str] = mapped_column(Unicode(255), unique=True, nullable=False)
     last_update: Mapped[datetime.datetime] = mapped_column(DateTime)
 
-    def update_packages(self, db, subdirs=None):
+    def update_packages(
+        self,
+        db,
+        subdirs=None,
+        batch_size: int = 10000,
+        session=None,
+        max_workers: int = 4,
+    ):
         logger.info(f"update packages {self.name} ")
 
-        logger.info("Downloading repodata ...  ")
-        repodata = conda_utils.download_repodata(
-            self.name, self.last_update, subdirs=subdirs
-        )
-        logger.info("repodata downloaded ")
+        """
+        Context :
+           For each architecture, we need to add all the packages (`conda_package`),
+           and all their builds (`conda_package_build`), with their relationship.
+           As of May 2022, based on the default channels `main` and `conda-forge`,
+           there are 136K packages and 367K conda_package_build
+
+        Trick :
+           The repodata is decompressed to disk while it is downloaded and
+           the package records are parsed one at a time, so that memory
+           use is bounded by `batch_size` and not by the size of the
+           channel. Each batch is bulk loaded into a temporary staging
+           table (COPY on PostgreSQL, executemany elsewhere) and merged
+           with set-based INSERT ... SELECT statements, to get rid of the
+           overhead induced by the ORM layer and by per-row lookups.
+
+        Caveat :
+           bulk insertion is handy, but we need to avoid breaking integrity constraint,
+           This implies that we need to insert only new data. Rows already
+           in the DB are skipped with ON CONFLICT DO NOTHING (INSERT IGNORE
+           on MySQL) on the unique constraints of conda_package and
+           conda_package_build. Batches are committed one after the
+           other, so later batches see the rows inserted by earlier ones.
+        """
+        # the id of a newly created channel is needed by the inserted rows
+        db.flush()
 
-        # Hint : you can store the file locally for later debug
-        # with open(f"~/{self.name.split('/')[-1]}_{datetime.datetime.now()}.json", "w") as f:
-        #    f.write(json.dumps(repodata, indent=4, sort_keys=True))
+        channel_subdirs = {
+            channel_subdir.subdir: channel_subdir
+            for channel_subdir in db.query(CondaChannelSubdir).filter(
+                CondaChannelSubdir.channel_id == self.id
+            )
+        }
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            logger.info("Downloading repodata ...  ")
+            repodata = conda_utils.download_repodata(
+                self.name,
+                tmpdir,
+                subdirs=subdirs,
+                cache_headers={
+                    subdir: channel_subdir.cache_headers
+                    for subdir, channel_subdir in channel_subdirs.items()
+                },
+                session=session,
+                max_workers=max_workers,
+            )
+            logger.info("repodata downloaded ")
 
-        if not repodata:
-            # nothing to update
-            return
+            for architecture, filename in repodata["architectures"].items():
+                logger.info(f"architecture  : {architecture} ")
 
-        for architecture in repodata["architectures"]:
-            logger.info(f"architecture  : {architecture} ")
-
-            """
-            Context :
-               For each architecture, we need to add all the packages (`conda_package`),
-               and all their builds (`conda_package_build`), with their relationship.
-               As of May 2022, based on the default channels `main` and `conda-forge`,
-               there are 136K packages and 367K conda_package_build
-
-            Trick :
-               To insert these data fast, we need to get rid of the overhead induced
-               by the ORM layer, and use session.bulk_insert_mappings.
-
-            Caveat :
-               bulk insertion is handy, but we need to avoid breaking integrity constraint,
-               This implies that we need to bulk_insert only new data, filtering out
-               the data already in the DB
-
-            Algorithm :
-               First step :  we insert all the new conda_package rows
-               Second step : we insert all the new conda_package_builds rows
-
-               These steps are detailled below.
-            """
-
-            # package_data contains all the data for the iterated architecture.
-            # Each dict represents a conda_package_build and also contains
-            # thge data of the conda_package
-            packages_data = list(
-                repodata["architectures"][architecture]["packages"].values()
-            )
+                with open(filename, encoding="utf-8") as f:
+                    records = conda_utils.iter_json_object(f, "packages")
+                    while batch := list(itertools.islice(records, batch_size)):
+                        self._update_packages_batch(
+                            db, architecture, batch, repodata["packages"]
+                        )
+
+                # the decompressed repodata can be large, free the disk
+                # space as soon as it has been processed
+                os.remove(filename)
 
-            # First, we retrieve all the pairs "package name - pacakge version"
-            # in the DB. This represents all the existing packages.
-            existing_packages_keys = [
-                f"{_[0]}-{_[1]}-{self.id}"
-                for _ in db.query(CondaPackage.name, CondaPackage.version)
-                .filter(CondaPackage.channel_id == self.id)
-                .all()
-            ]
-
-            # Then, we filter packages_data to keep only the new packages.
-
-            # `packages` associates a key representing the package like "{name}-{version}-{channel_id}"
-            # to a dict representing a new package to insert.
-            # By using a dict with such key, we avoid potential duplicates from within the repodata.
-            packages = {}
-
-            for p_build in packages_data:
-                package_key = f"{p_build['name']}-{p_build['version']}-{self.id}"
-
-                # Filtering out : if the key already exists in existing_packages_keys,
-                # then the package is already if DB, we don't add it.
-                if (
-                    package_key not in packages
-                    and package_key not in existing_packages_keys
-                ):
-                    new_package_dict = {
-                        "channel_id": self.id,
-                        "license": p_build.get("license"),
-                        "license_family": p_build.get("license_family"),
-                        "name": p_build["name"],
-                        "version": p_build["version"],
-                        "summary": repodata.get("packages", {})
-                        .get(p_build["name"], {})
-                        .get("summary"),
-                        "description": repodata.get("packages", {})
-                        .get(p_build["name"], {})
-                        .get("description"),
-                    }
-
-                    packages[package_key] = new_package_dict
-
-            logger.info(f"packages to insert : {len(packages)} ")
-
-            try:
-                db.bulk_insert_mappings(CondaPackage, packages.values())
+                self._remove_package_builds(
+                    db, architecture, repodata["removed"][architecture]
+                )
+
+                # only remember the cache headers once the repodata has been
+                # ingested, so that a failed update is retried in full
+                self._update_channel_subdir(db, channel_subdirs, architecture, repodata)
                 db.commit()
-            except Exception as e:
-                print(f"{e}")
-                db.rollback()
-                raise e
-
-            logger.info("insert packages done")
-
-            logger.info("retrieving existing sha256  : ")
-            existing_sha256 = {
-                _[0]
-                for _ in db.query(CondaPackageBuild.sha256)
-                .join(CondaPackageBuild.package)
-                .filter(CondaPackage.channel_id == self.id)
-                .filter(CondaPackageBuild.subdir == architecture)
-                .all()
+                logger.info(f"DONE for architecture  : {architecture}")
+
+        # unmodified subdirs may have new cache headers too, e.g. when the
+        # channel has stopped providing jlap
+        for subdir in repodata["cache_headers"]:
+            if subdir not in repodata["architectures"]:
+                self._update_channel_subdir(db, channel_subdirs, subdir, repodata)
+
+        self.last_update = datetime.datetime.utcnow()
+        db.commit()
+        logger.info("update packages DONE ")
+
+    def _update_channel_subdir(self, db, channel_subdirs, subdir, repodata):
+        if subdir not in channel_subdirs:
+            channel_subdirs[subdir] = CondaChannelSubdir(
+                channel_id=self.id, subdir=subdir
+            )
+            db.add(channel_subdirs[subdir])
+        channel_subdir = channel_subdirs[subdir]
+        channel_subdir.cache_headers = repodata["cache_headers"][subdir]
+        channel_subdir.fetch_duration = repodata["fetch_durations"][subdir]
+        channel_subdir.fetched_on = datetime.datetime.utcnow()
+
+    def _remove_package_builds(self, db, architecture, filenames):
+        """Remove the package builds of package records removed from the channel
+
+        Package builds are matched on their filename, so that removing one
+        format of a package build, e.g. foo-1.0-h0.tar.bz2, keeps the other
+        one, e.g. foo-1.0-h0.conda. Package builds which are part of a
+        build or a solve are kept, since removing them would change the
+        packages of existing environments.
+        """
+        # imported here since api depends on this module
+        from conda_store_server import api
+
+        for batch in api._batched(sorted(filenames)):
+            db.query(CondaPackageBuild).filter(
+                CondaPackageBuild.channel_id == self.id,
+                CondaPackageBuild.subdir == architecture,
+                CondaPackageBuild.filename.in_(batch),
+                ~exists().where(
+                    build_conda_package.c.conda_package_build_id == CondaPackageBuild.id
+                ),
+                ~exists().where(
+                    solve_conda_package_build.c.conda_package_build_id
+                    == CondaPackageBuild.id
+                ),
+            ).delete(synchronize_session=False)
+        logger.info(f"package records removed : {len(filenames)} ")
+
+    def _update_packages_batch(self, db, architecture, records, channeldata):
+        """Insert the new packages and package builds of a batch of
+        (filename, package record) pairs
+
+        The records are bulk loaded into a temporary staging table, see
+        `_load_conda_package_staging`, from which the packages and the
+        package builds are inserted with one INSERT ... SELECT each. Rows
+        which are already in the DB are skipped by the unique constraints
+        of the tables, so no lookup of existing rows is needed.
+        """
+        # imported here since api depends on this module
+        from conda_store_server import api
+
+        # any duplicated sha256 from the repodata is erased by using it as key
+        non_null_keys = ["build", "build_number", "depends", "md5", "sha256", "size"]
+        rows = {}
+        for filename, p_build in records:
+            if any(p_build.get(k) is None for k in non_null_keys):
+                continue
+
+            channeldata_package = channeldata.get(p_build["name"], {})
+            rows[p_build["sha256"]] = {
+                "name": p_build["name"],
+                "version": p_build["version"],
+                "license": p_build.get("license"),
+                "license_family": p_build.get("license_family"),
+                "summary": channeldata_package.get("summary"),
+                "description": channeldata_package.get("description"),
+                "build": p_build["build"],
+                "build_number": p_build["build_number"],
+                "constrains": p_build.get("constrains"),
+                "depends": p_build["depends"] or "",
+                "md5": p_build["md5"],
+                "sha256": p_build["sha256"],
+                "size": p_build["size"],
+                "subdir": p_build.get("subdir"),
+                "timestamp": p_build.get("timestamp"),
+                "filename": filename,
             }
-            logger.info("retrieved existing sha256  : ")
-            logger.info(f"package data before filtering  : {len(packages_data)} ")
-
-            # We store the package builds in a dict indexed by their sha256
-            # Later, we keep only the values.
-            # That way, any duplicated sha256 from the repodata is erased
-            # Also, we exclude pacakge_builds for which the sha256 is already in the DB
-            packages_builds = {}
-            for pb in packages_data:
-                if pb["sha256"] not in existing_sha256:
-                    packages_builds[pb["sha256"]] = pb
-
-            packages_builds = packages_builds.values()
-            logger.info(f"package builds after filtering : {len(packages_builds)} ")
-
-            # This associates a tuple like "(name,version)" representing a package
-            # to all its builds
-            package_builds = {}
-            logger.info("Creating CondaPackageBuild objects")
-            for p_build in packages_builds:
-                has_null = False
-                non_null_keys = [
-                    "build",
-                    "build_number",
-                    "depends",
-                    "md5",
-                    "sha256",
-                    "size",
-                ]
-                for k in non_null_keys:
-                    if p_build[k] is None:
-                        has_null = True
-                        break
-                if has_null:
-                    continue
-
-                if p_build["depends"] == []:
-                    p_build["depends"] = ""
-
-                package_key = (p_build["name"], p_build["version"])
-
-                new_package_build_dict = {
-                    "build": p_build["build"],
-                    "build_number": p_build["build_number"],
-                    "channel_id": self.id,
-                    "constrains": p_build.get("constrains"),
-                    "depends": p_build["depends"],
-                    "md5": p_build["md5"],
-                    "sha256": p_build["sha256"],
-                    "size": p_build["size"],
-                    "subdir": p_build.get("subdir"),
-                    "timestamp": p_build.get("timestamp"),
-                }
-
-                if package_key not in package_builds:
-                    package_builds[package_key] = []
-
-                package_builds[package_key].append(new_package_build_dict)
-            logger.info("CondaPackageBuild objects created")
-
-            # sqlite3 has a max expression depth of 1000
-            batch_size = 990
-            all_package_keys = list(package_builds.keys())
-            for i in range(0, len(all_package_keys), batch_size):
-                logger.info(f"handling subset at index {i} (batch size {batch_size})")
-                subset_keys = all_package_keys[i : i + batch_size]
-
-                # retrieve the parent packages for the subset
-                logger.info("retrieve the parent packages for the subset ")
-                statements = []
-                for p_name, p_version in subset_keys:
-                    statements.append(
-                        and_(
-                            CondaPackage.name == p_name,
-                            CondaPackage.version == p_version,
-                            CondaPackage.channel_id == self.id,
-                        )
+        if not rows:
+            return
+
+        staging = conda_package_staging
+        try:
+            connection = db.connection()
+            # a staging table left over by a failed batch is not always
+            # dropped by the rollback, e.g. DDL is not transactional on MySQL
+            staging.drop(connection, checkfirst=True)
+            staging.create(connection)
+            _load_conda_package_staging(connection, list(rows.values()))
+
+            # SQLite needs a WHERE clause to parse INSERT ... SELECT ... ON CONFLICT
+            result = db.execute(
+                api._insert_or_ignore(db, CondaPackage.__table__).from_select(
+                    [
+                        "channel_id",
+                        "name",
+                        "version",
+                        "license",
+                        "license_family",
+                        "summary",
+                        "description",
+                    ],
+                    select(
+                        literal(self.id, Integer),
+                        staging.c.name,
+                        staging.c.version,
+                        func.min(staging.c.license),
+                        func.min(staging.c.license_family),
+                        func.min(staging.c.summary),
+                        func.min(staging.c.description),
                     )
-                all_parent_packages = (
-                    db.query(CondaPackage).filter(or_(*statements)).all()
+                    .where(true())
+                    .group_by(staging.c.name, staging.c.version),
+                )
+            )
+            logger.info(f"packages inserted : {result.rowcount} ")
+
+            result = db.execute(
+                api._insert_or_ignore(db, CondaPackageBuild.__table__).from_select(
+                    [
+                        "package_id",
+                        "channel_id",
+                        "build",
+                        "build_number",
+                        "constrains",
+                        "depends",
+                        "md5",
+                        "sha256",
+                        "size",
+                        "subdir",
+                        "timestamp",
+                        "filename",
+                    ],
+                    select(
+                        CondaPackage.id,
+                        literal(self.id, Integer),
+                        staging.c.build,
+                        staging.c.build_number,
+                        staging.c.constrains,
+                        staging.c.depends,
+                        staging.c.md5,
+                        staging.c.sha256,
+                        staging.c.size,
+                        staging.c.subdir,
+                        staging.c.timestamp,
+                        staging.c.filename,
+                    ).where(
+                        CondaPackage.channel_id == self.id,
+                        CondaPackage.name == staging.c.name,
+                        CondaPackage.version == staging.c.version,
+                    ),
+                )
+            )
+            logger.info(f"package builds inserted : {result.rowcount} ")
+
+            # package builds indexed before their filename was recorded, or
+            # registered from a lockfile, get it from the matching record
+            package_build = CondaPackageBuild.__table__
+            db.execute(
+                update(package_build)
+                .where(
+                    package_build.c.channel_id == self.id,
+                    package_build.c.subdir == architecture,
+                    package_build.c.filename.is_(None),
+                    package_build.c.sha256 == staging.c.sha256,
                 )
-                all_parent_packages = {
-                    (_.name, _.version): _ for _ in all_parent_packages
-                }
-                logger.info(f"parent packages retrieved : {len(all_parent_packages)} ")
+                .values(filename=staging.c.filename)
+            )
 
-                for p_name, p_version in subset_keys:
-                    for p_build_dict in package_builds[(p_name, p_version)]:
-                        p_build_dict["package_id"] = all_parent_packages[
-                            (p_name, p_version)
-                        ].id
+            staging.drop(connection)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
 
-                logger.info("ready to bulk save")
 
-            try:
-                flatten = []
-                for p_name, p_version in package_builds:
-                    flatten += package_builds[(p_name, p_version)]
+class CondaChannelSubdir(Base):
+    """Cache headers and version of the last download of the repodata of a
+    channel subdir
+    """
 
-                db.bulk_insert_mappings(CondaPackageBuild, flatten)
-                db.commit()
-                logger.info("bulk saved")
-            except Exception as e:
-                logger.error(f"{e}")
+    __tablename__ = "conda_channel_subdir"
 
-                raise e
+    __table_args__ = (
+        UniqueConstraint("channel_id", "subdir", name="_channel_subdir_uc"),
+    )
 
-            logger.info(f"DONE for architecture  : {architecture}")
+    id: Mapped[int] = mapped_column(primary_key=True)
 
-        self.last_update = datetime.datetime.utcnow()
-        db.commit()
-        logger.info("update packages DONE ")
+    channel_id: Mapped[int] = mapped_column(ForeignKey("conda_channel.id"))
+    channel: Mapped["CondaChannel"] = relationship(CondaChannel)
+
+    subdir: Mapped[str] = mapped_column(Unicode(64), nullable=False)
+
+    # variant of the repodata which was downloaded, e.g. repodata.json.zst
+    filename: Mapped[str | None] = mapped_column(Unicode(64))
+    etag: Mapped[str | None] = mapped_column(Unicode(255))
+    last_modified: Mapped[str | None] = mapped_column(Unicode(64))
+    # version of the ingested repodata.json, the blake2b hash identifying
+    # it in jlap patches
+    repodata_hash: Mapped[str | None] = mapped_column(Unicode(64))
+
+    # duration in seconds and time of the last fetch, exposed as metrics
+    fetch_duration: Mapped[float | None]
+    fetched_on: Mapped[datetime.datetime | None] = mapped_column(DateTime)
+
+    @property
+    def cache_headers(self):
+        return {
+            "filename": self.filename,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "repodata_hash": self.repodata_hash,
+        }
+
+    @cache_headers.setter
+    def cache_headers(self, cache_headers):
+        self.filename = cache_headers.get("filename")
+        self.etag = cache_headers.get("etag")
+        self.last_modified = cache_headers.get("last_modified")
+        self.repodata_hash = cache_headers.get("repodata_hash")
 
 
 class CondaPackage(Base):
@@ -790,11 +909,123 @@ class CondaPackageBuild(Base):
     size: Mapped[int] = mapped_column(BigInteger)
     subdir: Mapped[str] = mapped_column(Unicode(64))
     timestamp: Mapped[int] = mapped_column(BigInteger)
+    # filename of the record in the repodata of the channel, e.g.
+    # foo-1.0-h0.tar.bz2, which tells apart the formats of a package build
+    filename: Mapped[str | None] = mapped_column(Unicode(255))
 
     def __repr__(self):
         return f"<CondaPackageBuild (id={self.id} build={self.build} size={self.size} sha256={self.sha256})>"
 
 
+# Temporary table into which a batch of repodata records is bulk loaded
+# before being merged into conda_package and conda_package_build, see
+# CondaChannel.update_packages. It is not part of Base.metadata, so it is
+# neither created with the other tables nor tracked by the migrations.
+conda_package_staging = Table(
+    "conda_package_staging",
+    MetaData(),
+    Column("name", Unicode(255), nullable=False),
+    Column("version", Unicode(64), nullable=False),
+    Column("license", Text),
+    Column("license_family", Unicode(64)),
+    Column("summary", Text),
+    Column("description", Text),
+    Column("build", Unicode(64)),
+    Column("build_number", Integer),
+    Column("constrains", JSON),
+    Column("depends", JSON),
+    Column("md5", Unicode(255)),
+    Column("sha256", Unicode(64), index=True),
+    Column("size", BigInteger),
+    Column("subdir", Unicode(64)),
+    Column("timestamp", BigInteger),
+    Column("filename", Unicode(255)),
+    prefixes=["TEMPORARY"],
+)
+
+_STAGING_JSON_COLUMNS = {"constrains", "depends"}
+
+
+def _copy_value(column, value):
+    """Value of a column in the text format of PostgreSQL COPY"""
+    if column in _STAGING_JSON_COLUMNS:
+        value = json.dumps(value)
+    elif value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _load_conda_package_staging(connection, rows):
+    """Bulk load rows into conda_package_staging
+
+    PostgreSQL loads the rows with a single COPY, other databases with an
+    executemany of INSERT.
+    """
+    if (
+        connection.dialect.name == "postgresql"
+        and connection.dialect.driver == "psycopg2"
+    ):
+        columns = [column.name for column in conda_package_staging.columns]
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write("\t".join(_copy_value(c, row[c]) for c in columns) + "\n")
+        buffer.seek(0)
+
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {conda_package_staging.name} ({', '.join(columns)}) FROM STDIN",
+                buffer,
+            )
+        finally:
+            cursor.close()
+    else:
+        connection.execute(conda_package_staging.insert(), rows)
+
+
+class SolveCache(Base):
+    """Lockfiles of previous solves keyed by the inputs of the solve"""
+
+    __tablename__ = "solve_cache"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    key: Mapped[str] = mapped_column(Unicode(64), unique=True, nullable=False)
+    lockfile: Mapped[dict] = mapped_column(JSON, nullable=False)
+    created_on: Mapped[datetime.datetime] = mapped_column(
+        DateTime, default=datetime.datetime.utcnow
+    )
+    last_used_on: Mapped[datetime.datetime] = mapped_column(
+        DateTime, default=datetime.datetime.utcnow, index=True
+    )
+
+
+class BuildStageDurationBucket(Base):
+    """Running histogram of the duration of each build stage
+
+    Each row counts the stages whose duration falls in the bucket with
+    upper bound ``le``, in seconds, and is not cumulative unlike
+    Prometheus buckets. The worker updates the row of a stage when it
+    completes, see ``api.observe_build_stage_duration``.
+    """
+
+    __tablename__ = "build_stage_duration_bucket"
+
+    __table_args__ = (UniqueConstraint("stage", "le", name="_stage_le_uc"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    stage: Mapped[str] = mapped_column(Unicode(64), nullable=False)
+    # Prometheus label of the upper bound, e.g. "60" or "+Inf"
+    le: Mapped[str] = mapped_column(Unicode(16), nullable=False)
+    count: Mapped[int] = mapped_column(BigInteger, default=0, nullable=False)
+    sum: Mapped[float] = mapped_column(Float, default=0.0, nullable=False)
+
+
 class CondaStoreConfiguration(Base):
     __tablename__ = "conda_store_configuration"
 
@@ -804,6 +1035,9 @@ class CondaStoreConfiguration(Base):
     free_storage: Mapped[int] = mapped_column(BigInteger, default=0)
     total_storage: Mapped[int] = mapped_column(BigInteger, default=0)
 
+    solve_cache_hits: Mapped[int] = mapped_column(BigInteger, default=0)
+    solve_cache_misses: Mapped[int] = mapped_column(BigInteger, default=0)
+
     @classmethod
     def configuration(cls, db):
         query = db.query(cls).filter(cls.id == 1)
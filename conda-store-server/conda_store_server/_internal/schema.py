@@ -125,6 +125,8 @@ class BuildArtifact(BaseModel):
     id: int
     artifact_type: BuildArtifactType
     key: str
+    digest: str | None = None
+    content_encoding: str | None = None
     model_config = ConfigDict(from_attributes=True, use_enum_values=True)
 
 
@@ -139,6 +141,7 @@ class Build(BaseModel):
     scheduled_on: datetime.datetime
     started_on: datetime.datetime | None = None
     ended_on: datetime.datetime | None = None
+    stage_durations: Dict[str, float] | None = None
     build_artifacts: List[BuildArtifact] | None = None
     model_config = ConfigDict(from_attributes=True, use_enum_values=True)
 
@@ -40,6 +40,20 @@ from conda_store_server.conda_store_config import CondaStore as CondaStoreConfig
 from conda_store_server.server import auth
 
 
+class StorageStaticFiles(StaticFiles):
+    """Serves the artifacts of LocalStorage
+
+    Hidden files and directories hold artifacts which are still being
+    written, see LocalStorage.temporary_directory and LocalStorage._publish,
+    and are never served
+    """
+
+    def lookup_path(self, path):
+        if any(part.startswith(".") for part in path.replace("\\", "/").split("/")):
+            return "", None
+        return super().lookup_path(path)
+
+
 class _Color(str, Enum):
     GREEN = "\x1b[32m"
     RED = "\x1b[31m"
@@ -181,6 +195,12 @@ class CondaStoreServer(Application):
         config=True,
     )
 
+    proxy_artifact_downloads = Bool(
+        False,
+        help="Stream build archives and installers through the server, with support for HTTP Range requests, instead of redirecting clients to the storage url. Use when clients cannot reach the storage backend directly, e.g. presigned S3 urls are not allowed",
+        config=True,
+    )
+
     max_page_size = Integer(
         100, help="maximum number of items to return in a single page", config=True
     )
@@ -308,7 +328,7 @@ class CondaStoreServer(Application):
             )
             app.mount(
                 self.conda_store.storage.storage_url,
-                StaticFiles(directory=self.conda_store.storage.storage_path),
+                StorageStaticFiles(directory=self.conda_store.storage.storage_path),
                 name="static-storage",
             )
 
@@ -0,0 +1,167 @@
+# Copyright (c) conda-store development team. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+"""Downloads of build artifacts
+
+Artifacts are served by redirecting to ``Storage.get_url``, by asking a
+fronting web server to send the file, or proxied through the server when
+clients cannot reach the storage backend. Proxied downloads support single
+byte ranges so large archives and installers can be resumed.
+"""
+
+import posixpath
+import re
+from typing import Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
+
+from conda_store_server import storage
+
+RANGE_REGEX = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header: str | None, size: int) -> Tuple[int, int] | None:
+    """Parse a ``Range`` header into an inclusive ``(start, end)`` tuple
+
+    Returns None when the whole object should be sent: no header, a header
+    that is not a single byte range, or multiple ranges, which are allowed
+    to be ignored by RFC 9110. Raises ValueError for unsatisfiable ranges.
+    """
+    if header is None:
+        return None
+
+    match = RANGE_REGEX.match(header.strip())
+    if match is None:
+        return None
+
+    first, last = match.groups()
+    if first == "" and last == "":
+        return None
+
+    if first == "":
+        # suffix range, the last n bytes of the object
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise ValueError(f"unsatisfiable range {header}")
+        return max(size - suffix, 0), size - 1
+
+    start = int(first)
+    end = size - 1 if last == "" else min(int(last), size - 1)
+    if start >= size or start > end:
+        raise ValueError(f"unsatisfiable range {header}")
+    return start, end
+
+
+def redirect_response(
+    artifact_storage: storage.Storage, key: str, filename: str | None = None
+) -> Response:
+    """Hand the download of the artifact stored at ``key`` to the storage
+    backend or to a fronting web server
+    """
+    headers = artifact_storage.get_sendfile_headers(key)
+    if headers:
+        if filename is not None:
+            headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return Response(headers=headers)
+    return RedirectResponse(artifact_storage.get_url(key))
+
+
+def accepts_encoding(request: Request, encoding: str) -> bool:
+    """Whether the ``Accept-Encoding`` header lists ``encoding`` with a
+    non-zero quality value
+    """
+    for accepted in request.headers.get("accept-encoding", "").split(","):
+        name, *params = accepted.split(";")
+        if name.strip().lower() != encoding:
+            continue
+
+        quality = 1.0
+        for param in params:
+            param_name, _, value = param.strip().partition("=")
+            if param_name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        return quality > 0
+    return False
+
+
+def text_artifact_response(
+    request: Request,
+    db,
+    artifact_storage: storage.Storage,
+    key: str,
+    media_type: str,
+) -> Response:
+    """Serve the lockfile or environment export stored at ``key``
+
+    Compressed artifacts are sent as is, with a ``Content-Encoding``, to
+    clients accepting the encoding and decompressed for other clients.
+    """
+    object_key = artifact_storage.resolve_key(db, key)
+    content_encoding = artifact_storage.get_content_encoding(db, key)
+    if content_encoding is None:
+        return redirect_response(artifact_storage, object_key)
+
+    try:
+        value = artifact_storage.get(object_key)
+    except Exception:
+        raise HTTPException(status_code=404, detail=f"artifact {key} does not exist")
+
+    headers = {"Vary": "Accept-Encoding"}
+    if accepts_encoding(request, content_encoding):
+        headers["Content-Encoding"] = content_encoding
+    else:
+        value = storage.decompress(value, content_encoding)
+    return Response(value, media_type=media_type, headers=headers)
+
+
+def artifact_response(
+    request: Request,
+    artifact_storage: storage.Storage,
+    key: str,
+    media_type: str,
+    filename: str | None = None,
+) -> Response:
+    """Stream the artifact stored at ``key``, honoring the ``Range`` header
+
+    ``filename`` defaults to the basename of ``key``, which is not
+    meaningful for content addressed blobs
+    """
+    try:
+        size = artifact_storage.get_size(key)
+    except Exception:
+        raise HTTPException(status_code=404, detail=f"artifact {key} does not exist")
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'attachment; filename="{filename or posixpath.basename(key)}"',
+    }
+
+    try:
+        byte_range = parse_range(request.headers.get("range"), size)
+    except ValueError:
+        return Response(
+            status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"}
+        )
+
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(
+            artifact_storage.get_stream(key),
+            media_type=media_type,
+            headers=headers,
+        )
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        artifact_storage.get_stream(key, start=start, end=end + 1),
+        status_code=206,
+        media_type=media_type,
+        headers=headers,
+    )
@@ -3,6 +3,7 @@
 # license that can be found in the LICENSE file.
 
 import datetime
+import posixpath
 from functools import wraps
 from typing import Any, Callable, Dict, List
 
@@ -10,12 +11,16 @@ import pydantic
 import yaml
 from celery.result import AsyncResult
 from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request
-from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse
+from fastapi.responses import (
+    JSONResponse,
+    PlainTextResponse,
+    StreamingResponse,
+)
 
 from conda_store_server import __version__, api
-from conda_store_server._internal import orm, schema
+from conda_store_server._internal import log_stream, orm, schema
 from conda_store_server._internal.environment import filter_environments
-from conda_store_server._internal.server import dependencies
+from conda_store_server._internal.server import dependencies, downloads
 from conda_store_server.conda_store import CondaStore
 from conda_store_server.exception import CondaStoreError
 from conda_store_server.server import schema as auth_schema
@@ -1206,7 +1211,50 @@ async def api_get_build_logs(
             require=True,
         )
 
-        return RedirectResponse(conda_store.storage.get_url(build.log_key))
+        return downloads.redirect_response(conda_store.storage, build.log_key)
+
+
+@router_api.get("/build/{build_id}/logs/stream/")
+async def api_get_build_logs_stream(
+    build_id: int,
+    request: Request,
+    offset: int = Query(0, ge=0),
+    conda_store=Depends(dependencies.get_conda_store),
+    auth=Depends(dependencies.get_auth),
+):
+    """Follow the logs of a build starting at byte ``offset``
+
+    The response is streamed until the build has finished. Clients that
+    get disconnected can resume by passing the number of bytes received
+    so far as the offset.
+    """
+    with conda_store.get_db() as db:
+        build = api.get_build(db, build_id)
+        if build is None:
+            raise HTTPException(status_code=404, detail="build id does not exist")
+
+        auth.authorize_request(
+            request,
+            f"{build.environment.namespace.name}/{build.environment.name}",
+            {Permissions.ENVIRONMENT_READ},
+            require=True,
+        )
+
+        if not log_stream.can_follow_logs(conda_store):
+            raise HTTPException(
+                status_code=409,
+                detail=(
+                    "following build logs requires redis or local storage. "
+                    "Use /api/v1/build/{build_id}/logs/ instead"
+                ),
+            )
+
+        log_key = build.log_key
+
+    return StreamingResponse(
+        log_stream.follow_logs(conda_store, build_id, log_key, offset=offset),
+        media_type="text/plain",
+    )
 
 
 @router_api.get(
@@ -1286,7 +1334,9 @@ async def api_get_build_yaml(
             {Permissions.ENVIRONMENT_READ},
             require=True,
         )
-        return RedirectResponse(conda_store.storage.get_url(build.conda_env_export_key))
+        return downloads.text_artifact_response(
+            request, db, conda_store.storage, build.conda_env_export_key, "text/yaml"
+        )
 
 
 @router_api.get(
@@ -1350,7 +1400,9 @@ async def api_get_build_lockfile(
         if any(ba.key == "" for ba in build_artifacts):
             return api.get_build_lockfile_legacy(db, build_id)
 
-        return RedirectResponse(conda_store.storage.get_url(build.conda_lock_key))
+        return downloads.text_artifact_response(
+            request, db, conda_store.storage, build.conda_lock_key, "application/json"
+        )
 
 
 @router_api.get("/build/{build_id}/archive/")
@@ -1358,6 +1410,7 @@ async def api_get_build_archive(
     build_id: int,
     request: Request,
     conda_store=Depends(dependencies.get_conda_store),
+    server=Depends(dependencies.get_server),
     auth=Depends(dependencies.get_auth),
 ):
     with conda_store.get_db() as db:
@@ -1368,8 +1421,28 @@ async def api_get_build_archive(
             {Permissions.ENVIRONMENT_READ},
             require=True,
         )
-
-        return RedirectResponse(conda_store.storage.get_url(build.conda_pack_key))
+        # a build deduplicated from a build with an identical lockfile
+        # shares the archive of that build, see copy_build_references
+        build_artifact = api.list_build_artifacts(
+            db,
+            build_id=build.id,
+            included_artifact_types=[schema.BuildArtifactType.CONDA_PACK],
+        ).first()
+        key = build.conda_pack_key if build_artifact is None else build_artifact.key
+        conda_pack_key = conda_store.storage.resolve_key(db, key)
+        filename = posixpath.basename(build.conda_pack_key)
+
+    if server.proxy_artifact_downloads:
+        return downloads.artifact_response(
+            request,
+            conda_store.storage,
+            conda_pack_key,
+            "application/gzip",
+            filename=filename,
+        )
+    return downloads.redirect_response(
+        conda_store.storage, conda_pack_key, filename=filename
+    )
 
 
 @router_api.get("/build/{build_id}/docker/", deprecated=True)
@@ -1410,6 +1483,7 @@ async def api_get_build_installer(
     build_id: int,
     request: Request,
     conda_store=Depends(dependencies.get_conda_store),
+    server=Depends(dependencies.get_server),
     auth=Depends(dependencies.get_auth),
 ):
     with conda_store.get_db() as db:
@@ -1422,8 +1496,21 @@ async def api_get_build_installer(
         )
 
         if build.has_constructor_installer:
-            return RedirectResponse(
-                conda_store.storage.get_url(build.constructor_installer_key)
+            installer_key = conda_store.storage.resolve_key(
+                db, build.constructor_installer_key
+            )
+            if server.proxy_artifact_downloads:
+                return downloads.artifact_response(
+                    request,
+                    conda_store.storage,
+                    installer_key,
+                    "application/octet-stream",
+                    filename=posixpath.basename(build.constructor_installer_key),
+                )
+            return downloads.redirect_response(
+                conda_store.storage,
+                installer_key,
+                filename=posixpath.basename(build.constructor_installer_key),
             )
 
         else:
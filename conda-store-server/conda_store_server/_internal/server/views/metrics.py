@@ -2,6 +2,8 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import datetime
+
 from fastapi import APIRouter, Depends
 from fastapi.responses import PlainTextResponse
 
@@ -17,7 +19,30 @@ async def prometheus_metrics(
 ):
     with conda_store.get_db() as db:
         metrics = api.get_metrics(db)
-        return "\n".join(f"conda_store_{key} {value}" for key, value in metrics.items())
+        histograms = api.get_build_stage_duration_histograms(db)
+        channel_fetches = api.get_channel_fetch_metrics(db)
+
+    lines = [f"conda_store_{key} {value}" for key, value in metrics.items()]
+
+    name = "conda_store_build_stage_duration_seconds"
+    lines.append(f"# TYPE {name} histogram")
+    for stage, histogram in sorted(histograms.items()):
+        for le, count in histogram["buckets"].items():
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {count}')
+        lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {histogram["sum"]}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {histogram["count"]}')
+
+    duration_name = "conda_store_channel_fetch_duration_seconds"
+    timestamp_name = "conda_store_channel_fetch_timestamp_seconds"
+    lines.append(f"# TYPE {duration_name} gauge")
+    lines.append(f"# TYPE {timestamp_name} gauge")
+    for channel, subdir, duration, fetched_on in channel_fetches:
+        labels = f'channel="{channel}",subdir="{subdir}"'
+        lines.append(f"{duration_name}{{{labels}}} {duration}")
+        timestamp = fetched_on.replace(tzinfo=datetime.timezone.utc).timestamp()
+        lines.append(f"{timestamp_name}{{{labels}}} {timestamp}")
+    return "\n".join(lines)
 
 
 @router_metrics.get("/celery")
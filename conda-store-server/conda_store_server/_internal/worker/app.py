@@ -106,4 +106,5 @@ class CondaStoreWorker(Application):
             argv.append(f"--concurrency={self.concurrency}")
 
         self.conda_store.ensure_directories()
+        self.conda_store.ensure_pkgs_dir()
         self.conda_store.celery_app.worker_main(argv)
@@ -3,12 +3,16 @@
 # license that can be found in the LICENSE file.
 
 import collections
+import contextlib
 import datetime
 import json
+import os
 import pathlib
 import re
+import shutil
 import subprocess
 import tempfile
+import time
 import traceback
 import typing
 
@@ -17,19 +21,37 @@ from filelock import FileLock
 from sqlalchemy.orm import Session
 
 from conda_store_server import api
-from conda_store_server._internal import action, conda_utils, orm, schema, utils
+from conda_store_server._internal import (
+    action,
+    conda_utils,
+    log_stream,
+    orm,
+    schema,
+    utils,
+)
 from conda_store_server.exception import BuildPathError
 from conda_store_server.plugins import plugin_context
 
 
 class LoggedStream:
-    """Allows writing to storage via logging.StreamHandler"""
+    """Allows writing to storage via logging.StreamHandler
+
+    Lines are buffered and appended to the build log once the buffer holds
+    ``CondaStore.build_logs_buffer_size`` bytes or its oldest line is
+    ``CondaStore.build_logs_flush_interval`` seconds old. ``flush`` and
+    ``close`` append whatever is buffered.
+    """
 
     def __init__(self, db, conda_store, build, prefix=None):
         self.db = db
         self.conda_store = conda_store
         self.build = build
         self.prefix = prefix
+        self.buffer_size = conda_store.config.build_logs_buffer_size
+        self.flush_interval = conda_store.config.build_logs_flush_interval
+        self._lines = []
+        self._size = 0
+        self._buffered_since = None
 
     def write(self, b, /):
         for line in b.split("\n"):
@@ -38,39 +60,90 @@ class LoggedStream:
                 continue
             if self.prefix is not None:
                 line = self.prefix + line
-            append_to_logs(self.db, self.conda_store, self.build, line + "\n")
+            self._lines.append(line + "\n")
+            self._size += len(line) + 1
+
+        if not self._lines:
+            return
+        now = time.monotonic()
+        if self._buffered_since is None:
+            self._buffered_since = now
+        if (
+            self._size >= self.buffer_size
+            or now - self._buffered_since >= self.flush_interval
+        ):
+            self.flush()
 
     def flush(self):
-        pass
+        if not self._lines:
+            return
+        logs = "".join(self._lines)
+        self._lines = []
+        self._size = 0
+        self._buffered_since = None
+        append_to_logs(self.db, self.conda_store, self.build, logs)
 
+    def close(self):
+        self.flush()
 
-def append_to_logs(db: Session, conda_store, build, logs: typing.Union[str, bytes]):
-    # For instance, with local storage, this involves reading from and writing
-    # to a file. Locking here prevents a race condition when multiple tasks
-    # attempt to write to a shared resource, which is the log
-    with FileLock(f"{build.build_path(conda_store)}.log.lock"):
-        try:
-            current_logs = conda_store.storage.get(build.log_key)
-        except Exception:
-            current_logs = b""
+    def __enter__(self):
+        return self
 
-        if current_logs is None:
-            current_logs = b""
+    def __exit__(self, *exc_info):
+        self.close()
 
-        if isinstance(logs, str):
-            logs = logs.encode("utf-8")
-        elif logs is None:
-            logs = b""
 
-        conda_store.storage.set(
+def append_to_logs(db: Session, conda_store, build, logs: typing.Union[str, bytes]):
+    if isinstance(logs, str):
+        logs = logs.encode("utf-8")
+    elif logs is None:
+        logs = b""
+
+    # Locking here prevents a race condition when multiple tasks attempt to
+    # write to a shared resource, which is the log. Storage backends without
+    # a native append fall back to reading and writing the whole log
+    with FileLock(f"{build.build_path(conda_store)}.log.lock"):
+        conda_store.storage.append(
             db,
             build.id,
             build.log_key,
-            current_logs + logs,
+            logs,
             content_type="text/plain",
             artifact_type=schema.BuildArtifactType.LOGS,
         )
 
+        try:
+            log_stream.publish_logs(conda_store, build.id, logs)
+        except Exception as e:
+            conda_store.log.warning(
+                f"failed to publish logs for build={build.id}", exc_info=e
+            )
+
+
+def compact_logs(conda_store, build):
+    """Merge pending log appends into the stored log object
+
+    Called once a task has finished writing to the log of a build. The log
+    stream of a finished build is only kept until followers have caught up
+    """
+    try:
+        with FileLock(f"{build.build_path(conda_store)}.log.lock"):
+            conda_store.storage.compact(build.log_key)
+    except Exception as e:
+        conda_store.log.warning(
+            f"failed to compact logs for build={build.id}", exc_info=e
+        )
+
+    if build.status in (schema.BuildStatus.QUEUED, schema.BuildStatus.BUILDING):
+        return
+
+    try:
+        log_stream.expire_logs(conda_store, build.id)
+    except Exception as e:
+        conda_store.log.warning(
+            f"failed to expire log stream for build={build.id}", exc_info=e
+        )
+
 
 def set_build_started(db: Session, build: orm.Build):
     build.status = schema.BuildStatus.BUILDING
@@ -96,18 +169,30 @@ def set_build_completed(db: Session, conda_store, build: orm.Build):
     build.status = schema.BuildStatus.COMPLETED
     build.ended_on = datetime.datetime.utcnow()
 
-    directory_build_artifact = orm.BuildArtifact(
-        build_id=build.id,
-        artifact_type=schema.BuildArtifactType.DIRECTORY,
-        key=str(build.build_path(conda_store)),
+    db.execute(
+        api._insert_or_ignore(db, orm.BuildArtifact).values(
+            build_id=build.id,
+            artifact_type=schema.BuildArtifactType.DIRECTORY,
+            key=str(build.build_path(conda_store)),
+        )
     )
-    db.add(directory_build_artifact)
 
     build.environment.current_build = build
     build.environment.specification = build.specification
     db.commit()
 
 
+@contextlib.contextmanager
+def build_stage(db: Session, build: orm.Build, stage: str):
+    """Record the duration in seconds of a stage of the build which succeeded"""
+    start_time = time.monotonic()
+    yield
+    duration = round(time.monotonic() - start_time, 3)
+    build.stage_durations = {**(build.stage_durations or {}), stage: duration}
+    api.observe_build_stage_duration(db, stage, duration)
+    db.commit()
+
+
 def build_cleanup(
     db: Session,
     conda_store,
@@ -174,6 +259,308 @@ or error in conda-store
                 set_build_canceled(db, build)
             else:
                 set_build_failed(db, build)
+            compact_logs(conda_store, build)
+
+
+def solve_cache_key(
+    db: Session,
+    conda_store,
+    specification: orm.Specification,
+    platforms: typing.List[str],
+    lock_backend: str,
+) -> str | None:
+    """Key of the solve cache for a specification, or None if the solve
+    cannot be cached
+
+    The state of a channel is taken from the version of the repodata of
+    each solved subdir, and noarch, last downloaded by conda-store, see
+    ``CondaChannelSubdir``, so channel updates which download nothing new
+    keep the cached solves. Only specifications with channels indexed by
+    conda-store for all these subdirs are cached. There is no
+    equivalent for PyPI, so specifications with pip dependencies are not
+    cached either.
+    """
+    spec = schema.CondaSpecification.model_validate(specification.spec)
+    if not spec.channels or any(
+        isinstance(dependency, dict) for dependency in spec.dependencies
+    ):
+        return None
+
+    subdirs = sorted(set(platforms) | {"noarch"})
+    channels = []
+    for channel in spec.channels:
+        channel_orm = api.get_conda_channel(
+            db,
+            conda_utils.normalize_channel_name(
+                conda_store.config.conda_channel_alias, channel
+            ),
+        )
+        if channel_orm is None:
+            return None
+
+        # the hash of the ingested repodata.json when known, its cache
+        # headers otherwise
+        versions = {
+            channel_subdir.subdir: channel_subdir.repodata_hash
+            or channel_subdir.etag
+            or channel_subdir.last_modified
+            for channel_subdir in api.list_conda_channel_subdirs(db, channel_orm.id)
+        }
+        if any(versions.get(subdir) is None for subdir in subdirs):
+            return None
+        channels.append(
+            [channel_orm.name, [[subdir, versions[subdir]] for subdir in subdirs]]
+        )
+
+    return utils.datastructure_hash(
+        {
+            "specification": specification.sha256,
+            "platforms": platforms,
+            "lock_backend": lock_backend,
+            "conda_flags": conda_store.config.conda_flags,
+            "channels": channels,
+        }
+    )
+
+
+def lock_environment(
+    db: Session,
+    conda_store,
+    specification: orm.Specification,
+    platforms: typing.List[str],
+    build: orm.Build = None,
+):
+    """Solve a specification with the configured lock plugin, reusing the
+    lockfile of an identical previous solve if enabled
+    """
+    lock_backend, locker = conda_store.lock_plugin()
+
+    stdout = None
+    if build is not None:
+        stdout = LoggedStream(
+            db=db,
+            conda_store=conda_store,
+            build=build,
+            prefix=f"plugin-{lock_backend}: ",
+        )
+    context = plugin_context.PluginContext(conda_store=conda_store, stdout=stdout)
+
+    cache_key = None
+    if conda_store.config.solve_cache_enabled:
+        cache_key = solve_cache_key(
+            db, conda_store, specification, platforms, lock_backend
+        )
+
+    if cache_key is not None:
+        conda_lock_spec = api.get_solve_cache(
+            db, cache_key, ttl=conda_store.config.solve_cache_ttl
+        )
+        api.increment_solve_cache_metrics(db, hit=conda_lock_spec is not None)
+        if conda_lock_spec is not None:
+            context.log.info(f"using cached solve key={cache_key}")
+            return conda_lock_spec
+
+    try:
+        conda_lock_spec = locker.lock_environment(
+            spec=schema.CondaSpecification.model_validate(specification.spec),
+            platforms=platforms,
+            context=context,
+        )
+    finally:
+        # append the buffered output of the solve before anything else is
+        # logged, e.g. the traceback of a failed build
+        context.stdout.flush()
+
+    if cache_key is not None:
+        # The lockfile is stored as JSON, so this ensures the cached value
+        # is identical to what is returned on a cache miss
+        conda_lock_spec = json.loads(
+            json.dumps(conda_lock_spec, cls=utils.CustomJSONEncoder)
+        )
+        api.set_solve_cache(db, cache_key, conda_lock_spec)
+        api.evict_solve_cache(
+            db,
+            max_entries=conda_store.config.solve_cache_max_entries,
+            ttl=conda_store.config.solve_cache_ttl,
+        )
+
+    return conda_lock_spec
+
+
+def incremental_base_build(db: Session, conda_store, build: orm.Build):
+    """Returns the build an incremental install of build can start from
+    and its lockfile, if any
+    """
+    if not conda_store.config.build_incremental:
+        return None
+
+    base_build = build.environment.current_build
+    if (
+        base_build is None
+        or base_build.id == build.id
+        or base_build.status != schema.BuildStatus.COMPLETED
+        or base_build.deleted_on is not None
+    ):
+        return None
+
+    try:
+        base_conda_lock_spec = json.loads(
+            conda_store.storage.get_artifact(db, base_build.conda_lock_key)
+        )
+    except Exception:
+        return None
+    return base_build, base_conda_lock_spec
+
+
+def install_lockfile_incremental(
+    db: Session,
+    conda_store,
+    build: orm.Build,
+    conda_lock_spec: typing.Dict,
+    conda_prefix: pathlib.Path,
+    base_build: orm.Build,
+    base_conda_lock_spec: typing.Dict,
+) -> bool:
+    """Install the lockfile by cloning the prefix of base_build and applying
+    the packages which differ between the lockfiles
+
+    Returns False, after cleaning up the prefix, if this is not possible
+    """
+    try:
+        action.action_install_lockfile_incremental(
+            conda_command=conda_store.config.conda_command,
+            conda_lock_spec=conda_lock_spec,
+            conda_prefix=conda_prefix,
+            base_conda_lock_spec=base_conda_lock_spec,
+            base_conda_prefix=base_build.build_path(conda_store),
+            stdout=LoggedStream(
+                db=db,
+                conda_store=conda_store,
+                build=build,
+                prefix="action_install_lockfile_incremental: ",
+            ),
+        )
+        return True
+    except Exception as e:
+        conda_store.log.warning(
+            f"incremental install of build={build.id} failed, falling back to a full install: {e}"
+        )
+        append_to_logs(
+            db,
+            conda_store,
+            build,
+            f"incremental install failed, falling back to a full install: {e}\n",
+        )
+        shutil.rmtree(conda_prefix, ignore_errors=True)
+        return False
+
+
+def install_lockfile(
+    db: Session,
+    conda_store,
+    build: orm.Build,
+    conda_lock_spec: typing.Dict,
+    conda_prefix: pathlib.Path,
+):
+    """Install the lockfile into the prefix of the build
+
+    When enabled, the prefix of the current build of the environment is
+    cloned and only the packages which changed are installed, falling back
+    to a full install on any failure
+    """
+    base = incremental_base_build(db, conda_store, build)
+    if base is not None and install_lockfile_incremental(
+        db, conda_store, build, conda_lock_spec, conda_prefix, *base
+    ):
+        return
+
+    action.action_install_lockfile(
+        conda_lock_spec=conda_lock_spec,
+        conda_prefix=conda_prefix,
+        stdout=LoggedStream(
+            db=db,
+            conda_store=conda_store,
+            build=build,
+            prefix="action_install_lockfile: ",
+        ),
+    )
+
+
+def lockfile_hash(conda_lock_spec: typing.Dict) -> str:
+    """Hash of the packages of a lockfile
+
+    Builds with the same hash install identical environments
+    """
+    return utils.datastructure_hash(
+        sorted(
+            [package["manager"], package["platform"], package["name"], package["url"]]
+            for package in conda_lock_spec["package"]
+        )
+    )
+
+
+@contextlib.contextmanager
+def coalesce_builds(conda_store, lockfile_hash: str):
+    """Serialize builds with the same lockfile hash, so that only the first
+    one installs the environment and the others materialize from it
+
+    If the lock can't be acquired in time the build proceeds without it
+    """
+    task_key = f"lock_build_lockfile_{lockfile_hash}"
+    timeout = 60 * 60  # 1 hour
+
+    if conda_store.config.redis_url is not None:
+        lock = conda_store.redis.lock(
+            task_key, timeout=timeout, blocking_timeout=timeout
+        )
+    else:
+        lockfile_path = os.path.join(tempfile.gettempdir(), f"task_lock_{task_key}")
+        lock = FileLock(lockfile_path, timeout=timeout)
+
+    is_locked = False
+    try:
+        try:
+            is_locked = lock.acquire()
+        except TimeoutError:
+            pass
+
+        if not is_locked:
+            conda_store.log.warning(
+                f"timeout when acquiring lock with key {task_key}, building without it"
+            )
+        yield
+    finally:
+        if is_locked:
+            lock.release()
+
+
+def copy_build_references(db: Session, source_build: orm.Build, build: orm.Build):
+    """Reuse the package associations and the relocatable artifacts of a
+    build with an identical lockfile
+    """
+    api.add_build_conda_package_builds(
+        db,
+        build.id,
+        [package_build.id for package_build in source_build.package_builds],
+    )
+
+    # conda-pack archives are relocatable, other artifacts embed the
+    # name or path of the build
+    for build_artifact in api.list_build_artifacts(
+        db,
+        build_id=source_build.id,
+        included_artifact_types=[schema.BuildArtifactType.CONDA_PACK],
+    ).all():
+        db.add(
+            orm.BuildArtifact(
+                build_id=build.id,
+                artifact_type=build_artifact.artifact_type,
+                key=build_artifact.key,
+                digest=build_artifact.digest,
+                content_encoding=build_artifact.content_encoding,
+            )
+        )
+    db.commit()
 
 
 def build_conda_environment(db: Session, conda_store, build):
@@ -181,6 +568,8 @@ def build_conda_environment(db: Session, conda_store, build):
     symlink the build to a named environment
 
     """
+    # Held until the build completes, see coalesce_builds
+    coalesce_lock = contextlib.ExitStack()
     try:
         set_build_started(db, build)
         # Note: even append_to_logs can fail due to filename size limit, so
@@ -207,107 +596,133 @@ def build_conda_environment(db: Session, conda_store, build):
         is_lockfile = build.specification.is_lockfile
 
         with utils.timer(conda_store.log, f"building conda_prefix={conda_prefix}"):
-            if is_lockfile:
-                context = action.action_save_lockfile(
-                    specification=schema.LockfileSpecification.model_validate(
-                        build.specification.spec
-                    ),
-                    stdout=LoggedStream(
-                        db=db,
-                        conda_store=conda_store,
+            with build_stage(db, build, "lock"):
+                if is_lockfile:
+                    context = action.action_save_lockfile(
+                        specification=schema.LockfileSpecification.model_validate(
+                            build.specification.spec
+                        ),
+                        stdout=LoggedStream(
+                            db=db,
+                            conda_store=conda_store,
+                            build=build,
+                            prefix="action_save_lockfile: ",
+                        ),
+                    )
+                    conda_lock_spec = context.result
+                else:
+                    conda_lock_spec = lock_environment(
+                        db,
+                        conda_store,
+                        build.specification,
+                        platforms=settings.conda_solve_platforms,
                         build=build,
-                        prefix="action_save_lockfile: ",
-                    ),
+                    )
+
+                conda_store.storage.set(
+                    db,
+                    build.id,
+                    build.conda_lock_key,
+                    json.dumps(
+                        conda_lock_spec, indent=4, cls=utils.CustomJSONEncoder
+                    ).encode("utf-8"),
+                    content_type="application/json",
+                    artifact_type=schema.BuildArtifactType.LOCKFILE,
                 )
-                conda_lock_spec = context.result
-            else:
-                lock_backend, locker = conda_store.lock_plugin()
-                conda_lock_spec = locker.lock_environment(
-                    spec=schema.CondaSpecification.model_validate(
-                        build.specification.spec
-                    ),
-                    platforms=settings.conda_solve_platforms,
-                    context=plugin_context.PluginContext(
-                        conda_store=conda_store,
+
+            build.lockfile_hash = lockfile_hash(conda_lock_spec)
+            db.commit()
+
+            source_build = None
+            if conda_store.config.build_deduplication:
+                coalesce_lock.enter_context(
+                    coalesce_builds(conda_store, build.lockfile_hash)
+                )
+                source_build = api.get_completed_build_by_lockfile_hash(
+                    db, build.lockfile_hash, exclude_build_id=build.id
+                )
+
+            if source_build is not None:
+                append_to_logs(
+                    db,
+                    conda_store,
+                    build,
+                    f"materializing from build {source_build.id} with an identical lockfile\n",
+                )
+                with build_stage(db, build, "install"):
+                    if not install_lockfile_incremental(
+                        db,
+                        conda_store,
+                        build,
+                        conda_lock_spec,
+                        conda_prefix,
+                        source_build,
+                        conda_lock_spec,
+                    ):
+                        source_build = None
+
+            if source_build is None:
+                with build_stage(db, build, "fetch"):
+                    context = action.action_fetch_and_extract_conda_packages(
+                        conda_lock_spec=conda_lock_spec,
+                        pkgs_dir=conda_store.pkgs_dir,
+                        max_workers=conda_store.config.conda_package_download_workers,
                         stdout=LoggedStream(
                             db=db,
                             conda_store=conda_store,
                             build=build,
-                            prefix=f"plugin-{lock_backend}: ",
+                            prefix="action_fetch_and_extract_conda_packages: ",
                         ),
-                    ),
-                )
+                    )
 
-            conda_store.storage.set(
-                db,
-                build.id,
-                build.conda_lock_key,
-                json.dumps(
-                    conda_lock_spec, indent=4, cls=utils.CustomJSONEncoder
-                ).encode("utf-8"),
-                content_type="application/json",
-                artifact_type=schema.BuildArtifactType.LOCKFILE,
-            )
+                with build_stage(db, build, "install"):
+                    install_lockfile(
+                        db, conda_store, build, conda_lock_spec, conda_prefix
+                    )
+
+        if environment_prefix is not None:
+            utils.symlink(conda_prefix, environment_prefix)
 
-            context = action.action_fetch_and_extract_conda_packages(
-                conda_lock_spec=conda_lock_spec,
-                pkgs_dir=conda_utils.conda_root_package_dir(),
+        with build_stage(db, build, "permissions"):
+            action.action_set_conda_prefix_permissions(
+                conda_prefix=conda_prefix,
+                permissions=settings.default_permissions,
+                uid=settings.default_uid,
+                gid=settings.default_gid,
                 stdout=LoggedStream(
                     db=db,
                     conda_store=conda_store,
                     build=build,
-                    prefix="action_fetch_and_extract_conda_packages: ",
+                    prefix="action_set_conda_prefix_permissions: ",
                 ),
             )
 
-            context = action.action_install_lockfile(
-                conda_lock_spec=conda_lock_spec,
-                conda_prefix=conda_prefix,
+        with build_stage(db, build, "register_packages"):
+            if source_build is not None:
+                copy_build_references(db, source_build, build)
+            else:
+                action.action_add_conda_prefix_packages(
+                    db=db,
+                    conda_prefix=conda_prefix,
+                    build_id=build.id,
+                    stdout=LoggedStream(
+                        db=db,
+                        conda_store=conda_store,
+                        build=build,
+                        prefix="action_add_conda_prefix_packages: ",
+                    ),
+                )
+
+        with build_stage(db, build, "stats"):
+            context = action.action_get_conda_prefix_stats(
+                conda_prefix,
                 stdout=LoggedStream(
                     db=db,
                     conda_store=conda_store,
                     build=build,
-                    prefix="action_install_lockfile: ",
+                    prefix="action_get_conda_prefix_stats: ",
                 ),
             )
-
-        if environment_prefix is not None:
-            utils.symlink(conda_prefix, environment_prefix)
-
-        action.action_set_conda_prefix_permissions(
-            conda_prefix=conda_prefix,
-            permissions=settings.default_permissions,
-            uid=settings.default_uid,
-            gid=settings.default_gid,
-            stdout=LoggedStream(
-                db=db,
-                conda_store=conda_store,
-                build=build,
-                prefix="action_set_conda_prefix_permissions: ",
-            ),
-        )
-
-        action.action_add_conda_prefix_packages(
-            db=db,
-            conda_prefix=conda_prefix,
-            build_id=build.id,
-            stdout=LoggedStream(
-                db=db,
-                conda_store=conda_store,
-                build=build,
-                prefix="action_add_conda_prefix_packages: ",
-            ),
-        )
-
-        context = action.action_get_conda_prefix_stats(
-            conda_prefix,
-            stdout=LoggedStream(
-                db=db,
-                conda_store=conda_store,
-                build=build,
-                prefix="action_get_conda_prefix_stats: ",
-            ),
-        )
         build.size = context.result["disk_usage"]
 
         set_build_completed(db, conda_store, build)
@@ -330,16 +745,18 @@ def build_conda_environment(db: Session, conda_store, build):
         conda_store.log.exception(e)
         append_to_logs(db, conda_store, build, traceback.format_exc())
         raise e
+    finally:
+        coalesce_lock.close()
 
 
 def solve_conda_environment(db: Session, conda_store, solve: orm.Solve):
     solve.started_on = datetime.datetime.utcnow()
     db.commit()
 
-    _, locker = conda_store.lock_plugin()
-    conda_lock_spec = locker.lock_environment(
-        context=plugin_context.PluginContext(conda_store=conda_store),
-        spec=schema.CondaSpecification.model_validate(solve.specification.spec),
+    conda_lock_spec = lock_environment(
+        db,
+        conda_store,
+        solve.specification,
         platforms=[conda_utils.conda_platform()],
     )
 
@@ -386,10 +803,19 @@ def build_conda_env_export(db: Session, conda_store, build: orm.Build):
 def build_conda_pack(db: Session, conda_store, build: orm.Build):
     conda_prefix = build.build_path(conda_store)
 
+    # Builds materialized from a build with an identical lockfile reuse its
+    # archive, see copy_build_references
+    if api.list_build_artifacts(
+        db,
+        build_id=build.id,
+        included_artifact_types=[schema.BuildArtifactType.CONDA_PACK],
+    ).first():
+        return
+
     with utils.timer(
         conda_store.log, f"packaging archive of conda environment={conda_prefix}"
     ):
-        with tempfile.TemporaryDirectory() as tmpdir:
+        with conda_store.storage.temporary_directory() as tmpdir:
             output_filename = pathlib.Path(tmpdir) / "environment.tar.gz"
             action.action_generate_conda_pack(
                 conda_prefix=conda_prefix,
@@ -401,9 +827,10 @@ def build_conda_pack(db: Session, conda_store, build: orm.Build):
                     prefix="action_generate_conda_pack: ",
                 ),
             )
-            conda_store.storage.fset(
+            upload_artifact(
                 db,
-                build.id,
+                conda_store,
+                build,
                 build.conda_pack_key,
                 output_filename,
                 content_type="application/gzip",
@@ -411,6 +838,40 @@ def build_conda_pack(db: Session, conda_store, build: orm.Build):
             )
 
 
+def upload_artifact(
+    db: Session,
+    conda_store,
+    build: orm.Build,
+    key: str,
+    filename,
+    content_type: str,
+    artifact_type: schema.BuildArtifactType,
+):
+    """Store a build artifact and report the upload throughput in the
+    build log
+    """
+    size = os.path.getsize(filename)
+    start_time = time.monotonic()
+    conda_store.storage.fset(
+        db,
+        build.id,
+        key,
+        filename,
+        content_type=content_type,
+        artifact_type=artifact_type,
+    )
+    elapsed = time.monotonic() - start_time
+
+    size_mib = size / 2**20
+    append_to_logs(
+        db,
+        conda_store,
+        build,
+        f"Uploaded {key} ({size_mib:.1f} MiB) in {elapsed:.1f} s "
+        f"({size_mib / max(elapsed, 1e-6):.1f} MiB/s)\n",
+    )
+
+
 def build_conda_docker(db: Session, conda_store, build: orm.Build):
     import warnings
 
@@ -432,7 +893,7 @@ def build_constructor_installer(db: Session, conda_store, build: orm.Build):
     with utils.timer(
         conda_store.log, f"creating installer for conda environment={conda_prefix}"
     ):
-        with tempfile.TemporaryDirectory() as tmpdir:
+        with conda_store.storage.temporary_directory() as tmpdir:
             is_lockfile = build.specification.is_lockfile
 
             if is_lockfile:
@@ -449,7 +910,9 @@ def build_constructor_installer(db: Session, conda_store, build: orm.Build):
                         {
                             "name": build.specification.name,
                             "lockfile": json.loads(
-                                conda_store.storage.get(build.conda_lock_key)
+                                conda_store.storage.get_artifact(
+                                    db, build.conda_lock_key
+                                )
                             ),
                         }
                     )
@@ -479,9 +942,10 @@ def build_constructor_installer(db: Session, conda_store, build: orm.Build):
             output_filename = context.result
             if output_filename is None:
                 return
-            conda_store.storage.fset(
+            upload_artifact(
                 db,
-                build.id,
+                conda_store,
+                build,
                 build.constructor_installer_key,
                 output_filename,
                 content_type="application/octet-stream",
@@ -2,6 +2,7 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import concurrent.futures
 import datetime
 import os
 import shutil
@@ -16,7 +17,7 @@ from filelock import FileLock
 from sqlalchemy.orm import Session
 
 from conda_store_server import api
-from conda_store_server._internal import environment, schema, utils
+from conda_store_server._internal import conda_utils, environment, orm, schema, utils
 from conda_store_server._internal.worker.app import CondaStoreWorker
 from conda_store_server._internal.worker.build import (
     build_cleanup,
@@ -24,6 +25,7 @@ from conda_store_server._internal.worker.build import (
     build_conda_environment,
     build_conda_pack,
     build_constructor_installer,
+    compact_logs,
     solve_conda_environment,
 )
 
@@ -187,7 +189,18 @@ def task_update_conda_channel(self, channel_name):
                 channel = api.get_conda_channel(db, channel_name)
 
                 conda_store.log.debug(f"updating packages for channel {channel.name}")
-                channel.update_packages(db, subdirs=settings.conda_platforms)
+                config = conda_store.config
+                channel.update_packages(
+                    db,
+                    subdirs=settings.conda_platforms,
+                    batch_size=config.conda_indexed_channels_batch_size,
+                    session=conda_utils.http_session(
+                        retries=config.conda_indexed_channels_fetch_retries,
+                        backoff_factor=config.conda_indexed_channels_fetch_backoff_factor,
+                        pool_maxsize=config.conda_indexed_channels_max_concurrent_fetches,
+                    ),
+                    max_workers=config.conda_indexed_channels_max_concurrent_fetches,
+                )
 
         else:
             conda_store.log.debug(
@@ -221,7 +234,10 @@ def task_build_conda_environment(self, build_id):
 
     with conda_store.session_factory() as db:
         build = api.get_build(db, build_id)
-        build_conda_environment(db, conda_store, build)
+        try:
+            build_conda_environment(db, conda_store, build)
+        finally:
+            compact_logs(conda_store, build)
 
 
 @shared_task(base=WorkerTask, name="task_build_conda_env_export", bind=True)
@@ -229,7 +245,10 @@ def task_build_conda_env_export(self, build_id):
     conda_store = self.worker.conda_store
     with conda_store.session_factory() as db:
         build = api.get_build(db, build_id)
-        build_conda_env_export(db, conda_store, build)
+        try:
+            build_conda_env_export(db, conda_store, build)
+        finally:
+            compact_logs(conda_store, build)
 
 
 @shared_task(base=WorkerTask, name="task_build_conda_pack", bind=True)
@@ -237,7 +256,10 @@ def task_build_conda_pack(self, build_id):
     conda_store = self.worker.conda_store
     with conda_store.session_factory() as db:
         build = api.get_build(db, build_id)
-        build_conda_pack(db, conda_store, build)
+        try:
+            build_conda_pack(db, conda_store, build)
+        finally:
+            compact_logs(conda_store, build)
 
 
 @shared_task(base=WorkerTask, name="task_build_constructor_installer", bind=True)
@@ -245,7 +267,10 @@ def task_build_constructor_installer(self, build_id):
     conda_store = self.worker.conda_store
     with conda_store.session_factory() as db:
         build = api.get_build(db, build_id)
-        build_constructor_installer(db, conda_store, build)
+        try:
+            build_constructor_installer(db, conda_store, build)
+        finally:
+            compact_logs(conda_store, build)
 
 
 @shared_task(base=WorkerTask, name="task_update_environment_build", bind=True)
@@ -264,19 +289,98 @@ def task_update_environment_build(self, environment_id):
             conda_store.post_update_environment_build_hook(conda_store, environment)
 
 
-def delete_build_artifact(db: Session, conda_store, build_artifact):
-    if build_artifact.artifact_type == schema.BuildArtifactType.DIRECTORY:
-        # ignore key
-        conda_prefix = build_artifact.build.build_path(conda_store)
-        # be REALLY sure this is a directory within store directory
-        if str(conda_prefix).startswith(
-            conda_store.config.store_directory
-        ) and os.path.isdir(conda_prefix):
-            shutil.rmtree(conda_prefix)
-            db.delete(build_artifact)
-    else:
-        conda_store.log.info(f"deleting {build_artifact.key}")
-        conda_store.storage.delete(db, build_artifact.build.id, build_artifact.key)
+# Number of builds whose artifacts are deleted per database transaction
+DELETE_BATCH_SIZE = 100
+
+# Number of build prefixes removed concurrently
+DELETE_PREFIX_WORKERS = 4
+
+
+def delete_build_prefix(conda_store, conda_prefix) -> bool:
+    """Remove the conda prefix of a build, returns whether it was removed"""
+    # be REALLY sure this is a directory within store directory
+    if str(conda_prefix).startswith(
+        conda_store.config.store_directory
+    ) and os.path.isdir(conda_prefix):
+        shutil.rmtree(conda_prefix)
+        return True
+    return False
+
+
+def delete_builds_artifacts(
+    db: Session,
+    conda_store,
+    builds: typing.List[orm.Build],
+    excluded_artifact_types: typing.List[schema.BuildArtifactType] = None,
+    progress: typing.Callable[[int, int], None] = None,
+):
+    """Delete the artifacts of ``builds`` in batches of DELETE_BATCH_SIZE
+
+    Each batch removes the build prefixes concurrently and the stored
+    artifacts with a single Storage.delete_many, which commits the
+    removal of their rows at once
+    """
+    for start in range(0, len(builds), DELETE_BATCH_SIZE):
+        batch = builds[start : start + DELETE_BATCH_SIZE]
+        build_artifacts = (
+            api.list_build_artifacts(
+                db, excluded_artifact_types=excluded_artifact_types
+            )
+            .filter(orm.BuildArtifact.build_id.in_([build.id for build in batch]))
+            .all()
+        )
+
+        directory_artifacts = [
+            build_artifact
+            for build_artifact in build_artifacts
+            if build_artifact.artifact_type == schema.BuildArtifactType.DIRECTORY
+        ]
+        # prefixes are resolved upfront since sessions are not thread safe
+        conda_prefixes = [
+            build_artifact.build.build_path(conda_store)
+            for build_artifact in directory_artifacts
+        ]
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=DELETE_PREFIX_WORKERS
+        ) as executor:
+            removed = list(
+                executor.map(
+                    lambda conda_prefix: delete_build_prefix(conda_store, conda_prefix),
+                    conda_prefixes,
+                )
+            )
+        for build_artifact, was_removed in zip(
+            directory_artifacts, removed, strict=True
+        ):
+            if was_removed:
+                db.delete(build_artifact)
+
+        conda_store.storage.delete_many(
+            db,
+            [
+                build_artifact
+                for build_artifact in build_artifacts
+                if build_artifact.artifact_type != schema.BuildArtifactType.DIRECTORY
+            ],
+        )
+        db.commit()
+
+        deleted = start + len(batch)
+        conda_store.log.info(f"deleted artifacts of {deleted} of {len(builds)} builds")
+        if progress is not None:
+            progress(deleted, len(builds))
+
+
+def deletion_progress(task):
+    """Report the progress of a deletion as the state of ``task``"""
+
+    def progress(deleted: int, total: int):
+        if task.request.id is not None:
+            task.update_state(
+                state="PROGRESS", meta={"deleted_builds": deleted, "builds": total}
+            )
+
+    return progress
 
 
 @shared_task(base=WorkerTask, name="task_delete_build", bind=True)
@@ -289,12 +393,12 @@ def task_delete_build(self, build_id):
 
         # Deletes build artifacts for this build
         conda_store.log.info(f"deleting artifacts for build={build.id}")
-        for build_artifact in api.list_build_artifacts(
+        delete_builds_artifacts(
             db,
-            build_id=build_id,
+            conda_store,
+            [build],
             excluded_artifact_types=settings.build_artifacts_kept_on_deletion,
-        ).all():
-            delete_build_artifact(db, conda_store, build_artifact)
+        )
 
         # Updates build size and marks build as deleted
         build.deleted_on = datetime.datetime.utcnow()
@@ -309,13 +413,13 @@ def task_delete_environment(self, environment_id):
     with conda_store.session_factory() as db:
         environment = api.get_environment(db, id=environment_id)
 
-        for build in environment.builds:
-            conda_store.log.info(f"deleting artifacts for build={build.id}")
-            for build_artifact in api.list_build_artifacts(
-                db,
-                build_id=build.id,
-            ).all():
-                delete_build_artifact(db, conda_store, build_artifact)
+        conda_store.log.info(
+            f"deleting artifacts of {len(environment.builds)} builds "
+            f"for environment={environment.id}"
+        )
+        delete_builds_artifacts(
+            db, conda_store, environment.builds, progress=deletion_progress(self)
+        )
 
         db.delete(environment)
         db.commit()
@@ -327,14 +431,19 @@ def task_delete_namespace(self, namespace_id):
     with conda_store.session_factory() as db:
         namespace = api.get_namespace(db, id=namespace_id)
 
+        builds = [
+            build
+            for environment_orm in namespace.environments
+            for build in environment_orm.builds
+        ]
+        conda_store.log.info(
+            f"deleting artifacts of {len(builds)} builds for namespace={namespace.id}"
+        )
+        delete_builds_artifacts(
+            db, conda_store, builds, progress=deletion_progress(self)
+        )
+
         for environment_orm in namespace.environments:
-            for build in environment_orm.builds:
-                conda_store.log.info(f"deleting artifacts for build={build.id}")
-                for build_artifact in api.list_build_artifacts(
-                    db,
-                    build_id=build.id,
-                ).all():
-                    delete_build_artifact(db, conda_store, build_artifact)
             db.delete(environment_orm)
         db.delete(namespace)
         db.commit()
@@ -3,10 +3,12 @@
 # license that can be found in the LICENSE file.
 from __future__ import annotations
 
+import datetime
 import re
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, Iterable, List, Set, Union
 
-from sqlalchemy import distinct, func, null, or_
+from sqlalchemy import distinct, func, insert, null, or_, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Query, aliased, session
 
 from conda_store_server._internal import conda_utils, orm, schema, utils
@@ -574,6 +576,25 @@ def get_build_artifact_types(db, build_id: int):
     )
 
 
+def get_completed_build_by_lockfile_hash(
+    db, lockfile_hash: str, exclude_build_id: int = None
+):
+    """Most recent completed build, which hasn't been deleted, with the given
+    lockfile hash
+    """
+    filters = [
+        orm.Build.lockfile_hash == lockfile_hash,
+        orm.Build.status == schema.BuildStatus.COMPLETED,
+        orm.Build.deleted_on == null(),
+    ]
+    if exclude_build_id is not None:
+        filters.append(orm.Build.id != exclude_build_id)
+
+    return (
+        db.query(orm.Build).filter(*filters).order_by(orm.Build.ended_on.desc()).first()
+    )
+
+
 def list_build_artifacts(
     db,
     build_id: int = None,
@@ -596,6 +617,32 @@ def list_build_artifacts(
     return db.query(orm.BuildArtifact).filter(*filters)
 
 
+def get_referenced_build_artifact_keys(db, keys: Iterable[str]) -> Set[str]:
+    """Subset of ``keys`` referenced by build artifacts"""
+    referenced = set()
+    for batch in _batched(sorted(keys)):
+        referenced.update(
+            key
+            for (key,) in db.query(orm.BuildArtifact.key).filter(
+                orm.BuildArtifact.key.in_(batch)
+            )
+        )
+    return referenced
+
+
+def get_referenced_build_artifact_digests(db, digests: Iterable[str]) -> Set[str]:
+    """Subset of ``digests`` referenced by content addressed build artifacts"""
+    referenced = set()
+    for batch in _batched(sorted(digests)):
+        referenced.update(
+            digest
+            for (digest,) in db.query(orm.BuildArtifact.digest).filter(
+                orm.BuildArtifact.digest.in_(batch)
+            )
+        )
+    return referenced
+
+
 def get_build_artifact(db, build_id: int, key: str):
     return (
         db.query(orm.BuildArtifact)
@@ -629,6 +676,12 @@ def get_conda_channel(db, channel_name: str):
     )
 
 
+def list_conda_channel_subdirs(db, channel_id: int):
+    return db.query(orm.CondaChannelSubdir).filter(
+        orm.CondaChannelSubdir.channel_id == channel_id
+    )
+
+
 def get_conda_package(db, channel_id: int, name: str, version: str):
     return (
         db.query(orm.CondaPackage)
@@ -732,6 +785,186 @@ def create_conda_package_build(db, package_id: int, package_record: Dict):
     return conda_package_build
 
 
+def _insert_or_ignore(db, table):
+    """INSERT statement for table which skips rows violating a unique constraint"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+    elif dialect == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing()
+    elif dialect in ("mysql", "mariadb"):
+        return insert(table).prefix_with("IGNORE")
+    raise NotImplementedError(f"unsupported database dialect {dialect}")
+
+
+def _batched(values: List, batch_size: int = 500):
+    # sqlite3 has a max expression depth of 1000
+    for i in range(0, len(values), batch_size):
+        yield values[i : i + batch_size]
+
+
+def create_or_ignore_conda_packages(db, package_records: List[Dict]) -> List[int]:
+    """Bulk version of create_or_ignore_conda_package
+
+    Channels, packages and package builds are looked up with a few
+    set-based queries and only the missing rows are inserted. Rows
+    inserted concurrently by another worker are ignored. Returns the ids
+    of the package builds, pypi packages are skipped. Does not commit.
+    """
+    package_records = [
+        record
+        for record in package_records
+        if record["channel_id"] != "https://conda.anaconda.org/pypi"
+    ]
+    if not package_records:
+        return []
+
+    # channels
+    channel_names = sorted({record["channel_id"] for record in package_records})
+    db.execute(
+        _insert_or_ignore(db, orm.CondaChannel),
+        [{"name": name, "last_update": None} for name in channel_names],
+    )
+    channel_ids = dict(
+        db.query(orm.CondaChannel.name, orm.CondaChannel.id).filter(
+            orm.CondaChannel.name.in_(channel_names)
+        )
+    )
+
+    # packages
+    conda_package_keys = [
+        "license",
+        "license_family",
+        "name",
+        "version",
+        "summary",
+        "description",
+    ]
+    packages = {}
+    for record in package_records:
+        channel_id = channel_ids[record["channel_id"]]
+        packages.setdefault(
+            (channel_id, record["name"], record["version"]),
+            {
+                "channel_id": channel_id,
+                **{k: record[k] for k in conda_package_keys},
+            },
+        )
+
+    def query_package_ids(keys):
+        package_ids = {}
+        for batch in _batched(keys):
+            package_ids.update(
+                {
+                    (channel_id, name, version): id
+                    for id, channel_id, name, version in db.query(
+                        orm.CondaPackage.id,
+                        orm.CondaPackage.channel_id,
+                        orm.CondaPackage.name,
+                        orm.CondaPackage.version,
+                    ).filter(
+                        tuple_(
+                            orm.CondaPackage.channel_id,
+                            orm.CondaPackage.name,
+                            orm.CondaPackage.version,
+                        ).in_(batch)
+                    )
+                }
+            )
+        return package_ids
+
+    package_ids = query_package_ids(list(packages))
+    missing = [key for key in packages if key not in package_ids]
+    if missing:
+        db.execute(
+            _insert_or_ignore(db, orm.CondaPackage), [packages[k] for k in missing]
+        )
+        package_ids.update(query_package_ids(missing))
+
+    # package builds
+    conda_package_build_keys = [
+        "build",
+        "build_number",
+        "constrains",
+        "depends",
+        "md5",
+        "sha256",
+        "size",
+        "subdir",
+        "timestamp",
+    ]
+    package_builds = {}
+    for record in package_records:
+        channel_id = channel_ids[record["channel_id"]]
+        package_id = package_ids[(channel_id, record["name"], record["version"])]
+        package_builds.setdefault(
+            (package_id, record["subdir"], record["build"]),
+            {
+                "package_id": package_id,
+                "channel_id": channel_id,
+                **{k: record[k] for k in conda_package_build_keys},
+            },
+        )
+
+    def query_package_build_ids(keys):
+        package_build_ids = {}
+        for batch in _batched(keys):
+            for id, package_id, subdir, build in (
+                db.query(
+                    orm.CondaPackageBuild.id,
+                    orm.CondaPackageBuild.package_id,
+                    orm.CondaPackageBuild.subdir,
+                    orm.CondaPackageBuild.build,
+                )
+                .filter(
+                    tuple_(
+                        orm.CondaPackageBuild.package_id,
+                        orm.CondaPackageBuild.subdir,
+                        orm.CondaPackageBuild.build,
+                    ).in_(batch)
+                )
+                .order_by(orm.CondaPackageBuild.id)
+            ):
+                # the same as get_conda_package_build, the first match wins
+                package_build_ids.setdefault((package_id, subdir, build), id)
+        return package_build_ids
+
+    package_build_ids = query_package_build_ids(list(package_builds))
+    missing = [key for key in package_builds if key not in package_build_ids]
+    if missing:
+        db.execute(
+            _insert_or_ignore(db, orm.CondaPackageBuild),
+            [package_builds[k] for k in missing],
+        )
+        package_build_ids.update(query_package_build_ids(missing))
+
+    return [package_build_ids[key] for key in package_builds]
+
+
+def add_build_conda_package_builds(db, build_id: int, package_build_ids: List[int]):
+    """Associate package builds with a build in a single statement"""
+    if package_build_ids:
+        db.execute(
+            _insert_or_ignore(db, orm.build_conda_package),
+            [
+                {"build_id": build_id, "conda_package_build_id": id}
+                for id in package_build_ids
+            ],
+        )
+
+
+def add_solve_conda_package_builds(db, solve_id: int, package_build_ids: List[int]):
+    """Associate package builds with a solve in a single statement"""
+    if package_build_ids:
+        db.execute(
+            _insert_or_ignore(db, orm.solve_conda_package_build),
+            [
+                {"solve_id": solve_id, "conda_package_build_id": id}
+                for id in package_build_ids
+            ],
+        )
+
+
 def list_conda_packages(db, search: str = None, exact: bool = False, build: str = None):
     filters = []
     if search:
@@ -745,12 +978,85 @@ def list_conda_packages(db, search: str = None, exact: bool = False, build: str
     return db.query(orm.CondaPackage).join(orm.CondaChannel).filter(*filters)
 
 
+def get_solve_cache(db, key: str, ttl: int = None):
+    """Get the cached lockfile for key, updating when it was last used"""
+    filters = [orm.SolveCache.key == key]
+    if ttl is not None:
+        filters.append(
+            orm.SolveCache.created_on
+            > datetime.datetime.utcnow() - datetime.timedelta(seconds=ttl)
+        )
+
+    entry = db.query(orm.SolveCache).filter(*filters).first()
+    if entry is None:
+        return None
+
+    entry.last_used_on = datetime.datetime.utcnow()
+    db.commit()
+    return entry.lockfile
+
+
+def set_solve_cache(db, key: str, lockfile: Dict):
+    entry = db.query(orm.SolveCache).filter(orm.SolveCache.key == key).first()
+    if entry is None:
+        entry = orm.SolveCache(key=key, lockfile=lockfile)
+        db.add(entry)
+    else:
+        entry.lockfile = lockfile
+        entry.created_on = datetime.datetime.utcnow()
+        entry.last_used_on = datetime.datetime.utcnow()
+    db.commit()
+
+
+def evict_solve_cache(db, max_entries: int, ttl: int = None):
+    """Delete expired entries and the least recently used entries over
+    max_entries
+    """
+    if ttl is not None:
+        db.query(orm.SolveCache).filter(
+            orm.SolveCache.created_on
+            <= datetime.datetime.utcnow() - datetime.timedelta(seconds=ttl)
+        ).delete(synchronize_session=False)
+
+    # Entries are deleted by age rather than with a LIMIT subquery, which
+    # MySQL does not support, entries used at the same time as the oldest
+    # kept entry are kept as well
+    query = db.query(orm.SolveCache)
+    if max_entries > 0:
+        oldest_kept = (
+            db.query(orm.SolveCache.last_used_on)
+            .order_by(orm.SolveCache.last_used_on.desc())
+            .offset(max_entries - 1)
+            .limit(1)
+            .scalar()
+        )
+        if oldest_kept is None:
+            db.commit()
+            return
+        query = query.filter(orm.SolveCache.last_used_on < oldest_kept)
+    query.delete(synchronize_session=False)
+    db.commit()
+
+
+def increment_solve_cache_metrics(db, hit: bool):
+    column = (
+        orm.CondaStoreConfiguration.solve_cache_hits
+        if hit
+        else orm.CondaStoreConfiguration.solve_cache_misses
+    )
+    orm.CondaStoreConfiguration.configuration(db)
+    db.query(orm.CondaStoreConfiguration).update({column: func.coalesce(column, 0) + 1})
+    db.commit()
+
+
 def get_metrics(db):
     metrics = (
         db.query(
             orm.CondaStoreConfiguration.free_storage.label("disk_free"),
             orm.CondaStoreConfiguration.total_storage.label("disk_total"),
             orm.CondaStoreConfiguration.disk_usage,
+            orm.CondaStoreConfiguration.solve_cache_hits,
+            orm.CondaStoreConfiguration.solve_cache_misses,
         )
         .first()
         ._asdict()
@@ -766,6 +1072,87 @@ def get_metrics(db):
     return metrics
 
 
+# Upper bounds in seconds of the build stage duration histogram buckets
+BUILD_STAGE_DURATION_BUCKETS = [1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600]
+
+
+def _build_stage_duration_bucket(duration: float, buckets: List[float]) -> str:
+    for le in buckets:
+        if duration <= le:
+            return str(le)
+    return "+Inf"
+
+
+def observe_build_stage_duration(
+    db, stage: str, duration: float, buckets: List[float] = BUILD_STAGE_DURATION_BUCKETS
+):
+    """Count the duration of a build stage in the running histograms read
+    by get_build_stage_duration_histograms. Does not commit.
+    """
+    le = _build_stage_duration_bucket(duration, buckets)
+    db.execute(
+        _insert_or_ignore(db, orm.BuildStageDurationBucket).values(
+            stage=stage, le=le, count=0, sum=0.0
+        )
+    )
+    db.query(orm.BuildStageDurationBucket).filter(
+        orm.BuildStageDurationBucket.stage == stage,
+        orm.BuildStageDurationBucket.le == le,
+    ).update(
+        {
+            orm.BuildStageDurationBucket.count: orm.BuildStageDurationBucket.count + 1,
+            orm.BuildStageDurationBucket.sum: orm.BuildStageDurationBucket.sum
+            + duration,
+        },
+        synchronize_session=False,
+    )
+
+
+def get_build_stage_duration_histograms(
+    db, buckets: List[float] = BUILD_STAGE_DURATION_BUCKETS
+):
+    """Histograms of the duration of each build stage over all builds
+
+    Returns a dict mapping each stage to its cumulative bucket counts, the
+    sum of the durations and the number of durations, in the form expected
+    by Prometheus histograms. Only the running histograms are read, so the
+    cost does not grow with the number of builds.
+    """
+    histograms = {}
+    for stage, le, count, sum_ in db.query(
+        orm.BuildStageDurationBucket.stage,
+        orm.BuildStageDurationBucket.le,
+        orm.BuildStageDurationBucket.count,
+        orm.BuildStageDurationBucket.sum,
+    ).order_by(orm.BuildStageDurationBucket.stage):
+        histogram = histograms.setdefault(
+            stage,
+            {"buckets": {le: 0 for le in buckets}, "sum": 0.0, "count": 0},
+        )
+        for bucket in buckets:
+            if float(le) <= bucket:
+                histogram["buckets"][bucket] += count
+        histogram["sum"] += sum_
+        histogram["count"] += count
+    return histograms
+
+
+def get_channel_fetch_metrics(db):
+    """Duration and time of the last repodata fetch of each channel subdir"""
+    return (
+        db.query(
+            orm.CondaChannel.name,
+            orm.CondaChannelSubdir.subdir,
+            orm.CondaChannelSubdir.fetch_duration,
+            orm.CondaChannelSubdir.fetched_on,
+        )
+        .join(orm.CondaChannelSubdir.channel)
+        .filter(orm.CondaChannelSubdir.fetched_on.is_not(None))
+        .order_by(orm.CondaChannel.name, orm.CondaChannelSubdir.subdir)
+        .all()
+    )
+
+
 def get_system_metrics(db):
     return db.query(
         orm.CondaStoreConfiguration.free_storage.label("disk_free"),
@@ -5,6 +5,7 @@
 import datetime
 import logging
 import os
+import pathlib
 from contextlib import contextmanager
 from typing import Any, Dict
 
@@ -166,6 +167,33 @@ class CondaStore:
         """Ensure that conda-store filesystem directories exist"""
         os.makedirs(self.config.store_directory, exist_ok=True)
 
+    @property
+    def pkgs_dir(self) -> pathlib.Path:
+        """Package cache directory used for builds"""
+        if hasattr(self, "_pkgs_dir"):
+            return self._pkgs_dir
+
+        if self.config.conda_pkgs_dir is not None:
+            self._pkgs_dir = pathlib.Path(self.config.conda_pkgs_dir)
+        else:
+            self._pkgs_dir = conda_utils.conda_root_package_dir()
+        return self._pkgs_dir
+
+    def ensure_pkgs_dir(self):
+        """Ensure that the package cache directory exists and is writable
+
+        A configured directory is exported as CONDA_PKGS_DIRS, so that the
+        conda commands run by builds use it too
+        """
+        os.makedirs(self.pkgs_dir, exist_ok=True)
+        if not os.access(self.pkgs_dir, os.W_OK | os.X_OK):
+            raise CondaStoreError(
+                f"package cache directory {self.pkgs_dir} is not writable"
+            )
+
+        if self.config.conda_pkgs_dir is not None:
+            os.environ["CONDA_PKGS_DIRS"] = str(self.pkgs_dir)
+
     def ensure_conda_channels(self, db: Session):
         """Ensure that conda-store indexed channels and packages are
         in database. Only globally defined `conda_indexed_channels`
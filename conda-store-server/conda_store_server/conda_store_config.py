@@ -9,6 +9,7 @@ from sqlalchemy.orm import Session
 from traitlets import (
     Bool,
     Callable,
+    Float,
     Integer,
     List,
     TraitError,
@@ -153,6 +154,31 @@ class CondaStore(LoggingConfigurable):
         config=True,
     )
 
+    build_incremental = Bool(
+        False,
+        help="Build new versions of an environment by cloning the prefix of its current build and installing only the packages which changed, instead of installing every package. Falls back to a full install when the clone or the update fails. Environments with pip packages are always fully installed",
+        config=True,
+    )
+
+    build_deduplication = Bool(
+        False,
+        help="Materialize builds whose lockfile is identical to the lockfile of a completed build by cloning the prefix of that build instead of installing it again. Concurrent builds with identical lockfiles are serialized, so only the first one installs the environment",
+        config=True,
+    )
+
+    conda_pkgs_dir = Unicode(
+        None,
+        help="Package cache directory used for builds. By default the first of conda's pkgs_dirs is used. When set, it is passed to conda via CONDA_PKGS_DIRS",
+        config=True,
+        allow_none=True,
+    )
+
+    conda_package_download_workers = Integer(
+        4,
+        help="Number of packages downloaded and extracted in parallel into the package cache during a build",
+        config=True,
+    )
+
     conda_platforms = List(
         [conda_utils.conda_platform(), "noarch"],
         help="Conda platforms to download package repodata.json from. By default includes current architecture and noarch",
@@ -182,6 +208,30 @@ class CondaStore(LoggingConfigurable):
         config=True,
     )
 
+    conda_indexed_channels_max_concurrent_fetches = Integer(
+        4,
+        help="Maximum number of platforms of an indexed channel whose repodata is fetched concurrently. Connections are kept alive and shared by the channel updates of a worker",
+        config=True,
+    )
+
+    conda_indexed_channels_fetch_retries = Integer(
+        3,
+        help="Number of times fetching the repodata of an indexed channel is retried after a connection error or a transient HTTP error status",
+        config=True,
+    )
+
+    conda_indexed_channels_fetch_backoff_factor = Float(
+        0.5,
+        help="Delay in seconds before retrying to fetch the repodata of an indexed channel, doubled on each retry unless the server sends Retry-After",
+        config=True,
+    )
+
+    conda_indexed_channels_batch_size = Integer(
+        10000,
+        help="Number of package records of an indexed channel parsed and inserted at a time. The repodata is streamed from disk, so this bounds the memory used by channel updates regardless of the size of the channel",
+        config=True,
+    )
+
     conda_default_packages = List(
         [],
         help="Conda packages that included by default if none are included",
@@ -287,6 +337,36 @@ class CondaStore(LoggingConfigurable):
         allow_none=True,
     )
 
+    build_logs_stream_ttl = Integer(
+        24 * 60 * 60,  # 1 day
+        help="Seconds to keep the Redis stream of a build log after its last write. The stream is used to follow the logs of running builds and is only used when `redis_url` is set",
+        config=True,
+    )
+
+    build_logs_stream_completed_ttl = Integer(
+        10 * 60,  # 10 minutes
+        help="Seconds to keep the Redis stream of a build log once the build has finished, leaving followers time to catch up. Only used when `redis_url` is set",
+        config=True,
+    )
+
+    build_logs_stream_maxlen = Integer(
+        1000,
+        help="Approximate maximum number of entries kept in the Redis stream of a build log. Followers read older output from the stored log. Only used when `redis_url` is set",
+        config=True,
+    )
+
+    build_logs_buffer_size = Integer(
+        64 * 1024,
+        help="Bytes of build log output buffered by a worker before they are appended to the stored log",
+        config=True,
+    )
+
+    build_logs_flush_interval = Float(
+        2.0,
+        help="Maximum number of seconds build log output is buffered by a worker before it is appended to the stored log. Checked whenever output is written",
+        config=True,
+    )
+
     @validate("redis_url")
     def _check_redis(self, proposal):
         try:
@@ -301,6 +381,25 @@ class CondaStore(LoggingConfigurable):
             )
         return proposal.value
 
+    solve_cache_enabled = Bool(
+        True,
+        help="Reuse the lockfile of a previous solve when the specification, solve platforms, lock backend, conda flags and the repodata of every channel of the specification, as last downloaded by conda-store, are identical. Specifications with pip dependencies or channels which are not indexed by conda-store are never cached",
+        config=True,
+    )
+
+    solve_cache_ttl = Integer(
+        24 * 60 * 60,  # 1 day
+        help="Seconds after which a cached solve is no longer used. If set to None cached solves never expire",
+        config=True,
+        allow_none=True,
+    )
+
+    solve_cache_max_entries = Integer(
+        1000,
+        help="Maximum number of cached solves. The least recently used solves are evicted first",
+        config=True,
+    )
+
     storage_class = Type(
         default_value=storage.LocalStorage,
         klass=storage.Storage,
@@ -2,30 +2,219 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import base64
+import concurrent.futures
+import contextlib
+import datetime
+import gzip
+import hashlib
 import io
+import math
 import os
 import posixpath
 import shutil
+import tempfile
+import threading
+import time
+import typing
+import urllib.parse
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    # not available on windows, where reflinks are not attempted
+    fcntl = None
 
 import minio
+import urllib3
+import zstandard
 from minio.credentials.providers import Provider
-from traitlets import Bool, Dict, List, Type, Unicode
+from minio.datatypes import Part
+from minio.deleteobjects import DeleteObject
+from traitlets import Bool, Dict, Enum, Float, Integer, List, Type, Unicode
 from traitlets.config import LoggingConfigurable
 
 from conda_store_server import CONDA_STORE_DIR, api
 from conda_store_server._internal import orm, schema
 
+# Default size of the chunks yielded by Storage.get_stream
+STREAM_CHUNK_SIZE = 2**20  # 1 MiB
+
+# S3 object metadata naming the last segment merged into an appended object
+COMPACTED_THROUGH = "compacted-through"
+
+# Immutable artifacts that are stored under the sha256 of their content
+# when Storage.content_addressed is set. Logs are appended to and docker
+# layers are already content addressed by the registry
+CONTENT_ADDRESSED_ARTIFACT_TYPES = [
+    schema.BuildArtifactType.LOCKFILE,
+    schema.BuildArtifactType.YAML,
+    schema.BuildArtifactType.CONDA_PACK,
+    schema.BuildArtifactType.CONSTRUCTOR_INSTALLER,
+]
+
+
+# ioctl cloning the data blocks of a file on filesystems supporting
+# reflinks, e.g. btrfs and xfs. See ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+
+# Text artifacts that are compressed when Storage.compression is set. Logs
+# are not compressed since they are tailed by byte offset
+COMPRESSED_ARTIFACT_TYPES = [
+    schema.BuildArtifactType.LOCKFILE,
+    schema.BuildArtifactType.YAML,
+]
+
+
+def compress(value: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        # a fixed mtime keeps the output, and so content addresses, stable
+        return gzip.compress(value, mtime=0)
+    elif encoding == "zstd":
+        return zstandard.ZstdCompressor().compress(value)
+    raise ValueError(f"unsupported content encoding {encoding}")
+
+
+def decompress(value: bytes, encoding: str | None) -> bytes:
+    if encoding is None:
+        return value
+    elif encoding == "gzip":
+        return gzip.decompress(value)
+    elif encoding == "zstd":
+        return zstandard.ZstdDecompressor().decompressobj().decompress(value)
+    raise ValueError(f"unsupported content encoding {encoding}")
+
+
+def _reflink(source: str, destination: str):
+    """Create ``destination`` sharing the data blocks of ``source``, raises
+    OSError when the filesystem does not support it
+    """
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(destination)
+            raise
+
+
+def _read_file_range(
+    filename: str, start: int, end: int | None, chunk_size: int
+) -> typing.Iterator[bytes]:
+    with open(filename, "rb") as f:
+        f.seek(start)
+        remaining = None if end is None else end - start
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            chunk = f.read(size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def _sha256_file(filename: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class _IterableReader(io.RawIOBase):
+    """Read-only file object over an iterable of bytes"""
+
+    def __init__(self, iterable: typing.Iterable[bytes]):
+        self._iterator = iter(iterable)
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._iterator)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
 
 class Storage(LoggingConfigurable):
-    def fset(
+    content_addressed = Bool(
+        False,
+        help="Store lockfiles, environment exports, conda-pack archives and installers once under the sha256 of their content instead of once per build. Build artifacts reference the blob by digest and a blob is removed when the last artifact referencing it is deleted",
+        config=True,
+    )
+
+    compression = Enum(
+        ["gzip", "zstd"],
+        default_value=None,
+        allow_none=True,
+        help="compression of lockfiles and environment exports in storage. Reads decompress transparently and http clients accepting the encoding receive the compressed artifact",
+        config=True,
+    )
+
+    def compression_for(self, artifact_type: schema.BuildArtifactType) -> str | None:
+        """Content encoding of newly stored artifacts of ``artifact_type``"""
+        if artifact_type in COMPRESSED_ARTIFACT_TYPES:
+            return self.compression
+        return None
+
+    def blob_key(self, digest: str) -> str:
+        return f"blobs/sha256/{digest[:2]}/{digest}"
+
+    def is_content_addressed(self, artifact_type: schema.BuildArtifactType) -> bool:
+        return (
+            self.content_addressed and artifact_type in CONTENT_ADDRESSED_ARTIFACT_TYPES
+        )
+
+    def _register(
         self,
         db,
         build_id: int,
         key: str,
-        filename: str,
         artifact_type: schema.BuildArtifactType,
+        digest: str | None = None,
+        content_encoding: str | None = None,
     ):
+        """Record that ``key`` holds an artifact of ``build_id``
+
+        Registration is a single INSERT which is ignored when the artifact
+        is already registered, so that repeated writes such as log appends
+        cost one statement and concurrent writers cannot register the same
+        artifact twice. Only artifacts which may carry a digest or a
+        content encoding are compared against the existing row.
+        """
         ba = orm.BuildArtifact
+        result = db.execute(
+            api._insert_or_ignore(db, ba).values(
+                build_id=build_id,
+                key=key,
+                artifact_type=artifact_type,
+                digest=digest,
+                content_encoding=content_encoding,
+            )
+        )
+        db.commit()
+
+        if result.rowcount == 1 or (
+            digest is None
+            and content_encoding is None
+            and artifact_type not in CONTENT_ADDRESSED_ARTIFACT_TYPES
+            and artifact_type not in COMPRESSED_ARTIFACT_TYPES
+        ):
+            return
+
         exists = (
             db.query(ba)
             .filter(ba.build_id == build_id)
@@ -33,9 +222,25 @@ class Storage(LoggingConfigurable):
             .filter(ba.artifact_type == artifact_type)
             .first()
         )
-        if not exists:
-            db.add(ba(build_id=build_id, key=key, artifact_type=artifact_type))
+        if (exists.digest, exists.content_encoding) != (digest, content_encoding):
+            previous_digest = exists.digest
+            exists.digest = digest
+            exists.content_encoding = content_encoding
             db.commit()
+            if previous_digest is not None and previous_digest != digest:
+                self.collect_blob(db, previous_digest)
+
+    def fset(
+        self,
+        db,
+        build_id: int,
+        key: str,
+        filename: str,
+        artifact_type: schema.BuildArtifactType,
+        digest: str | None = None,
+        content_type: str | None = None,
+    ):
+        self._register(db, build_id, key, artifact_type, digest=digest)
 
     def set(
         self,
@@ -44,30 +249,246 @@ class Storage(LoggingConfigurable):
         key: str,
         value: bytes,
         artifact_type: schema.BuildArtifactType,
+        digest: str | None = None,
+        content_encoding: str | None = None,
+        content_type: str | None = None,
     ):
-        ba = orm.BuildArtifact
-        exists = (
-            db.query(ba)
-            .filter(ba.build_id == build_id)
-            .filter(ba.key == key)
-            .filter(ba.artifact_type == artifact_type)
-            .first()
+        self._register(
+            db,
+            build_id,
+            key,
+            artifact_type,
+            digest=digest,
+            content_encoding=content_encoding,
         )
-        if not exists:
-            db.add(ba(build_id=build_id, key=key, artifact_type=artifact_type))
-            db.commit()
+
+    def append(
+        self,
+        db,
+        build_id: int,
+        key: str,
+        value: bytes,
+        content_type: str,
+        artifact_type: schema.BuildArtifactType,
+    ):
+        """Append ``value`` to the object stored at ``key``
+
+        The default implementation reads the whole object and writes it
+        back, which is O(n) per call. Storage backends should override
+        this with a native append where possible. get must raise
+        FileNotFoundError for a missing object, any other error is raised
+        rather than overwriting the object.
+        """
+        try:
+            current_value = self.get(key)
+        except FileNotFoundError:
+            current_value = b""
+
+        self.set(
+            db,
+            build_id,
+            key,
+            (current_value or b"") + value,
+            content_type=content_type,
+            artifact_type=artifact_type,
+        )
+
+    def compact(self, key: str):
+        """Merge any pending appends to ``key`` into a single object"""
+        pass
+
+    def set_stream(
+        self,
+        db,
+        build_id: int,
+        key: str,
+        stream: typing.Iterable[bytes],
+        content_type: str,
+        artifact_type: schema.BuildArtifactType,
+    ):
+        """Store the chunks of ``stream`` at ``key``
+
+        The default implementation joins the chunks in memory and calls
+        set. Storage backends should override this to write the chunks as
+        they arrive.
+        """
+        if self.is_content_addressed(artifact_type) and not self.compression_for(
+            artifact_type
+        ):
+            self._set_stream_content_addressed(
+                db, build_id, key, stream, content_type, artifact_type
+            )
+            return
+
+        self.set(
+            db,
+            build_id,
+            key,
+            b"".join(stream),
+            content_type=content_type,
+            artifact_type=artifact_type,
+        )
+
+    def _set_stream_content_addressed(
+        self, db, build_id, key, stream, content_type, artifact_type
+    ):
+        # The digest is only known once the whole stream has been read, so
+        # the stream is spooled to disk before it is stored under its digest
+        with tempfile.NamedTemporaryFile() as f:
+            for chunk in stream:
+                f.write(chunk)
+            f.flush()
+            self.fset(
+                db,
+                build_id,
+                key,
+                f.name,
+                content_type=content_type,
+                artifact_type=artifact_type,
+            )
 
     def get(self, key: str):
         raise NotImplementedError()
 
+    def get_content_encoding(self, db, key: str) -> str | None:
+        """Content encoding of the stored artifact ``key``"""
+        build_artifact = api.list_build_artifacts(db, key=key).first()
+        return None if build_artifact is None else build_artifact.content_encoding
+
+    def get_artifact(self, db, key: str) -> bytes:
+        """Content of the artifact ``key``, read from its blob if it is
+        content addressed and decompressed
+        """
+        return decompress(
+            self.get(self.resolve_key(db, key)), self.get_content_encoding(db, key)
+        )
+
+    def get_stream(
+        self,
+        key: str,
+        start: int = 0,
+        end: int | None = None,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+    ) -> typing.Iterator[bytes]:
+        """Iterate over the bytes ``start`` to ``end`` (exclusive) of the
+        object at ``key``, or until the end of the object if ``end`` is None
+
+        The default implementation reads the whole object with get. Storage
+        backends should override this to read the range in chunks.
+        """
+        value = self.get(key)[start:end]
+        for i in range(0, len(value), chunk_size):
+            yield value[i : i + chunk_size]
+
+    def get_size(self, key: str) -> int:
+        return len(self.get(key))
+
     def get_url(self, key: str):
         raise NotImplementedError()
 
+    def temporary_directory(self) -> tempfile.TemporaryDirectory:
+        """Temporary directory to write artifacts to before storing them,
+        storage backends can choose one from which storing is cheap
+        """
+        return tempfile.TemporaryDirectory()
+
+    def get_sendfile_headers(self, key: str) -> typing.Dict[str, str]:
+        """Headers asking a fronting web server to send the object at
+        ``key`` itself, empty when clients should be redirected to get_url
+        """
+        return {}
+
+    def resolve_key(self, db, key: str) -> str:
+        """Key of the object holding the content of the artifact ``key``,
+        which is a blob for content addressed artifacts
+        """
+        build_artifact = (
+            api.list_build_artifacts(db, key=key)
+            .filter(orm.BuildArtifact.digest.is_not(None))
+            .first()
+        )
+        if build_artifact is None:
+            return key
+        return self.blob_key(build_artifact.digest)
+
+    def _remove_object(self, key: str):
+        """Remove the object at ``key``, the base class stores no objects"""
+        pass
+
+    def _remove_objects(self, keys: typing.List[str]):
+        """Remove the objects at ``keys``, storage backends should override
+        this when they support removing objects in bulk
+        """
+        for key in keys:
+            self._remove_object(key)
+
     def delete(self, db, build_id: int, key: str):
         build_artifact = api.get_build_artifact(db, build_id, key)
+        digest = build_artifact.digest
+        if digest is None and not self.is_shared(db, build_id, key):
+            self._remove_object(key)
+
         db.delete(build_artifact)
         db.commit()
 
+        if digest is not None:
+            self.collect_blob(db, digest)
+
+    def delete_many(self, db, build_artifacts: typing.List[orm.BuildArtifact]):
+        """Delete ``build_artifacts`` in a single transaction
+
+        Objects still referenced by artifacts outside of ``build_artifacts``
+        are kept, all other objects are removed in bulk once the
+        transaction is committed
+        """
+        if not build_artifacts:
+            return
+
+        ba = orm.BuildArtifact
+        ids = [build_artifact.id for build_artifact in build_artifacts]
+        # legacy lockfiles have an empty key and are stored in the database
+        keys = {a.key for a in build_artifacts if a.digest is None and a.key}
+        digests = {a.digest for a in build_artifacts if a.digest is not None}
+
+        db.query(ba).filter(ba.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+
+        shared_keys = api.get_referenced_build_artifact_keys(db, keys)
+        referenced_digests = api.get_referenced_build_artifact_digests(db, digests)
+        self._remove_objects(
+            sorted(keys - shared_keys)
+            + [self.blob_key(digest) for digest in sorted(digests - referenced_digests)]
+        )
+
+    def collect_blob(self, db, digest: str):
+        """Remove the blob ``digest`` once no build artifact references it"""
+        referenced = (
+            db.query(orm.BuildArtifact)
+            .filter(orm.BuildArtifact.digest == digest)
+            .first()
+        )
+        if referenced is None:
+            self.log.info(f"removing unreferenced blob sha256:{digest}")
+            self._remove_object(self.blob_key(digest))
+
+    def is_shared(self, db, build_id: int, key: str) -> bool:
+        """Whether artifacts of other builds reference the object at ``key``,
+        e.g. builds materialized from a build with an identical lockfile
+        """
+        return (
+            api.list_build_artifacts(db, key=key)
+            .filter(orm.BuildArtifact.build_id != build_id)
+            .first()
+            is not None
+        )
+
+
+def _is_resumable_error(e: Exception) -> bool:
+    """Whether an upload failed with a transient network or server error"""
+    if isinstance(e, minio.error.S3Error):
+        return e.response is not None and e.response.status >= 500
+    return isinstance(e, (minio.error.ServerError, urllib3.exceptions.HTTPError))
+
 
 class S3Storage(Storage):
     internal_endpoint = Unicode(
@@ -136,6 +557,36 @@ class S3Storage(Storage):
         config=True,
     )
 
+    append_compact_interval = Float(
+        30.0,
+        help="S3 has no append operation so appends, e.g. build logs, are stored as separate segment objects. This is the minimum number of seconds between merges of these segments into the main object. Segments are always merged when a build finishes",
+        config=True,
+    )
+
+    presigned_url_cache_ttl = Float(
+        60.0,
+        help="number of seconds presigned urls are reused for the same key. Presigning involves the credentials provider on every call and artifact endpoints are often hit in bursts, e.g. by JupyterHub spawns. Must be lower than the 7 day validity of the urls, 0 disables the cache",
+        config=True,
+    )
+
+    multipart_part_size = Integer(
+        64 * 2**20,
+        help="size in bytes of the parts of multipart uploads. Files larger than this, e.g. conda-pack archives and installers, are uploaded in parts. S3 requires parts of at least 5 MiB and allows at most 10000 parts per object, the part size is increased as needed",
+        config=True,
+    )
+
+    multipart_upload_max_age = Float(
+        24 * 60 * 60,  # 1 day
+        help="number of seconds after which an interrupted multipart upload is aborted instead of resumed. Uploads are only found again by uploading the same key, so a bucket lifecycle rule expiring incomplete multipart uploads is still needed to remove all of them",
+        config=True,
+    )
+
+    multipart_parallel_uploads = Integer(
+        4,
+        help="number of parts of a multipart upload that are uploaded concurrently. Each part in flight is held in memory",
+        config=True,
+    )
+
     @property
     def _credentials(self):
         if self.credentials is None:
@@ -184,32 +635,408 @@ class S3Storage(Storage):
         if not self._internal_client.bucket_exists(self.bucket_name):
             raise ValueError(f"S3 bucket={self.bucket_name} does not exist")
 
-    def fset(self, db, build_id, key, filename, content_type, artifact_type):
-        self.internal_client.fput_object(
-            self.bucket_name, key, filename, content_type=content_type
+    def _exists(self, key):
+        try:
+            self.internal_client.stat_object(self.bucket_name, key)
+        except minio.error.S3Error:
+            return False
+        return True
+
+    def _abort_multipart_upload(self, key, upload_id):
+        try:
+            self.internal_client._abort_multipart_upload(
+                self.bucket_name, key, upload_id
+            )
+        except (minio.error.MinioException, urllib3.exceptions.HTTPError) as e:
+            self.log.warning(
+                f"failed to abort upload of key={key} upload_id={upload_id}: {e}"
+            )
+
+    def _find_multipart_upload(self, key):
+        """Upload id and part etags of an interrupted multipart upload of
+        ``key``, if there is one
+
+        Only the most recent upload younger than ``multipart_upload_max_age``
+        is resumed, any other upload of ``key`` is aborted
+        """
+        result = self.internal_client._list_multipart_uploads(
+            self.bucket_name, prefix=key
+        )
+        uploads = sorted(
+            (upload for upload in result.uploads if upload.object_name == key),
+            key=lambda upload: (
+                upload.initiated_time
+                or datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+            ),
+            reverse=True,
         )
-        super().fset(db, build_id, key, filename, artifact_type)
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        max_age = datetime.timedelta(seconds=self.multipart_upload_max_age)
+        upload = None
+        for candidate in uploads:
+            if upload is None and (
+                candidate.initiated_time is None
+                or now - candidate.initiated_time < max_age
+            ):
+                upload = candidate
+            else:
+                self.log.info(
+                    f"aborting stale upload of key={key} upload_id={candidate.upload_id}"
+                )
+                self._abort_multipart_upload(key, candidate.upload_id)
+        if upload is None:
+            return None, {}
+
+        etags = {}
+        part_number_marker = None
+        while True:
+            result = self.internal_client._list_parts(
+                self.bucket_name,
+                key,
+                upload.upload_id,
+                part_number_marker=part_number_marker,
+            )
+            etags.update({part.part_number: part.etag for part in result.parts})
+            if not result.is_truncated:
+                return upload.upload_id, etags
+            part_number_marker = result.next_part_number_marker
+
+    def _fput_multipart(self, key, filename, content_type):
+        """Upload ``filename`` in concurrent parts of ``multipart_part_size``
+
+        Every part is sent with its Content-MD5 so S3 rejects corrupted
+        parts. Uploads interrupted by network or server errors are kept: the
+        next upload of the same key resumes it, skipping the parts whose
+        etag, the md5 of the part, matches the file. Uploads failing with any
+        other error are aborted, as are uploads which are never resumed, see
+        _find_multipart_upload. minio only exposes multipart uploads through
+        its private api.
+        """
+        size = os.path.getsize(filename)
+        part_size = max(self.multipart_part_size, 5 * 2**20, math.ceil(size / 10000))
+        part_count = max(math.ceil(size / part_size), 1)
+
+        upload_id, etags = self._find_multipart_upload(key)
+        if upload_id is None:
+            upload_id = self.internal_client._create_multipart_upload(
+                self.bucket_name, key, {"Content-Type": content_type}
+            )
+        else:
+            self.log.info(
+                f"resuming upload of key={key} with {len(etags)} of {part_count} parts uploaded"
+            )
+
+        def upload_part(part_number):
+            with open(filename, "rb") as f:
+                f.seek((part_number - 1) * part_size)
+                data = f.read(part_size)
+
+            md5 = hashlib.md5(data, usedforsecurity=False)
+            if etags.get(part_number) == md5.hexdigest():
+                return Part(part_number, etags[part_number])
+
+            etag = self.internal_client._upload_part(
+                self.bucket_name,
+                key,
+                data,
+                {"Content-MD5": base64.b64encode(md5.digest()).decode()},
+                upload_id,
+                part_number,
+            )
+            return Part(part_number, etag)
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.multipart_parallel_uploads
+            ) as executor:
+                parts = list(executor.map(upload_part, range(1, part_count + 1)))
+
+            self.internal_client._complete_multipart_upload(
+                self.bucket_name, key, upload_id, parts
+            )
+        except Exception as e:
+            if not _is_resumable_error(e):
+                self._abort_multipart_upload(key, upload_id)
+            raise
+
+    def fset(self, db, build_id, key, filename, content_type, artifact_type):
+        if self.compression_for(artifact_type):
+            with open(filename, "rb") as f:
+                value = f.read()
+            self.set(db, build_id, key, value, content_type, artifact_type)
+            return
+
+        digest = None
+        object_key = key
+        if self.is_content_addressed(artifact_type):
+            digest = _sha256_file(filename)
+            object_key = self.blob_key(digest)
+
+        if digest is None or not self._exists(object_key):
+            if os.path.getsize(filename) > self.multipart_part_size:
+                self._fput_multipart(object_key, filename, content_type)
+            else:
+                self.internal_client.fput_object(
+                    self.bucket_name, object_key, filename, content_type=content_type
+                )
+        super().fset(db, build_id, key, filename, artifact_type, digest=digest)
 
     def set(self, db, build_id, key, value, content_type, artifact_type):
+        content_encoding = self.compression_for(artifact_type)
+        metadata = None
+        if content_encoding is not None:
+            value = compress(value, content_encoding)
+            # served by S3 so clients following presigned urls decompress
+            metadata = {"Content-Encoding": content_encoding}
+
+        digest = None
+        object_key = key
+        if self.is_content_addressed(artifact_type):
+            digest = hashlib.sha256(value).hexdigest()
+            object_key = self.blob_key(digest)
+
+        if digest is None or not self._exists(object_key):
+            self.internal_client.put_object(
+                self.bucket_name,
+                object_key,
+                io.BytesIO(value),
+                length=len(value),
+                content_type=content_type,
+                metadata=metadata,
+            )
+        super().set(
+            db,
+            build_id,
+            key,
+            value,
+            artifact_type,
+            digest=digest,
+            content_encoding=content_encoding,
+        )
+
+    def _segment_prefix(self, key):
+        return f"{key}.segments/"
+
+    def append(self, db, build_id, key, value, content_type, artifact_type):
+        # Segment names sort in the order they were written, so compact can
+        # rebuild the object without having to track a counter
+        segment_key = (
+            f"{self._segment_prefix(key)}{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+        )
         self.internal_client.put_object(
             self.bucket_name,
-            key,
+            segment_key,
             io.BytesIO(value),
             length=len(value),
             content_type=content_type,
         )
-        super().fset(db, build_id, key, value, artifact_type)
+        super().set(db, build_id, key, value, artifact_type)
+
+        if not hasattr(self, "_last_compact"):
+            self._last_compact = {}
+        last_compact = self._last_compact.setdefault(key, time.monotonic())
+        if time.monotonic() - last_compact > self.append_compact_interval:
+            self.compact(key)
+
+    def _get_compacted(self, key):
+        """Content and etag of the object at ``key`` and the name of the last
+        segment merged into it, an empty object if it does not exist yet
+        """
+        try:
+            response = self.internal_client.get_object(self.bucket_name, key)
+        except minio.error.S3Error as e:
+            if e.code != "NoSuchKey":
+                raise
+            return b"", None, ""
+
+        try:
+            return (
+                response.read(),
+                response.headers.get("ETag", "").strip('"'),
+                response.headers.get(f"x-amz-meta-{COMPACTED_THROUGH}", ""),
+            )
+        finally:
+            response.close()
+            response.release_conn()
+
+    def _stat_compacted(self, key):
+        """Etag of the object at ``key`` and the name of the last segment
+        merged into it
+        """
+        try:
+            stat = self.internal_client.stat_object(self.bucket_name, key)
+        except minio.error.S3Error as e:
+            if e.code != "NoSuchKey":
+                raise
+            return None, ""
+        return stat.etag, stat.metadata.get(f"x-amz-meta-{COMPACTED_THROUGH}", "")
+
+    def compact(self, key):
+        """Merge the segments appended to ``key`` into the object
+
+        Tasks of the same build append to its log from different workers, so
+        compactions may run concurrently and nothing locks across hosts. The
+        object records the name of the last segment merged into it, segments
+        up to that name are skipped and only removed once the stored object
+        contains them. A compaction which finds that the object changed
+        since it was read leaves the segments to the next compaction, and
+        one which crashed before removing its segments does not merge them
+        again.
+        """
+        if not hasattr(self, "_last_compact"):
+            self._last_compact = {}
+        self._last_compact[key] = time.monotonic()
+
+        prefix = self._segment_prefix(key)
+        segments = sorted(
+            obj.object_name
+            for obj in self.internal_client.list_objects(
+                self.bucket_name, prefix=prefix, recursive=True
+            )
+        )
+        if not segments:
+            return
+
+        value, etag, compacted_through = self._get_compacted(key)
+        pending = [
+            segment
+            for segment in segments
+            if segment.removeprefix(prefix) > compacted_through
+        ]
+
+        if pending:
+            content_type = None
+            for segment in pending:
+                try:
+                    response = self.internal_client.get_object(
+                        self.bucket_name, segment
+                    )
+                except minio.error.S3Error as e:
+                    if e.code != "NoSuchKey":
+                        raise
+                    # removed by a concurrent compaction which merged it
+                    self.log.info(f"key={key} was compacted concurrently, skipping")
+                    return
+
+                try:
+                    content_type = content_type or response.headers.get("Content-Type")
+                    value += response.read()
+                finally:
+                    response.close()
+                    response.release_conn()
+
+            if self._stat_compacted(key)[0] != etag:
+                self.log.info(f"key={key} was compacted concurrently, skipping")
+                return
+
+            self.internal_client.put_object(
+                self.bucket_name,
+                key,
+                io.BytesIO(value),
+                length=len(value),
+                content_type=content_type or "application/octet-stream",
+                metadata={COMPACTED_THROUGH: pending[-1].removeprefix(prefix)},
+            )
+
+        # Only segments which the stored object contains are removed, which
+        # excludes those of a compaction that was overwritten concurrently
+        _, compacted_through = self._stat_compacted(key)
+        merged = [
+            segment
+            for segment in segments
+            if segment.removeprefix(prefix) <= compacted_through
+        ]
+        if not merged:
+            return
+
+        # remove_objects is lazy, errors are only reported while iterating
+        for error in self.internal_client.remove_objects(
+            self.bucket_name, [DeleteObject(segment) for segment in merged]
+        ):
+            self.log.warning(f"failed to remove segment of key={key}: {error}")
+
+    def set_stream(self, db, build_id, key, stream, content_type, artifact_type):
+        if self.is_content_addressed(artifact_type) or self.compression_for(
+            artifact_type
+        ):
+            super().set_stream(db, build_id, key, stream, content_type, artifact_type)
+            return
+
+        self.internal_client.put_object(
+            self.bucket_name,
+            key,
+            _IterableReader(stream),
+            length=-1,
+            part_size=self.multipart_part_size,
+            num_parallel_uploads=self.multipart_parallel_uploads,
+            content_type=content_type,
+        )
+        super().set(db, build_id, key, None, artifact_type)
 
     def get(self, key):
         response = self.internal_client.get_object(self.bucket_name, key)
-        return response.read()
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
+    def get_stream(self, key, start=0, end=None, chunk_size=STREAM_CHUNK_SIZE):
+        if end is not None and end <= start:
+            return
+
+        # a length of 0 reads until the end of the object
+        response = self.internal_client.get_object(
+            self.bucket_name,
+            key,
+            offset=start,
+            length=0 if end is None else end - start,
+        )
+        try:
+            yield from response.stream(chunk_size)
+        finally:
+            response.close()
+            response.release_conn()
+
+    def get_size(self, key):
+        return self.internal_client.stat_object(self.bucket_name, key).size
 
     def get_url(self, key):
-        return self.external_client.presigned_get_object(self.bucket_name, key)
+        if self.presigned_url_cache_ttl <= 0:
+            return self.external_client.presigned_get_object(self.bucket_name, key)
 
-    def delete(self, db, build_id, key):
+        if not hasattr(self, "_presigned_urls"):
+            self._presigned_urls = {}
+            self._presigned_urls_lock = threading.Lock()
+
+        now = time.monotonic()
+        with self._presigned_urls_lock:
+            cached = self._presigned_urls.get(key)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
+        url = self.external_client.presigned_get_object(self.bucket_name, key)
+        with self._presigned_urls_lock:
+            # Expired entries are only dropped once the cache grows, which
+            # bounds its size by the number of keys requested within a ttl
+            if len(self._presigned_urls) >= 1024:
+                self._presigned_urls = {
+                    k: v for k, v in self._presigned_urls.items() if v[1] > now
+                }
+            self._presigned_urls[key] = (url, now + self.presigned_url_cache_ttl)
+        return url
+
+    def _remove_object(self, key):
         self.internal_client.remove_object(self.bucket_name, key)
-        super().delete(db, build_id, key)
+
+    def _remove_objects(self, keys):
+        # remove_objects sends multi-object deletes of up to 1000 keys and
+        # is lazy, errors are only reported while iterating
+        for error in self.internal_client.remove_objects(
+            self.bucket_name, [DeleteObject(key) for key in keys]
+        ):
+            self.log.warning(f"failed to remove key={error.name}: {error}")
 
 
 class LocalStorage(Storage):
@@ -224,29 +1051,153 @@ class LocalStorage(Storage):
         config=True,
     )
 
-    def fset(self, db, build_id, key, filename, content_type=None, artifact_type=None):
+    sendfile_header = Enum(
+        ["X-Accel-Redirect", "X-Sendfile"],
+        default_value=None,
+        allow_none=True,
+        help="header used to hand artifact downloads to a fronting web server instead of redirecting to storage_url. X-Accel-Redirect for nginx, which serves sendfile_location, X-Sendfile for Apache and lighttpd, which serve the file path",
+        config=True,
+    )
+
+    sendfile_location = Unicode(
+        "/conda-store-storage/",
+        help="internal nginx location serving storage_path, used with sendfile_header X-Accel-Redirect",
+        config=True,
+    )
+
+    @contextlib.contextmanager
+    def _publish(self, key):
+        """Yield a staging filename next to the destination of ``key``, which
+        atomically replaces the destination once the block succeeds
+
+        Readers never see a partially written artifact
+        """
         destination_filename = os.path.abspath(os.path.join(self.storage_path, key))
-        os.makedirs(os.path.dirname(destination_filename), exist_ok=True)
+        directory, basename = os.path.split(destination_filename)
+        os.makedirs(directory, exist_ok=True)
+
+        staging_filename = os.path.join(
+            directory, f".{basename}.{uuid.uuid4().hex[:8]}.tmp"
+        )
+        try:
+            yield staging_filename
+            os.replace(staging_filename, destination_filename)
+        finally:
+            if os.path.exists(staging_filename):
+                os.remove(staging_filename)
 
-        shutil.copyfile(filename, destination_filename)
-        super().fset(db, build_id, key, filename, artifact_type)
+    def fset(self, db, build_id, key, filename, content_type=None, artifact_type=None):
+        if self.compression_for(artifact_type):
+            with open(filename, "rb") as f:
+                value = f.read()
+            self.set(db, build_id, key, value, content_type, artifact_type)
+            return
+
+        digest = None
+        object_key = key
+        if self.is_content_addressed(artifact_type):
+            digest = _sha256_file(filename)
+            object_key = self.blob_key(digest)
+
+        destination_filename = os.path.join(self.storage_path, object_key)
+        if digest is None or not os.path.exists(destination_filename):
+            with self._publish(object_key) as staging_filename:
+                # Reflinks and hardlinks avoid writing the artifact a second
+                # time, they require filename to be on the same filesystem,
+                # see temporary_directory. Callers must not modify filename
+                # afterwards since a hardlink shares its data
+                try:
+                    _reflink(filename, staging_filename)
+                except OSError:
+                    try:
+                        os.link(filename, staging_filename)
+                    except OSError:
+                        shutil.copyfile(filename, staging_filename)
+        super().fset(db, build_id, key, filename, artifact_type, digest=digest)
 
     def set(self, db, build_id, key, value, content_type=None, artifact_type=None):
+        content_encoding = self.compression_for(artifact_type)
+        if content_encoding is not None:
+            value = compress(value, content_encoding)
+
+        digest = None
+        object_key = key
+        if self.is_content_addressed(artifact_type):
+            digest = hashlib.sha256(value).hexdigest()
+            object_key = self.blob_key(digest)
+
+        destination_filename = os.path.join(self.storage_path, object_key)
+        if digest is None or not os.path.exists(destination_filename):
+            with self._publish(object_key) as staging_filename:
+                with open(staging_filename, "wb") as f:
+                    f.write(value)
+        super().set(
+            db,
+            build_id,
+            key,
+            value,
+            artifact_type,
+            digest=digest,
+            content_encoding=content_encoding,
+        )
+
+    def append(self, db, build_id, key, value, content_type=None, artifact_type=None):
         destination_filename = os.path.join(self.storage_path, key)
         os.makedirs(os.path.dirname(destination_filename), exist_ok=True)
 
-        with open(destination_filename, "wb") as f:
+        with open(destination_filename, "ab") as f:
             f.write(value)
         super().set(db, build_id, key, value, artifact_type)
 
+    def set_stream(
+        self, db, build_id, key, stream, content_type=None, artifact_type=None
+    ):
+        if self.is_content_addressed(artifact_type) or self.compression_for(
+            artifact_type
+        ):
+            super().set_stream(db, build_id, key, stream, content_type, artifact_type)
+            return
+
+        with self._publish(key) as staging_filename:
+            with open(staging_filename, "wb") as f:
+                for chunk in stream:
+                    f.write(chunk)
+        super().set(db, build_id, key, None, artifact_type)
+
     def get(self, key):
         with open(os.path.join(self.storage_path, key), "rb") as f:
             return f.read()
 
+    def get_stream(self, key, start=0, end=None, chunk_size=STREAM_CHUNK_SIZE):
+        yield from _read_file_range(
+            os.path.join(self.storage_path, key), start, end, chunk_size
+        )
+
+    def get_size(self, key):
+        return os.path.getsize(os.path.join(self.storage_path, key))
+
     def get_url(self, key):
         return posixpath.join(self.storage_url, key)
 
-    def delete(self, db, build_id, key):
+    def temporary_directory(self):
+        # on the filesystem of storage_path so artifacts can be linked
+        # instead of copied, see fset
+        staging_directory = os.path.join(self.storage_path, ".staging")
+        os.makedirs(staging_directory, exist_ok=True)
+        return tempfile.TemporaryDirectory(dir=staging_directory)
+
+    def get_sendfile_headers(self, key):
+        if self.sendfile_header == "X-Accel-Redirect":
+            return {
+                "X-Accel-Redirect": posixpath.join(
+                    self.sendfile_location, urllib.parse.quote(key)
+                )
+            }
+        elif self.sendfile_header == "X-Sendfile":
+            return {"X-Sendfile": os.path.abspath(os.path.join(self.storage_path, key))}
+        return {}
+
+    def _remove_object(self, key):
         filename = os.path.join(self.storage_path, key)
         try:
             os.remove(filename)
@@ -256,4 +1207,252 @@ class LocalStorage(Storage):
             # deleted. See LocalStorage.fset and Storage.fset, which are used
             # for saving build artifacts
             pass
-        super().delete(db, build_id, key)
+
+
+class CachedStorage(Storage):
+    """Read-through cache on local disk in front of another storage backend
+
+    Objects are cached by key in ``cache_directory`` and the least recently
+    used ones are evicted once the cache exceeds ``cache_max_size``. Writes
+    go through to the backend and are cached, appends and deletes invalidate
+    the cached object. Objects changed by other processes are not
+    invalidated, so keys of objects appended to, like build logs, are
+    excluded from the cache.
+    """
+
+    backend_class = Type(
+        default_value=S3Storage,
+        klass=Storage,
+        help="storage backend holding the artifacts",
+        config=True,
+    )
+
+    cache_directory = Unicode(
+        str(CONDA_STORE_DIR / "storage-cache"),
+        help="directory of the local cache of artifacts",
+        config=True,
+    )
+
+    cache_max_size = Integer(
+        10 * 2**30,
+        help="maximum size in bytes of the local cache of artifacts, least recently used artifacts are evicted first",
+        config=True,
+    )
+
+    cache_max_object_size = Integer(
+        100 * 2**20,
+        help="artifacts larger than this many bytes, e.g. conda-pack archives, are not cached",
+        config=True,
+    )
+
+    cache_excluded_prefixes = List(
+        ["logs/"],
+        help="prefixes of keys that are never cached because their objects change after being written",
+        config=True,
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._cache_lock = threading.Lock()
+        # unknown until the cache directory is first scanned, see _evict
+        self._cache_size = None
+
+    @property
+    def backend(self) -> Storage:
+        if hasattr(self, "_backend"):
+            return self._backend
+
+        self._backend = self.backend_class(parent=self, log=self.log)
+        return self._backend
+
+    def _cache_filename(self, key):
+        return os.path.join(
+            self.cache_directory, hashlib.sha256(key.encode("utf-8")).hexdigest()
+        )
+
+    def _is_cacheable(self, key, size):
+        return size <= self.cache_max_object_size and not any(
+            key.startswith(prefix) for prefix in self.cache_excluded_prefixes
+        )
+
+    def _cached(self, key):
+        """Filename of the cached object at ``key``, None on a cache miss"""
+        filename = self._cache_filename(key)
+        try:
+            # the modification time orders the cache for eviction
+            os.utime(filename)
+        except FileNotFoundError:
+            return None
+        return filename
+
+    def _cache_put(self, key, value=None, filename=None):
+        size = len(value) if filename is None else os.path.getsize(filename)
+        if not self._is_cacheable(key, size):
+            return
+
+        os.makedirs(self.cache_directory, exist_ok=True)
+        cache_filename = self._cache_filename(key)
+        staging_filename = f"{cache_filename}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            if filename is None:
+                with open(staging_filename, "wb") as f:
+                    f.write(value)
+            else:
+                shutil.copyfile(filename, staging_filename)
+            os.replace(staging_filename, cache_filename)
+        except OSError as e:
+            self.log.warning(f"failed to cache key={key}: {e}")
+            if os.path.exists(staging_filename):
+                os.remove(staging_filename)
+            return
+
+        with self._cache_lock:
+            if self._cache_size is not None:
+                self._cache_size += size
+            if self._cache_size is None or self._cache_size > self.cache_max_size:
+                self._cache_size = self._evict()
+
+    def _evict(self) -> int:
+        """Remove the least recently used cached objects until the cache
+        fits in cache_max_size, returns the size of the cache
+        """
+        entries = []
+        for entry in os.scandir(self.cache_directory):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.cache_max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+        return size
+
+    def _cache_invalidate(self, key):
+        try:
+            os.remove(self._cache_filename(key))
+        except FileNotFoundError:
+            pass
+
+    def fset(self, db, build_id, key, filename, content_type, artifact_type):
+        self.backend.fset(
+            db,
+            build_id,
+            key,
+            filename,
+            content_type=content_type,
+            artifact_type=artifact_type,
+        )
+        object_key = self.backend.resolve_key(db, key)
+        if self.backend.compression_for(artifact_type):
+            self._cache_invalidate(object_key)
+        else:
+            self._cache_put(object_key, filename=filename)
+
+    def set(self, db, build_id, key, value, content_type, artifact_type):
+        self.backend.set(
+            db,
+            build_id,
+            key,
+            value,
+            content_type=content_type,
+            artifact_type=artifact_type,
+        )
+        object_key = self.backend.resolve_key(db, key)
+        if self.backend.compression_for(artifact_type):
+            # the backend stores the compressed value
+            self._cache_invalidate(object_key)
+        else:
+            self._cache_put(object_key, value=value)
+
+    def append(self, db, build_id, key, value, content_type, artifact_type):
+        self.backend.append(
+            db,
+            build_id,
+            key,
+            value,
+            content_type=content_type,
+            artifact_type=artifact_type,
+        )
+        self._cache_invalidate(key)
+
+    def compact(self, key):
+        self.backend.compact(key)
+        self._cache_invalidate(key)
+
+    def set_stream(self, db, build_id, key, stream, content_type, artifact_type):
+        self.backend.set_stream(
+            db,
+            build_id,
+            key,
+            stream,
+            content_type=content_type,
+            artifact_type=artifact_type,
+        )
+        self._cache_invalidate(self.backend.resolve_key(db, key))
+
+    def get(self, key):
+        filename = self._cached(key)
+        if filename is not None:
+            with open(filename, "rb") as f:
+                return f.read()
+
+        value = self.backend.get(key)
+        self._cache_put(key, value=value)
+        return value
+
+    def get_stream(self, key, start=0, end=None, chunk_size=STREAM_CHUNK_SIZE):
+        filename = self._cached(key)
+        if filename is None:
+            yield from self.backend.get_stream(key, start, end, chunk_size)
+            return
+
+        yield from _read_file_range(filename, start, end, chunk_size)
+
+    def get_size(self, key):
+        filename = self._cached(key)
+        if filename is not None:
+            return os.path.getsize(filename)
+        return self.backend.get_size(key)
+
+    def get_url(self, key):
+        return self.backend.get_url(key)
+
+    def get_sendfile_headers(self, key):
+        return self.backend.get_sendfile_headers(key)
+
+    def temporary_directory(self):
+        return self.backend.temporary_directory()
+
+    def is_content_addressed(self, artifact_type):
+        return self.backend.is_content_addressed(artifact_type)
+
+    def compression_for(self, artifact_type):
+        return self.backend.compression_for(artifact_type)
+
+    def blob_key(self, digest):
+        return self.backend.blob_key(digest)
+
+    def resolve_key(self, db, key):
+        return self.backend.resolve_key(db, key)
+
+    def delete(self, db, build_id, key):
+        object_key = self.backend.resolve_key(db, key)
+        self.backend.delete(db, build_id, key)
+        self._cache_invalidate(object_key)
+
+    def delete_many(self, db, build_artifacts):
+        object_keys = [
+            a.key if a.digest is None else self.backend.blob_key(a.digest)
+            for a in build_artifacts
+        ]
+        self.backend.delete_many(db, build_artifacts)
+        for object_key in object_keys:
+            self._cache_invalidate(object_key)
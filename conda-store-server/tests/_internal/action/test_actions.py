@@ -4,6 +4,8 @@
 
 import asyncio
 import datetime
+import hashlib
+import json
 import os
 import pathlib
 import re
@@ -22,7 +24,9 @@ from traitlets import TraitError
 from conda_store_server import BuildKey, api
 from conda_store_server._internal import action, conda_utils, orm, schema, server
 from conda_store_server._internal.action import (
+    add_conda_prefix_packages,
     generate_constructor_installer,
+    install_lockfile,
 )
 from conda_store_server.server.auth import DummyAuthentication
 
@@ -149,13 +153,75 @@ def test_generate_constructor_installer(
     temp_directory.cleanup()
 
 
-def test_fetch_and_extract_conda_packages(tmp_path, simple_conda_lock):
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_fetch_and_extract_conda_packages(tmp_path, simple_conda_lock, max_workers):
     context = action.action_fetch_and_extract_conda_packages(
         conda_lock_spec=simple_conda_lock,
         pkgs_dir=tmp_path,
+        max_workers=max_workers,
     )
 
     assert context.stdout.getvalue()
+    for package in simple_conda_lock["package"]:
+        filename = pathlib.Path(package["url"]).name
+        assert (tmp_path / filename).exists()
+        extracted_dir = tmp_path / filename.removesuffix(".conda").removesuffix(
+            ".tar.bz2"
+        )
+        assert (extracted_dir / "info" / "repodata_record.json").exists()
+
+
+def test_fetch_and_extract_conda_packages_concurrent(tmp_path):
+    packages = [
+        {
+            "manager": "conda",
+            "platform": platform,
+            "url": f"https://conda.anaconda.org/conda-forge/noarch/pkg{i}-1.0-0.conda",
+        }
+        for i in range(8)
+        for platform in [conda_utils.conda_platform(), "noarch"]
+    ]
+
+    with mock.patch(
+        "conda_store_server._internal.action.download_packages._fetch_and_extract_conda_package",
+        return_value=1024,
+    ) as fetch:
+        context = action.action_fetch_and_extract_conda_packages(
+            conda_lock_spec={"package": packages},
+            pkgs_dir=tmp_path,
+            max_workers=3,
+        )
+
+    # packages listed for several platforms are only fetched once
+    assert fetch.call_count == 8
+    # workers don't get the context, results are logged by the action thread
+    assert all(len(call.args) == 2 for call in fetch.call_args_list)
+    for i in range(8):
+        assert f"DOWNLOAD pkg{i}-1.0-0.conda | {2 * i + 1} of 16" in (
+            context.stdout.getvalue()
+        )
+    assert "Downloaded 8 of 8 packages" in context.stdout.getvalue()
+    assert "using 3 workers" in context.stdout.getvalue()
+
+
+def test_fetch_and_extract_conda_packages_failure(tmp_path):
+    packages = [
+        {
+            "manager": "conda",
+            "platform": "noarch",
+            "url": "https://conda.anaconda.org/conda-forge/noarch/pkg-1.0-0.conda",
+        }
+    ]
+
+    with mock.patch(
+        "conda_store_server._internal.action.download_packages._fetch_and_extract_conda_package",
+        side_effect=RuntimeError("download failed"),
+    ):
+        with pytest.raises(RuntimeError, match="download failed"):
+            action.action_fetch_and_extract_conda_packages(
+                conda_lock_spec={"package": packages},
+                pkgs_dir=tmp_path,
+            )
 
 
 @pytest.mark.long_running_test
@@ -181,6 +247,81 @@ def test_install_lockfile(tmp_path, conda_store, simple_conda_lock):
     assert conda_utils.is_conda_prefix(conda_prefix)
 
 
+def test_diff_lockfile_packages():
+    def lockfile(*packages):
+        return {
+            "package": [
+                {
+                    "manager": "conda",
+                    "platform": "linux-64",
+                    "name": name,
+                    "url": f"https://conda.anaconda.org/conda-forge/linux-64/{name}-{version}-0.conda",
+                }
+                for name, version in packages
+            ]
+        }
+
+    removals, additions = install_lockfile.diff_lockfile_packages(
+        lockfile(("python", "3.12"), ("numpy", "1.0"), ("pandas", "2.0")),
+        lockfile(("python", "3.12"), ("numpy", "2.0"), ("scipy", "1.0")),
+        "linux-64",
+    )
+    assert removals == ["numpy", "pandas"]
+    assert [package["name"] for package in additions] == ["numpy", "scipy"]
+
+    with pytest.raises(ValueError):
+        install_lockfile.diff_lockfile_packages(
+            lockfile(("python", "3.12")),
+            {"package": [{"manager": "pip", "platform": "linux-64", "name": "flask"}]},
+            "linux-64",
+        )
+
+
+def test_clone_conda_prefix(tmp_path):
+    base_conda_prefix = tmp_path / "base"
+    (base_conda_prefix / "conda-meta").mkdir(parents=True)
+    (base_conda_prefix / "bin").mkdir()
+    (base_conda_prefix / "conda-meta" / "history").write_text("==> history <==\n")
+    (base_conda_prefix / "bin" / "tool").write_text(f"#!{base_conda_prefix}/bin/sh\n")
+    (base_conda_prefix / "lib.so").write_bytes(b"binary data")
+    (base_conda_prefix / "bin" / "link").symlink_to("tool")
+    (base_conda_prefix / "conda-meta" / "pkg-1.0-0.json").write_text(
+        json.dumps(
+            {
+                "paths_data": {
+                    "paths": [
+                        {
+                            "_path": "bin/tool",
+                            "path_type": "hardlink",
+                            "prefix_placeholder": "/opt/placeholder",
+                            "file_mode": "text",
+                        },
+                        {"_path": "lib.so", "path_type": "hardlink"},
+                        {"_path": "bin/link", "path_type": "softlink"},
+                    ]
+                }
+            }
+        )
+    )
+
+    conda_prefix = tmp_path / "clone"
+    install_lockfile.clone_conda_prefix(base_conda_prefix, conda_prefix)
+
+    # files embedding the prefix are copied and rewritten
+    assert (conda_prefix / "bin" / "tool").read_text() == f"#!{conda_prefix}/bin/sh\n"
+    assert (base_conda_prefix / "bin" / "tool").read_text() == (
+        f"#!{base_conda_prefix}/bin/sh\n"
+    )
+    # other package files are hardlinked, conda-meta is copied
+    assert os.path.samefile(conda_prefix / "lib.so", base_conda_prefix / "lib.so")
+    assert not os.path.samefile(
+        conda_prefix / "conda-meta" / "history",
+        base_conda_prefix / "conda-meta" / "history",
+    )
+    assert os.readlink(conda_prefix / "bin" / "link") == "tool"
+    assert conda_utils.is_conda_prefix(conda_prefix)
+
+
 @pytest.mark.long_running_test
 def test_generate_conda_export(conda_store, conda_prefix):
     context = action.action_generate_conda_export(
@@ -277,6 +418,61 @@ def test_add_conda_prefix_packages(db, conda_store, simple_specification, conda_
     assert len(build.package_builds) > 0
 
 
+def test_hash_file(tmp_path):
+    filename = tmp_path / "package.conda"
+    content = os.urandom(3 * 2**20 + 17)
+    filename.write_bytes(content)
+
+    assert add_conda_prefix_packages.hash_file(str(filename), chunk_size=2**20) == (
+        hashlib.md5(content).hexdigest(),
+        hashlib.sha256(content).hexdigest(),
+    )
+
+
+def test_package_hash_cache(tmp_path):
+    filename = tmp_path / "package.conda"
+    filename.write_bytes(b"package")
+    expected = add_conda_prefix_packages.hash_file(str(filename))
+
+    hash_cache = add_conda_prefix_packages.PackageHashCache(str(tmp_path))
+    assert hash_cache.get(str(filename)) == expected
+    hash_cache.save()
+    assert (tmp_path / add_conda_prefix_packages.PACKAGE_HASH_CACHE_FILENAME).exists()
+
+    # a new build sharing the package cache does not hash the tarball again
+    with mock.patch.object(add_conda_prefix_packages, "hash_file") as hash_file:
+        hash_cache = add_conda_prefix_packages.PackageHashCache(str(tmp_path))
+        assert tuple(hash_cache.get(str(filename))) == expected
+        hash_file.assert_not_called()
+
+    # a modified tarball is hashed again
+    filename.write_bytes(b"modified package")
+    hash_cache = add_conda_prefix_packages.PackageHashCache(str(tmp_path))
+    assert hash_cache.get(str(filename)) == add_conda_prefix_packages.hash_file(
+        str(filename)
+    )
+
+
+def test_get_package_hashes_repodata_record(tmp_path):
+    extracted_package_dir = tmp_path / "package"
+    (extracted_package_dir / "info").mkdir(parents=True)
+    record = mock.Mock(
+        extracted_package_dir=str(extracted_package_dir),
+        package_tarball_full_path=str(tmp_path / "package.conda"),
+    )
+
+    repodata_record = {"md5": "a" * 32, "sha256": "b" * 64}
+    (extracted_package_dir / "info" / "repodata_record.json").write_text(
+        json.dumps(repodata_record)
+    )
+
+    # the tarball doesn't exist, so the hashes have to come from the record
+    assert add_conda_prefix_packages.get_package_hashes(record, {}) == (
+        "a" * 32,
+        "b" * 64,
+    )
+
+
 @pytest.mark.long_running_test
 def test_add_lockfile_packages(
     db,
@@ -6,6 +6,7 @@ import contextlib
 import datetime
 import json
 import os
+import posixpath
 import sys
 import time
 
@@ -16,10 +17,11 @@ import yaml
 from fastapi import Request
 from fastapi.testclient import TestClient
 
-from conda_store_server import CONDA_STORE_DIR, __version__
+from conda_store_server import CONDA_STORE_DIR, __version__, api
 from conda_store_server._internal import schema
 from conda_store_server._internal.server import dependencies
 from conda_store_server._internal.server.pagination import Cursor
+from conda_store_server._internal.worker.build import copy_build_references
 from conda_store_server.server import schema as auth_schema
 
 
@@ -428,6 +430,20 @@ def test_api_get_build_one_auth(testclient, seed_conda_store, authenticate):
     assert r.data.id == 3
     assert r.data.specification.name == "name3"
     assert r.data.status == schema.BuildStatus.QUEUED.value
+    assert r.data.stage_durations is None
+
+
+def test_api_get_build_one_stage_durations(
+    db, testclient, seed_conda_store, authenticate
+):
+    api.get_build(db, 3).stage_durations = {"lock": 12.5, "install": 30.0}
+    db.commit()
+
+    response = testclient.get("api/v1/build/3")
+    response.raise_for_status()
+
+    r = schema.APIGetBuild.model_validate(response.json())
+    assert r.data.stage_durations == {"lock": 12.5, "install": 30.0}
 
 
 def test_api_get_build_one_unauth_packages(testclient, seed_conda_store):
@@ -478,6 +494,161 @@ def test_api_get_build_auth_logs_no_exist(testclient, seed_conda_store, authenti
     assert response.status_code == 404
 
 
+def test_api_get_build_logs_stream(testclient, seed_conda_store, authenticate):
+    # build 4 is completed, so the stream ends after the stored logs
+    response = testclient.get("api/v1/build/4/logs/stream/")
+    response.raise_for_status()
+    assert response.content == b"fake logs"
+
+    response = testclient.get("api/v1/build/4/logs/stream/?offset=5")
+    response.raise_for_status()
+    assert response.content == b"logs"
+
+
+def test_api_get_build_logs_stream_unauth(testclient, seed_conda_store):
+    response = testclient.get("api/v1/build/4/logs/stream/")
+    assert response.status_code == 403
+
+
+def test_api_get_build_archive_redirect(testclient, seed_conda_store, authenticate):
+    response = testclient.get("api/v1/build/4/archive/", follow_redirects=False)
+    assert response.status_code == 307
+
+
+@pytest.mark.parametrize(
+    "range_header, status_code, content, content_range",
+    [
+        (None, 200, b"testing-conda-package", None),
+        ("bytes=0-6", 206, b"testing", "bytes 0-6/21"),
+        ("bytes=8-", 206, b"conda-package", "bytes 8-20/21"),
+        ("bytes=-7", 206, b"package", "bytes 14-20/21"),
+        ("bytes=8-1000", 206, b"conda-package", "bytes 8-20/21"),
+        ("bytes=0-1,4-5", 200, b"testing-conda-package", None),
+        ("bytes=21-", 416, b"", "bytes */21"),
+    ],
+)
+def test_api_get_build_archive_proxied(
+    conda_store_server,
+    testclient,
+    seed_conda_store,
+    authenticate,
+    range_header,
+    status_code,
+    content,
+    content_range,
+):
+    conda_store_server.proxy_artifact_downloads = True
+
+    headers = {} if range_header is None else {"Range": range_header}
+    response = testclient.get("api/v1/build/4/archive/", headers=headers)
+    assert response.status_code == status_code
+    assert response.content == content
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers.get("content-range") == content_range
+
+
+def test_api_get_build_archive_sendfile(
+    conda_store_server, testclient, seed_conda_store, authenticate
+):
+    conda_store_server.conda_store.storage.sendfile_header = "X-Accel-Redirect"
+
+    response = testclient.get("api/v1/build/4/archive/", follow_redirects=False)
+    assert response.status_code == 200
+    assert response.content == b""
+    assert response.headers["x-accel-redirect"].startswith("/conda-store-storage/")
+    assert "attachment" in response.headers["content-disposition"]
+
+    response = testclient.get("api/v1/build/3/logs/", follow_redirects=False)
+    assert response.status_code == 200
+    assert "x-accel-redirect" in response.headers
+
+
+def test_storage_staging_not_served(testclient, conda_store_server):
+    storage = conda_store_server.conda_store.storage
+    with open(os.path.join(storage.storage_path, "served.txt"), "w") as f:
+        f.write("served")
+    response = testclient.get(posixpath.join(storage.storage_url, "served.txt"))
+    assert response.status_code == 200
+
+    # artifacts are written in the staging directory before being stored
+    with storage.temporary_directory() as tmpdir:
+        with open(os.path.join(tmpdir, "environment.tar.gz"), "w") as f:
+            f.write("partial")
+        path = os.path.relpath(
+            os.path.join(tmpdir, "environment.tar.gz"), storage.storage_path
+        )
+        assert path.startswith(".staging/")
+
+        response = testclient.get(posixpath.join(storage.storage_url, path))
+        assert response.status_code == 404
+
+
+def test_api_get_build_archive_deduplicated(
+    conda_store_server, testclient, seed_conda_store, authenticate
+):
+    conda_store_server.proxy_artifact_downloads = True
+    db = seed_conda_store
+    source_build = api.get_build(db, build_id=4)
+    deduplicated_build = api.create_build(
+        db, source_build.environment_id, source_build.specification_id
+    )
+    db.commit()
+    copy_build_references(db, source_build, deduplicated_build)
+
+    response = testclient.get(f"api/v1/build/{deduplicated_build.id}/archive/")
+    assert response.status_code == 200
+    assert response.content == b"testing-conda-package"
+    assert (
+        posixpath.basename(deduplicated_build.conda_pack_key)
+        in (response.headers["content-disposition"])
+    )
+
+
+def test_api_get_build_archive_proxied_unauth(
+    conda_store_server, testclient, seed_conda_store
+):
+    conda_store_server.proxy_artifact_downloads = True
+
+    response = testclient.get("api/v1/build/4/archive/")
+    assert response.status_code == 403
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, content_encoding",
+    [("gzip, deflate", "gzip"), ("gzip;q=0, identity", None), ("identity", None)],
+)
+def test_api_get_build_lockfile_compressed(
+    conda_store_server,
+    testclient,
+    seed_conda_store,
+    authenticate,
+    accept_encoding,
+    content_encoding,
+):
+    conda_store = conda_store_server.conda_store
+    conda_store.storage.compression = "gzip"
+    build = api.get_build(seed_conda_store, 4)
+    conda_store.storage.set(
+        seed_conda_store,
+        build.id,
+        build.conda_env_export_key,
+        b"name: testing\n",
+        content_type="text/yaml",
+        artifact_type=schema.BuildArtifactType.YAML,
+    )
+
+    response = testclient.get(
+        "api/v1/build/4/yaml/",
+        headers={"Accept-Encoding": accept_encoding},
+        follow_redirects=False,
+    )
+    assert response.status_code == 200
+    assert response.headers.get("content-encoding") == content_encoding
+    assert "Accept-Encoding" in response.headers["vary"]
+    # httpx decodes the content of compressed responses
+    assert response.content == b"name: testing\n"
+
+
 def test_api_get_build_one_unauth_yaml(testclient, seed_conda_store):
     response = testclient.get("api/v1/build/3/yaml/")
     assert response.status_code == 403
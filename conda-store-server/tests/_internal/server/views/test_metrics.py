@@ -2,6 +2,11 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import datetime
+
+from conda_store_server import api
+from conda_store_server._internal import orm
+
 
 def test_prometheus_metrics(testclient):
     response = testclient.get("metrics")
@@ -16,6 +21,62 @@ def test_prometheus_metrics(testclient):
     } <= d.keys()
 
 
+def test_prometheus_metrics_build_stage_durations(db, testclient, seed_conda_store):
+    for duration in [3.0, 45.0]:
+        api.observe_build_stage_duration(db, "lock", duration)
+    db.commit()
+
+    response = testclient.get("metrics")
+    lines = response.content.decode("utf-8").split("\n")
+    d = {line.rsplit(" ", 1)[0]: line.rsplit(" ", 1)[1] for line in lines}
+
+    name = "conda_store_build_stage_duration_seconds"
+    assert f"# TYPE {name}" in d
+    assert d[f'{name}_bucket{{stage="lock",le="1"}}'] == "0"
+    assert d[f'{name}_bucket{{stage="lock",le="5"}}'] == "1"
+    assert d[f'{name}_bucket{{stage="lock",le="60"}}'] == "2"
+    assert d[f'{name}_bucket{{stage="lock",le="+Inf"}}'] == "2"
+    assert d[f'{name}_sum{{stage="lock"}}'] == "48.0"
+    assert d[f'{name}_count{{stage="lock"}}'] == "2"
+
+
+def test_build_stage_duration_histograms_overflow(db):
+    api.observe_build_stage_duration(db, "install", 7200.0)
+    api.observe_build_stage_duration(db, "install", 7.5)
+    db.commit()
+
+    histogram = api.get_build_stage_duration_histograms(db)["install"]
+    assert histogram["buckets"][5] == 0
+    assert histogram["buckets"][10] == 1
+    assert histogram["buckets"][3600] == 1
+    assert histogram["count"] == 2
+    assert histogram["sum"] == 7207.5
+
+
+def test_prometheus_metrics_channel_fetches(db, testclient):
+    channel = api.create_conda_channel(db, "conda-forge")
+    db.flush()
+    db.add(
+        orm.CondaChannelSubdir(
+            channel_id=channel.id,
+            subdir="linux-64",
+            fetch_duration=1.5,
+            fetched_on=datetime.datetime(2026, 10, 17, tzinfo=datetime.timezone.utc),
+        )
+    )
+    db.commit()
+
+    response = testclient.get("metrics")
+    lines = response.content.decode("utf-8").split("\n")
+    d = {line.rsplit(" ", 1)[0]: line.rsplit(" ", 1)[1] for line in lines}
+
+    labels = 'channel="conda-forge",subdir="linux-64"'
+    assert d[f"conda_store_channel_fetch_duration_seconds{{{labels}}}"] == "1.5"
+    assert d[f"conda_store_channel_fetch_timestamp_seconds{{{labels}}}"] == str(
+        datetime.datetime(2026, 10, 17, tzinfo=datetime.timezone.utc).timestamp()
+    )
+
+
 def test_celery_stats(testclient, celery_worker):
     response = testclient.get("celery")
     assert response.json().keys() == {
@@ -0,0 +1,491 @@
+# Copyright (c) conda-store development team. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import bz2
+import hashlib
+import io
+import json
+import pathlib
+import threading
+from unittest import mock
+
+import pytest
+import requests
+import zstandard
+
+from conda_store_server._internal import conda_utils
+
+REPODATA = {
+    "info": {"subdir": "linux-64"},
+    "packages": {
+        "a-1.0-0.tar.bz2": {"name": "a", "version": "1.0", "size": 12345},
+        "b-2.0-0.tar.bz2": {"name": "b", "version": "2.0", "depends": ["a >=1"]},
+    },
+    "packages.conda": {},
+    "removed": ["c-1.0-0.tar.bz2"],
+    "repodata_version": 1,
+}
+REPODATA_HASH = hashlib.blake2b(
+    json.dumps(REPODATA).encode(), digest_size=32
+).hexdigest()
+
+
+JLAP_PATCHES = [
+    {
+        "from": "a" * 64,
+        "to": REPODATA_HASH,
+        "patch": [
+            {"op": "add", "path": "/packages/d-1.0-0.tar.bz2", "value": {"name": "d"}},
+        ],
+    },
+    {
+        "from": REPODATA_HASH,
+        "to": "c" * 64,
+        "patch": [
+            {"op": "remove", "path": "/packages/a-1.0-0.tar.bz2"},
+            {"op": "add", "path": "/packages/e-1.0-0.tar.bz2", "value": {"name": "e"}},
+            {"op": "add", "path": "/removed/-", "value": "a-1.0-0.tar.bz2"},
+            {"op": "replace", "path": "/info/subdir", "value": "linux-64"},
+        ],
+    },
+    {
+        "from": "c" * 64,
+        "to": "d" * 64,
+        "patch": [
+            {"op": "remove", "path": "/packages/e-1.0-0.tar.bz2"},
+            {"op": "add", "path": "/packages/f-1.0-0.tar.bz2", "value": {"name": "f"}},
+        ],
+    },
+]
+
+
+# JLAP_PATCHES followed by {"url": "repodata.json", "latest": "d" * 64},
+# written with conda.gateways.repodata.jlap.core.JLAP
+JLAP_CONTENT = (
+    pathlib.Path(__file__).parent.parent / "assets" / "repodata.jlap"
+).read_bytes()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 2**20])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_iter_json_object(chunk_size, indent):
+    f = io.StringIO(json.dumps(REPODATA, indent=indent))
+    assert list(conda_utils.iter_json_object(f, "packages", chunk_size)) == list(
+        REPODATA["packages"].items()
+    )
+
+
+def test_iter_json_object_missing_key():
+    f = io.StringIO(json.dumps({"info": {}, "repodata_version": 1}))
+    assert list(conda_utils.iter_json_object(f, "packages", chunk_size=4)) == []
+
+
+def test_iter_json_object_invalid():
+    f = io.StringIO('{"packages": {"a": {"name": ')
+    with pytest.raises(json.JSONDecodeError):
+        list(conda_utils.iter_json_object(f, "packages", chunk_size=4))
+
+
+def test_parse_jlap():
+    patches, metadata = conda_utils.parse_jlap(JLAP_CONTENT)
+    assert patches == JLAP_PATCHES
+    assert metadata == {"url": "repodata.json", "latest": "d" * 64}
+
+    with pytest.raises(conda_utils.JLAPError):
+        conda_utils.parse_jlap(JLAP_CONTENT.replace(b'"e"', b'"g"'))
+
+
+def test_apply_jlap_patches():
+    added, removed = conda_utils.apply_jlap_patches(
+        JLAP_PATCHES, "d" * 64, REPODATA_HASH
+    )
+    assert added == {"f-1.0-0.tar.bz2": {"name": "f"}}
+    assert removed == {"a-1.0-0.tar.bz2", "e-1.0-0.tar.bz2"}
+
+    assert conda_utils.apply_jlap_patches(JLAP_PATCHES, "d" * 64, "d" * 64) == (
+        {},
+        set(),
+    )
+
+
+@pytest.mark.parametrize(
+    "patches, current",
+    [
+        # the chain does not start from the current version
+        (JLAP_PATCHES, "b" * 64),
+        # changes to a field of a record need the previous record
+        (
+            [
+                {
+                    "from": REPODATA_HASH,
+                    "to": "d" * 64,
+                    "patch": [
+                        {
+                            "op": "replace",
+                            "path": "/packages/a-1.0-0.tar.bz2/depends/0",
+                            "value": "python",
+                        }
+                    ],
+                }
+            ],
+            REPODATA_HASH,
+        ),
+    ],
+)
+def test_apply_jlap_patches_invalid(patches, current):
+    with pytest.raises(conda_utils.JLAPError):
+        conda_utils.apply_jlap_patches(patches, "d" * 64, current)
+
+
+class FakeChannel:
+    """requests.Session of a channel serving the given files
+
+    Files are served with an ETag and respond 304 to a matching
+    If-None-Match, every request is recorded. ``statuses`` overrides the
+    status code of the given paths.
+    """
+
+    def __init__(self, files, statuses=None):
+        self.files = files
+        self.statuses = statuses or {}
+        self.requests = []
+
+    def get(self, url, headers=None, stream=False):
+        path = str(url).removeprefix("https://conda.example.com/channel/")
+        self.requests.append((path, headers or {}))
+
+        response = mock.MagicMock()
+        response.__enter__.return_value = response
+        response.headers = {"ETag": f'"{path}"'}
+        if path in self.statuses or path not in self.files:
+            response.status_code = self.statuses.get(path, 404)
+            response.raise_for_status.side_effect = requests.HTTPError(
+                response=response
+            )
+            return response
+        if (headers or {}).get("If-None-Match") == f'"{path}"':
+            response.status_code = 304
+            return response
+
+        content = self.files[path]
+        response.status_code = 200
+        response.content = content
+        response.iter_content.return_value = (
+            content[i : i + 5] for i in range(0, len(content), 5)
+        )
+        return response
+
+
+@pytest.fixture
+def channel_files():
+    return {
+        "channeldata.json": json.dumps(
+            {"packages": {"a": {"summary": "a", "description": "A", "home": "x"}}}
+        ).encode(),
+        "linux-64/repodata.json.zst": zstandard.ZstdCompressor().compress(
+            json.dumps(REPODATA).encode()
+        ),
+        "noarch/repodata.json.bz2": bz2.compress(json.dumps(REPODATA).encode()),
+    }
+
+
+def test_download_repodata(tmp_path, channel_files):
+    channel = FakeChannel(channel_files)
+    repodata = conda_utils.download_repodata(
+        "https://conda.example.com/channel",
+        str(tmp_path),
+        session=channel,
+        subdirs=["linux-64", "noarch"],
+        max_workers=1,
+    )
+
+    assert repodata["packages"] == {"a": {"summary": "a", "description": "A"}}
+    assert repodata["cache_headers"] == {
+        "linux-64": {
+            "filename": "repodata.json.zst",
+            "etag": '"linux-64/repodata.json.zst"',
+            "last_modified": None,
+            "repodata_hash": REPODATA_HASH,
+        },
+        "noarch": {
+            "filename": "repodata.json.bz2",
+            "etag": '"noarch/repodata.json.bz2"',
+            "last_modified": None,
+            "repodata_hash": REPODATA_HASH,
+        },
+    }
+    for subdir in ["linux-64", "noarch"]:
+        with open(repodata["architectures"][subdir]) as f:
+            assert json.load(f) == REPODATA
+
+    # repodata.json.zst is preferred and bz2 is used when it does not exist
+    assert [path for path, _ in channel.requests] == [
+        "linux-64/repodata.json.zst",
+        "noarch/repodata.json.zst",
+        "noarch/repodata.json.bz2",
+        "channeldata.json",
+    ]
+
+
+def test_download_repodata_forbidden(tmp_path, channel_files):
+    # S3 buckets answer 403 for missing objects
+    channel = FakeChannel(channel_files, statuses={"noarch/repodata.json.zst": 403})
+    repodata = conda_utils.download_repodata(
+        "https://conda.example.com/channel",
+        str(tmp_path),
+        session=channel,
+        subdirs=["noarch"],
+    )
+
+    assert [path for path, _ in channel.requests] == [
+        "noarch/repodata.json.zst",
+        "noarch/repodata.json.bz2",
+        "channeldata.json",
+    ]
+    assert repodata["cache_headers"]["noarch"]["filename"] == "repodata.json.bz2"
+    with open(repodata["architectures"]["noarch"]) as f:
+        assert json.load(f) == REPODATA
+
+
+def test_download_repodata_concurrent(tmp_path, channel_files):
+    class ConcurrentChannel(FakeChannel):
+        """Blocks the first request of each subdir until both are in flight"""
+
+        barrier = threading.Barrier(2)
+
+        def get(self, url, headers=None, stream=False):
+            if str(url).endswith("repodata.json.zst"):
+                self.barrier.wait(timeout=10)
+            return super().get(url, headers=headers, stream=stream)
+
+    channel = ConcurrentChannel(channel_files)
+    repodata = conda_utils.download_repodata(
+        "https://conda.example.com/channel",
+        str(tmp_path),
+        session=channel,
+        subdirs=["linux-64", "noarch"],
+        max_workers=2,
+    )
+
+    assert set(repodata["architectures"]) == {"linux-64", "noarch"}
+    assert set(repodata["fetch_durations"]) == {"linux-64", "noarch"}
+    assert all(duration >= 0 for duration in repodata["fetch_durations"].values())
+
+
+def test_http_session():
+    session = conda_utils.http_session(retries=5, backoff_factor=2.0, pool_maxsize=8)
+    assert (
+        conda_utils.http_session(retries=5, backoff_factor=2.0, pool_maxsize=8)
+        is session
+    )
+
+    adapter = session.get_adapter("https://conda.anaconda.org/conda-forge")
+    assert adapter._pool_maxsize == 8
+    assert adapter.max_retries.total == 5
+    assert adapter.max_retries.backoff_factor == 2.0
+    assert 503 in adapter.max_retries.status_forcelist
+
+
+def test_download_repodata_not_modified(tmp_path, channel_files):
+    channel = FakeChannel(channel_files)
+    cache_headers = {
+        "linux-64": {
+            "filename": "repodata.json.zst",
+            "etag": '"linux-64/repodata.json.zst"',
+            "last_modified": "Sat, 17 Oct 2026 10:00:00 GMT",
+        },
+        "noarch": {
+            "filename": "repodata.json.bz2",
+            "etag": '"outdated"',
+            "last_modified": None,
+        },
+    }
+    repodata = conda_utils.download_repodata(
+        "https://conda.example.com/channel",
+        str(tmp_path),
+        session=channel,
+        subdirs=["linux-64", "noarch"],
+        max_workers=1,
+        cache_headers=cache_headers,
+    )
+
+    # the unmodified subdir costs a single request, even though another
+    # subdir of the channel has been modified
+    assert list(repodata["architectures"]) == ["noarch"]
+    assert channel.requests == [
+        (
+            "linux-64/repodata.json.zst",
+            {
+                "If-None-Match": '"linux-64/repodata.json.zst"',
+                "If-Modified-Since": "Sat, 17 Oct 2026 10:00:00 GMT",
+            },
+        ),
+        ("noarch/repodata.json.bz2", {"If-None-Match": '"outdated"'}),
+        ("channeldata.json", {}),
+    ]
+
+    # nothing is downloaded when no subdir has been modified
+    channel.requests = []
+    repodata = conda_utils.download_repodata(
+        "https://conda.example.com/channel",
+        str(tmp_path),
+        session=channel,
+        subdirs=["linux-64"],
+        cache_headers=cache_headers,
+    )
+    assert repodata["architectures"] == {}
+    assert len(channel.requests) == 1
+
+
+def test_download_repodata_missing_subdir(tmp_path, channel_files):
+    channel = FakeChannel(channel_files)
+    with pytest.raises(requests.HTTPError):
+        conda_utils.download_repodata(
+            "https://conda.example.com/channel",
+            str(tmp_path),
+            subdirs=["win-64"],
+            session=channel,
+        )
+
+
+def test_download_repodata_jlap(tmp_path, channel_files):
+    channel_files["linux-64/repodata.jlap"] = JLAP_CONTENT
+    channel = FakeChannel(channel_files)
+    cache_headers = {
+        "linux-64": {
+            "filename": "repodata.json.zst",
+            "etag": '"outdated"',
+            "last_modified": None,
+            "repodata_hash": REPODATA_HASH,
+        }
+    }
+    repodata = conda_utils.download_repodata(
+        "https://conda.example.com/channel",
+        str(tmp_path),
+        session=channel,
+        subdirs=["linux-64"],
+        cache_headers=cache_headers,
+    )
+
+    # only the records added since the ingested version are downloaded
+    assert [path for path, _ in channel.requests] == [
+        "linux-64/repodata.jlap",
+        "channeldata.json",
+    ]
+    with open(repodata["architectures"]["linux-64"]) as f:
+        assert json.load(f) == {"packages": {"f-1.0-0.tar.bz2": {"name": "f"}}}
+    assert repodata["removed"] == {"linux-64": {"a-1.0-0.tar.bz2", "e-1.0-0.tar.bz2"}}
+    assert repodata["cache_headers"] == {
+        "linux-64": {
+            "filename": "repodata.jlap",
+            "etag": '"linux-64/repodata.jlap"',
+            "last_modified": None,
+            "repodata_hash": "d" * 64,
+        }
+    }
+
+    # an unmodified jlap file costs a single request
+    channel.requests = []
+    repodata = conda_utils.download_repodata(
+        "https://conda.example.com/channel",
+        str(tmp_path),
+        session=channel,
+        subdirs=["linux-64"],
+        cache_headers=repodata["cache_headers"],
+    )
+    assert repodata["architectures"] == {}
+    assert channel.requests == [
+        ("linux-64/repodata.jlap", {"If-None-Match": '"linux-64/repodata.jlap"'})
+    ]
+
+
+def test_download_repodata_jlap_fallback(tmp_path, channel_files):
+    channel_files["linux-64/repodata.jlap"] = JLAP_CONTENT
+    channel = FakeChannel(channel_files)
+    cache_headers = {
+        # the chain is broken for linux-64, noarch does not provide jlap
+        subdir: {
+            "filename": filename,
+            "etag": etag,
+            "last_modified": None,
+            "repodata_hash": "b" * 64,
+        }
+        for subdir, filename, etag in [
+            ("linux-64", "repodata.jlap", '"outdated"'),
+            ("noarch", "repodata.json.bz2", '"noarch/repodata.json.bz2"'),
+        ]
+    }
+    repodata = conda_utils.download_repodata(
+        "https://conda.example.com/channel",
+        str(tmp_path),
+        session=channel,
+        subdirs=["linux-64", "noarch"],
+        max_workers=1,
+        cache_headers=cache_headers,
+    )
+
+    assert channel.requests == [
+        ("linux-64/repodata.jlap", {"If-None-Match": '"outdated"'}),
+        ("linux-64/repodata.json.zst", {}),
+        ("noarch/repodata.jlap", {}),
+        ("noarch/repodata.json.bz2", {"If-None-Match": '"noarch/repodata.json.bz2"'}),
+        ("channeldata.json", {}),
+    ]
+    assert list(repodata["architectures"]) == ["linux-64"]
+    with open(repodata["architectures"]["linux-64"]) as f:
+        assert json.load(f) == REPODATA
+    assert repodata["cache_headers"]["linux-64"]["repodata_hash"] == REPODATA_HASH
+    # jlap is not requested again for noarch until its repodata changes
+    assert repodata["cache_headers"]["noarch"]["repodata_hash"] is None
+
+
+@pytest.mark.parametrize(
+    "content, statuses",
+    [
+        # missing jlap file on a host which answers 403
+        (None, {"linux-64/repodata.jlap": 403}),
+        (None, {"linux-64/repodata.jlap": 500}),
+        (b"not a jlap file\n{}\n00\n", {}),
+        # valid checksum, but the metadata has no latest version
+        (
+            b"00" * 32
+            + b'\n{"url": "repodata.json"}\n'
+            + hashlib.blake2b(
+                b'{"url": "repodata.json"}', key=b"\0" * 32, digest_size=32
+            )
+            .hexdigest()
+            .encode(),
+            {},
+        ),
+    ],
+)
+def test_download_repodata_jlap_error(tmp_path, channel_files, content, statuses):
+    if content is not None:
+        channel_files["linux-64/repodata.jlap"] = content
+    channel = FakeChannel(channel_files, statuses=statuses)
+    cache_headers = {
+        "linux-64": {
+            "filename": "repodata.jlap",
+            "etag": '"outdated"',
+            "last_modified": None,
+            "repodata_hash": REPODATA_HASH,
+        }
+    }
+    repodata = conda_utils.download_repodata(
+        "https://conda.example.com/channel",
+        str(tmp_path),
+        session=channel,
+        subdirs=["linux-64"],
+        cache_headers=cache_headers,
+    )
+
+    # the full repodata is downloaded instead of failing the update
+    assert [path for path, _ in channel.requests] == [
+        "linux-64/repodata.jlap",
+        "linux-64/repodata.json.zst",
+        "channeldata.json",
+    ]
+    with open(repodata["architectures"]["linux-64"]) as f:
+        assert json.load(f) == REPODATA
+    assert repodata["cache_headers"]["linux-64"]["repodata_hash"] == REPODATA_HASH
@@ -0,0 +1,128 @@
+# Copyright (c) conda-store development team. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import asyncio
+from unittest import mock
+
+import pytest
+
+from conda_store_server import api
+from conda_store_server._internal import log_stream
+
+
+async def _collect(iterator):
+    return [chunk async for chunk in iterator]
+
+
+def _mock_redis(conda_store):
+    conda_store.config.redis_url = "redis://localhost:6379/0"
+    conda_store._redis = mock.MagicMock()
+    conda_store._redis.incrby.return_value = 15
+    conda_store._redis.xread.return_value = []
+    return conda_store._redis
+
+
+def test_publish_logs_trims_stream(conda_store):
+    redis = _mock_redis(conda_store)
+    conda_store.config.build_logs_stream_maxlen = 50
+
+    log_stream.publish_logs(conda_store, 4, b"some logs")
+
+    pipeline = redis.pipeline.return_value
+    pipeline.xadd.assert_called_once_with(
+        log_stream.redis_stream_key(4),
+        {"offset": 6, "data": b"some logs"},
+        maxlen=50,
+        approximate=True,
+    )
+    pipeline.execute.assert_called_once()
+
+
+def test_expire_logs(conda_store):
+    redis = _mock_redis(conda_store)
+    conda_store.config.build_logs_stream_completed_ttl = 30
+
+    log_stream.expire_logs(conda_store, 4)
+
+    pipeline = redis.pipeline.return_value
+    pipeline.expire.assert_has_calls(
+        [
+            mock.call(log_stream.redis_stream_key(4), 30),
+            mock.call(log_stream.redis_size_key(4), 30),
+        ]
+    )
+
+
+def test_follow_logs_local_storage(db, conda_store, seed_conda_store):
+    build = api.get_build(db, build_id=4)
+
+    chunks = asyncio.run(
+        _collect(log_stream.follow_logs(conda_store, 4, build.log_key, offset=5))
+    )
+    assert b"".join(chunks) == b"logs"
+
+
+def test_follow_logs_status_interval(db, conda_store, seed_conda_store):
+    _mock_redis(conda_store)
+    build = api.get_build(db, build_id=4)
+
+    # the status is only checked again once status_interval has passed
+    with (
+        mock.patch.object(
+            log_stream, "_build_running", side_effect=[True, False]
+        ) as build_running,
+        mock.patch.object(log_stream, "time") as time,
+    ):
+        time.monotonic.side_effect = [0, 0, 0, 5, 10, 10]
+        chunks = asyncio.run(
+            _collect(
+                log_stream.follow_logs(
+                    conda_store,
+                    4,
+                    build.log_key,
+                    poll_interval=0,
+                    status_interval=10,
+                )
+            )
+        )
+
+    assert build_running.call_count == 2
+    assert conda_store.redis.xread.call_count == 4
+    # nothing was published, so the stored log is returned once finished
+    assert b"".join(chunks) == b"fake logs"
+
+
+def test_redis_log_reader_gap(db, conda_store, seed_conda_store):
+    redis = _mock_redis(conda_store)
+    build = api.get_build(db, build_id=4)
+    redis.xread.return_value = [
+        (b"stream", [(b"1-0", {b"offset": b"9", b"data": b" more"})])
+    ]
+
+    # the start of the log is only in storage once pending appends are
+    # compacted, e.g. S3 segments
+    with (
+        mock.patch.object(
+            conda_store.storage,
+            "get_stream",
+            side_effect=[iter([b"fake"]), iter([b"fake logs"])],
+        ),
+        mock.patch.object(conda_store.storage, "compact") as compact,
+    ):
+        reader = log_stream.RedisLogReader(conda_store, 4, build.log_key)
+        assert reader.read(0) == b"fake logs more"
+    compact.assert_called_once_with(build.log_key)
+
+
+def test_redis_log_reader_missing(db, conda_store, seed_conda_store):
+    redis = _mock_redis(conda_store)
+    build = api.get_build(db, build_id=4)
+    redis.xread.return_value = [
+        (b"stream", [(b"1-0", {b"offset": b"20", b"data": b" more"})])
+    ]
+
+    # bytes which cannot be read are not skipped silently
+    reader = log_stream.RedisLogReader(conda_store, 4, build.log_key)
+    with pytest.raises(RuntimeError):
+        reader.read(0)
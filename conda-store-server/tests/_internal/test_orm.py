@@ -2,14 +2,54 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import json
+import os
 from unittest import mock
 
 import pytest
+import sqlalchemy
 
 from conda_store_server import api
 from conda_store_server._internal import orm
 
 
+def mock_download_repodata(repodata, removed=None):
+    """download_repodata writing the repodata of each architecture to disk"""
+
+    def download_repodata(
+        channel,
+        directory,
+        subdirs=None,
+        cache_headers=None,
+        session=None,
+        max_workers=4,
+    ):
+        architectures = {}
+        for subdir, subdir_repodata in repodata["architectures"].items():
+            architectures[subdir] = os.path.join(directory, f"{subdir}.json")
+            with open(architectures[subdir], "w") as f:
+                json.dump(subdir_repodata, f)
+        return {
+            "packages": repodata.get("packages", {}),
+            "architectures": architectures,
+            "removed": {
+                subdir: (removed or {}).get(subdir, set()) for subdir in architectures
+            },
+            "cache_headers": {
+                subdir: {
+                    "filename": "repodata.json.zst",
+                    "etag": f'"{subdir}"',
+                    "last_modified": "Sat, 17 Oct 2026 10:00:00 GMT",
+                    "repodata_hash": "0" * 64,
+                }
+                for subdir in architectures
+            },
+            "fetch_durations": {subdir: 0.5 for subdir in architectures},
+        }
+
+    return download_repodata
+
+
 @pytest.fixture
 def populated_db(db):
     """A database fixture populated with
@@ -174,7 +214,7 @@ def test_repodata_multiple_packages():
 @mock.patch("conda_store_server._internal.conda_utils.download_repodata")
 def test_update_packages_first_time(mock_repdata, db, test_repodata):
     # mock download_repodata to return static test repodata
-    mock_repdata.return_value = test_repodata
+    mock_repdata.side_effect = mock_download_repodata(test_repodata)
 
     # create test channel
     channel = api.create_conda_channel(db, "test-channel-1")
@@ -194,7 +234,7 @@ def test_update_packages_add_existing_pkg_new_version(
     mock_repdata, populated_db, test_repodata
 ):
     # mock download_repodata to return static test repodata
-    mock_repdata.return_value = test_repodata
+    mock_repdata.side_effect = mock_download_repodata(test_repodata)
 
     # check state of db before updating packages
     count = (
@@ -273,7 +313,7 @@ def test_update_packages_multiple_subdirs(mock_repdata, populated_db):
             },
         }
     }
-    mock_repdata.return_value = repodata
+    mock_repdata.side_effect = mock_download_repodata(repodata)
 
     # check state of db before updating packages
     count = (
@@ -308,7 +348,7 @@ def test_update_packages_multiple_subdirs(mock_repdata, populated_db):
 @mock.patch("conda_store_server._internal.conda_utils.download_repodata")
 def test_update_packages_twice(mock_repdata, populated_db, test_repodata):
     # mock download_repodata to return static test repodata
-    mock_repdata.return_value = test_repodata
+    mock_repdata.side_effect = mock_download_repodata(test_repodata)
 
     def check_packages():
         # ensure package is added
@@ -357,7 +397,7 @@ def test_update_packages_twice(mock_repdata, populated_db, test_repodata):
 @mock.patch("conda_store_server._internal.conda_utils.download_repodata")
 def test_update_packages_new_package_channel(mock_repdata, populated_db, test_repodata):
     # mock download_repodata to return static test repodata
-    mock_repdata.return_value = test_repodata
+    mock_repdata.side_effect = mock_download_repodata(test_repodata)
 
     channel = (
         populated_db.query(orm.CondaChannel).filter(orm.CondaChannel.id == 2).first()
@@ -388,7 +428,7 @@ def test_update_packages_multiple_builds(
     mock_repdata, populated_db, test_repodata_multiple_packages
 ):
     # mock download_repodata to return static test repodata
-    mock_repdata.return_value = test_repodata_multiple_packages
+    mock_repdata.side_effect = mock_download_repodata(test_repodata_multiple_packages)
 
     count = populated_db.query(orm.CondaPackageBuild).count()
     assert count == 3
@@ -419,7 +459,7 @@ def test_update_packages_multiple_builds(
 def test_update_packages_channel_consistency(
     mock_repdata, populated_db, test_repodata_multiple_packages
 ):
-    mock_repdata.return_value = test_repodata_multiple_packages
+    mock_repdata.side_effect = mock_download_repodata(test_repodata_multiple_packages)
 
     channel = (
         populated_db.query(orm.CondaChannel).filter(orm.CondaChannel.id == 2).first()
@@ -451,3 +491,214 @@ def test_update_packages_channel_consistency(
     for b in builds:
         assert b.channel_id == 1
         assert b.package.channel_id == 1
+
+
+@mock.patch("conda_store_server._internal.conda_utils.download_repodata")
+def test_update_packages_batches(mock_repdata, db):
+    repodata = {"architectures": {"linux-64": {"packages": {}}}}
+    for i in range(25):
+        repodata["architectures"]["linux-64"]["packages"][f"pkg-{i}.tar.bz2"] = {
+            "build": "py_0",
+            "build_number": 0,
+            "depends": [],
+            "license": "BSD",
+            "md5": f"{i:032x}",
+            "name": f"pkg-{i % 10}",
+            "sha256": f"{i:064x}",
+            "size": 3832,
+            "subdir": "linux-64",
+            "timestamp": 1530731681870,
+            "version": "1.0.0",
+        }
+    mock_repdata.side_effect = mock_download_repodata(repodata)
+
+    channel = api.create_conda_channel(db, "test-channel-1")
+    channel.update_packages(db, "linux-64", batch_size=4)
+
+    # packages spanning several batches are only inserted once
+    assert db.query(orm.CondaPackage).count() == 10
+    assert db.query(orm.CondaPackageBuild).count() == 25
+
+    channel.update_packages(db, "linux-64", batch_size=4)
+    assert db.query(orm.CondaPackage).count() == 10
+    assert db.query(orm.CondaPackageBuild).count() == 25
+
+
+@mock.patch("conda_store_server._internal.conda_utils.download_repodata")
+def test_update_packages_staging(mock_repdata, db, test_repodata_multiple_packages):
+    mock_repdata.side_effect = mock_download_repodata(test_repodata_multiple_packages)
+    channel = api.create_conda_channel(db, "test-channel-1")
+    db.flush()
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(" ".join(statement.split()))
+
+    engine = db.get_bind()
+    sqlalchemy.event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        channel.update_packages(db, "linux-64")
+    finally:
+        sqlalchemy.event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+    # the records are merged with one set-based statement per table, without
+    # looking up the rows which already exist
+    assert [
+        statement.split(" (")[0]
+        for statement in statements
+        if statement.startswith("INSERT")
+    ] == [
+        "INSERT INTO conda_package_staging",
+        "INSERT INTO conda_package",
+        "INSERT INTO conda_package_build",
+        "INSERT INTO conda_channel_subdir",
+    ]
+    assert all(
+        " SELECT " in statement
+        for statement in statements
+        if statement.startswith(
+            ("INSERT INTO conda_package ", "INSERT INTO conda_package_build ")
+        )
+    )
+    assert not any(
+        statement.startswith("SELECT") and "FROM conda_package" in statement
+        for statement in statements
+    )
+    assert db.query(orm.CondaPackage).count() == 1
+    assert db.query(orm.CondaPackageBuild).count() == 2
+
+    # the staging table does not outlive the update
+    assert sqlalchemy.inspect(db.connection()).get_temp_table_names() == []
+
+
+def test_copy_value():
+    assert orm._copy_value("license", None) == "\\N"
+    assert orm._copy_value("license", "a\tb\nc\\d") == "a\\tb\\nc\\\\d"
+    assert orm._copy_value("size", 3832) == "3832"
+    assert orm._copy_value("constrains", None) == "null"
+    assert orm._copy_value("depends", ["python >=3.8"]) == '["python >=3.8"]'
+
+
+@mock.patch("conda_store_server._internal.conda_utils.download_repodata")
+def test_update_packages_cache_headers(mock_repdata, db, test_repodata):
+    mock_repdata.side_effect = mock_download_repodata(test_repodata)
+
+    channel = api.create_conda_channel(db, "test-channel-1")
+    channel.update_packages(db, "linux-64")
+    assert mock_repdata.call_args.kwargs["cache_headers"] == {}
+
+    channel_subdir = db.query(orm.CondaChannelSubdir).one()
+    assert channel_subdir.channel_id == channel.id
+    assert channel_subdir.subdir == "linux-64"
+    assert channel_subdir.etag == '"linux-64"'
+    assert channel_subdir.fetch_duration == 0.5
+    assert channel_subdir.fetched_on is not None
+
+    # the next update sends the cache headers of each subdir
+    channel.update_packages(db, "linux-64")
+    assert mock_repdata.call_args.kwargs["cache_headers"] == {
+        "linux-64": {
+            "filename": "repodata.json.zst",
+            "etag": '"linux-64"',
+            "last_modified": "Sat, 17 Oct 2026 10:00:00 GMT",
+            "repodata_hash": "0" * 64,
+        }
+    }
+    assert db.query(orm.CondaChannelSubdir).count() == 1
+
+
+@mock.patch("conda_store_server._internal.conda_utils.download_repodata")
+def test_update_packages_removed(mock_repdata, populated_db):
+    channel = (
+        populated_db.query(orm.CondaChannel).filter(orm.CondaChannel.id == 1).first()
+    )
+    package_builds = (
+        populated_db.query(orm.CondaPackageBuild)
+        .filter(orm.CondaPackageBuild.channel_id == 1)
+        .all()
+    )
+    assert len(package_builds) == 3
+    for b in package_builds:
+        b.filename = f"{b.package.name}-{b.package.version}-{b.build}.tar.bz2"
+    filenames = {b.filename for b in package_builds}
+
+    # package builds which are part of a build are kept
+    api.add_build_conda_package_builds(populated_db, 1, [package_builds[0].id])
+    populated_db.commit()
+
+    mock_repdata.side_effect = mock_download_repodata(
+        {"architectures": {"linux-64": {"packages": {}}}},
+        removed={"linux-64": filenames},
+    )
+    channel.update_packages(populated_db, "linux-64")
+
+    assert [
+        b.id
+        for b in populated_db.query(orm.CondaPackageBuild).filter(
+            orm.CondaPackageBuild.channel_id == 1
+        )
+    ] == [package_builds[0].id]
+
+
+@mock.patch("conda_store_server._internal.conda_utils.download_repodata")
+def test_update_packages_removed_format(mock_repdata, db):
+    record = {
+        "build": "h0",
+        "build_number": 0,
+        "depends": [],
+        "md5": "0" * 32,
+        "name": "foo",
+        "size": 1,
+        "subdir": "linux-64",
+        "version": "1.0",
+    }
+    repodata = {
+        "architectures": {
+            "linux-64": {
+                "packages": {
+                    "foo-1.0-h0.tar.bz2": {**record, "sha256": "1" * 64},
+                    "foo-1.0-h0.conda": {**record, "sha256": "2" * 64},
+                }
+            }
+        }
+    }
+    mock_repdata.side_effect = mock_download_repodata(repodata)
+    channel = api.create_conda_channel(db, "test-channel-1")
+    channel.update_packages(db, "linux-64")
+    assert {b.filename for b in db.query(orm.CondaPackageBuild)} == {
+        "foo-1.0-h0.tar.bz2",
+        "foo-1.0-h0.conda",
+    }
+
+    # removing one format of a package build keeps the other one
+    mock_repdata.side_effect = mock_download_repodata(
+        {"architectures": {"linux-64": {"packages": {}}}},
+        removed={"linux-64": {"foo-1.0-h0.tar.bz2"}},
+    )
+    channel.update_packages(db, "linux-64")
+    assert [(b.filename, b.sha256) for b in db.query(orm.CondaPackageBuild)] == [
+        ("foo-1.0-h0.conda", "2" * 64)
+    ]
+
+
+@mock.patch("conda_store_server._internal.conda_utils.download_repodata")
+def test_update_packages_filename_backfill(mock_repdata, populated_db, test_repodata):
+    # package builds indexed before their filename was recorded
+    package_build = (
+        populated_db.query(orm.CondaPackageBuild)
+        .filter_by(channel_id=1, build="py310h06a4308_0")
+        .one()
+    )
+    assert package_build.filename is None
+
+    (filename,) = test_repodata["architectures"]["linux-64"]["packages"]
+    test_repodata["architectures"]["linux-64"]["packages"][filename]["sha256"] = (
+        package_build.sha256
+    )
+    mock_repdata.side_effect = mock_download_repodata(test_repodata)
+    channel = populated_db.query(orm.CondaChannel).filter_by(id=1).one()
+    channel.update_packages(populated_db, "linux-64")
+
+    populated_db.refresh(package_build)
+    assert package_build.filename == filename
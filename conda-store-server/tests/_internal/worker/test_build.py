@@ -2,8 +2,14 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import datetime
+import json
+from unittest import mock
+
+import pytest
+
 from conda_store_server import api
-from conda_store_server._internal import schema
+from conda_store_server._internal import action, conda_utils, orm, schema
 from conda_store_server._internal.worker import build
 
 
@@ -42,3 +48,331 @@ def test_build_completed(db, conda_store, seed_conda_store):
         db, 2, str(test_build.build_path(conda_store))
     )
     assert build_artifact is not None
+
+
+def test_build_stage(db, seed_conda_store):
+    test_build = api.get_build(db, build_id=4)
+    with build.build_stage(db, test_build, "lock"):
+        pass
+    with build.build_stage(db, test_build, "install"):
+        pass
+
+    try:
+        with build.build_stage(db, test_build, "stats"):
+            raise ValueError("stage failed")
+    except ValueError:
+        pass
+
+    test_build = api.get_build(db, build_id=4)
+    assert test_build.stage_durations.keys() == {"lock", "install"}
+    assert all(duration >= 0 for duration in test_build.stage_durations.values())
+
+    # the running histograms are updated as stages complete
+    histograms = api.get_build_stage_duration_histograms(db)
+    assert histograms.keys() == {"lock", "install"}
+    assert histograms["lock"]["count"] == 1
+    assert histograms["lock"]["buckets"][1] == 1
+
+
+def test_append_to_logs(db, conda_store, seed_conda_store):
+    test_build = api.get_build(db, build_id=4)
+    build.append_to_logs(db, conda_store, test_build, "first line\n")
+    build.append_to_logs(db, conda_store, test_build, b"second line\n")
+    build.compact_logs(conda_store, test_build)
+
+    logs = conda_store.storage.get(test_build.log_key)
+    assert logs == b"fake logsfirst line\nsecond line\n"
+
+
+def test_compact_logs_expires_stream(db, conda_store, seed_conda_store):
+    test_build = api.get_build(db, build_id=4)
+    conda_store.config.redis_url = "redis://localhost:6379/0"
+
+    with mock.patch.object(build.log_stream, "expire_logs") as expire_logs:
+        build.set_build_started(db, test_build)
+        build.compact_logs(conda_store, test_build)
+        expire_logs.assert_not_called()
+
+        build.set_build_completed(db, conda_store, test_build)
+        build.compact_logs(conda_store, test_build)
+        expire_logs.assert_called_once_with(conda_store, test_build.id)
+
+
+def test_logged_stream_buffered(db, conda_store, seed_conda_store):
+    test_build = api.get_build(db, build_id=4)
+    conda_store.config.build_logs_buffer_size = 1000
+    conda_store.config.build_logs_flush_interval = 3600
+
+    stream = build.LoggedStream(db, conda_store, test_build, prefix="test: ")
+    with mock.patch.object(
+        conda_store.storage, "append", wraps=conda_store.storage.append
+    ) as append:
+        for i in range(500):
+            stream.write(f"line {i}\n\n")
+        # many small writes are appended in a few batches of ~1000 bytes
+        assert 5 <= append.call_count <= 10
+
+        # nothing is lost when the stream is closed
+        stream.close()
+
+    logs = conda_store.storage.get(test_build.log_key)
+    assert logs.endswith(
+        "".join(f"test: line {i}\n" for i in range(500)).encode("utf-8")
+    )
+
+
+def test_logged_stream_flush_interval(db, conda_store, seed_conda_store):
+    test_build = api.get_build(db, build_id=4)
+    conda_store.config.build_logs_buffer_size = 2**20
+    conda_store.config.build_logs_flush_interval = 5
+
+    stream = build.LoggedStream(db, conda_store, test_build)
+    with (
+        mock.patch.object(build.time, "monotonic", side_effect=[0, 1, 6]),
+        mock.patch.object(conda_store.storage, "append") as append,
+    ):
+        stream.write("one\n")
+        stream.write("two\n")
+        append.assert_not_called()
+        # the buffered lines are appended once the oldest is 5 seconds old
+        stream.write("three\n")
+        append.assert_called_once()
+    assert append.call_args.args[3] == b"one\ntwo\nthree\n"
+
+
+def test_logged_stream_action_flush(db, conda_store, seed_conda_store):
+    test_build = api.get_build(db, build_id=4)
+    conda_store.config.build_logs_flush_interval = 3600
+
+    @action.action
+    def action_fail(context):
+        context.stdout.write("output before the failure\n")
+        raise ValueError("failure")
+
+    stream = build.LoggedStream(db, conda_store, test_build)
+    with pytest.raises(ValueError):
+        action_fail(stdout=stream)
+
+    # the output of an action is appended when it fails
+    logs = conda_store.storage.get(test_build.log_key)
+    assert logs.endswith(b"output before the failure\n")
+
+
+def test_lock_environment_solve_cache(db, conda_store, seed_conda_store):
+    # the specification of build 1 only uses the conda-forge channel
+    specification = api.get_build(db, build_id=1).specification
+    channel = api.ensure_conda_channel(
+        db,
+        conda_utils.normalize_channel_name(
+            conda_store.config.conda_channel_alias, "conda-forge"
+        ),
+    )
+    channel_subdirs = {
+        subdir: orm.CondaChannelSubdir(
+            channel_id=channel.id, subdir=subdir, etag=f'"{subdir}-1"'
+        )
+        for subdir in ["linux-64", "noarch"]
+    }
+    db.add_all(channel_subdirs.values())
+    channel.last_update = datetime.datetime.utcnow()
+    db.commit()
+
+    locker = mock.Mock()
+    locker.lock_environment.return_value = {"package": [], "version": 1}
+
+    with mock.patch.object(
+        conda_store, "lock_plugin", return_value=("test-backend", locker)
+    ):
+        for _ in range(2):
+            result = build.lock_environment(
+                db, conda_store, specification, platforms=["linux-64"]
+            )
+            assert result == {"package": [], "version": 1}
+        assert locker.lock_environment.call_count == 1
+
+        # a channel update which downloads nothing new keeps the cached solve
+        channel.last_update = datetime.datetime.utcnow() + datetime.timedelta(1)
+        db.commit()
+        build.lock_environment(db, conda_store, specification, platforms=["linux-64"])
+        assert locker.lock_environment.call_count == 1
+
+        # new repodata for one of the solved subdirs invalidates it
+        channel_subdirs["noarch"].repodata_hash = "a" * 64
+        db.commit()
+        build.lock_environment(db, conda_store, specification, platforms=["linux-64"])
+        assert locker.lock_environment.call_count == 2
+
+    metrics = api.get_metrics(db)
+    assert metrics["solve_cache_hits"] == 2
+    assert metrics["solve_cache_misses"] == 2
+
+
+def test_lock_environment_solve_cache_uncacheable(db, conda_store, seed_conda_store):
+    # conda-forge has never been downloaded for osx-arm64, so its state is
+    # unknown
+    specification = api.get_build(db, build_id=1).specification
+    channel = api.ensure_conda_channel(
+        db,
+        conda_utils.normalize_channel_name(
+            conda_store.config.conda_channel_alias, "conda-forge"
+        ),
+    )
+    db.add_all(
+        orm.CondaChannelSubdir(channel_id=channel.id, subdir=subdir, etag='"1"')
+        for subdir in ["linux-64", "noarch"]
+    )
+    db.commit()
+
+    locker = mock.Mock()
+    locker.lock_environment.return_value = {"package": []}
+
+    with mock.patch.object(
+        conda_store, "lock_plugin", return_value=("test-backend", locker)
+    ):
+        for _ in range(2):
+            build.lock_environment(
+                db, conda_store, specification, platforms=["osx-arm64"]
+            )
+    assert locker.lock_environment.call_count == 2
+
+
+def test_incremental_base_build(db, conda_store, seed_conda_store):
+    base_build = api.get_build(db, build_id=4)
+    conda_lock_spec = {"package": []}
+    conda_store.storage.set(
+        db,
+        base_build.id,
+        base_build.conda_lock_key,
+        json.dumps(conda_lock_spec).encode("utf-8"),
+        content_type="application/json",
+        artifact_type=schema.BuildArtifactType.LOCKFILE,
+    )
+    test_build = api.create_build(
+        db, base_build.environment_id, base_build.specification_id
+    )
+    db.commit()
+
+    conda_store.config.build_incremental = False
+    assert build.incremental_base_build(db, conda_store, test_build) is None
+
+    conda_store.config.build_incremental = True
+    assert build.incremental_base_build(db, conda_store, test_build) == (
+        base_build,
+        conda_lock_spec,
+    )
+
+    # builds which did not complete can't be used as a base
+    base_build.status = schema.BuildStatus.FAILED
+    db.commit()
+    assert build.incremental_base_build(db, conda_store, test_build) is None
+
+
+def test_install_lockfile_incremental_fallback(
+    tmp_path, db, conda_store, seed_conda_store
+):
+    test_build = api.get_build(db, build_id=4)
+    conda_prefix = tmp_path / "prefix"
+
+    with (
+        mock.patch.object(
+            build,
+            "incremental_base_build",
+            return_value=(api.get_build(db, build_id=1), {"package": []}),
+        ),
+        mock.patch.object(
+            build.action,
+            "action_install_lockfile_incremental",
+            side_effect=RuntimeError("clone failed"),
+        ) as install_incremental,
+        mock.patch.object(build.action, "action_install_lockfile") as install,
+    ):
+        build.install_lockfile(
+            db, conda_store, test_build, {"package": []}, conda_prefix
+        )
+
+    install_incremental.assert_called_once()
+    install.assert_called_once()
+    assert install.call_args.kwargs["conda_prefix"] == conda_prefix
+    assert b"falling back to a full install" in conda_store.storage.get(
+        test_build.log_key
+    )
+
+
+def test_lockfile_hash():
+    def lockfile(*urls, **metadata):
+        return {
+            "metadata": metadata,
+            "package": [
+                {
+                    "manager": "conda",
+                    "platform": "linux-64",
+                    "name": url.split("-")[0],
+                    "url": url,
+                }
+                for url in urls
+            ],
+        }
+
+    # metadata and package order do not matter
+    assert build.lockfile_hash(
+        lockfile("a-1.0-0.conda", "b-1.0-0.conda", content_hash="1")
+    ) == build.lockfile_hash(
+        lockfile("b-1.0-0.conda", "a-1.0-0.conda", content_hash="2")
+    )
+    assert build.lockfile_hash(lockfile("a-1.0-0.conda")) != build.lockfile_hash(
+        lockfile("a-2.0-0.conda")
+    )
+
+
+def test_get_completed_build_by_lockfile_hash(db, seed_conda_store):
+    for build_id in [1, 4]:
+        api.get_build(db, build_id).lockfile_hash = "a" * 64
+    db.commit()
+
+    # only build 4 is completed
+    assert api.get_completed_build_by_lockfile_hash(db, "a" * 64).id == 4
+    assert (
+        api.get_completed_build_by_lockfile_hash(db, "a" * 64, exclude_build_id=4)
+        is None
+    )
+
+
+def test_coalesce_builds(conda_store):
+    with build.coalesce_builds(conda_store, "a" * 64):
+        pass
+    # the lock is released
+    with build.coalesce_builds(conda_store, "a" * 64):
+        pass
+
+
+def test_copy_build_references(db, conda_store, seed_conda_store):
+    source_build = api.get_build(db, build_id=4)
+    test_build = api.create_build(
+        db, source_build.environment_id, source_build.specification_id
+    )
+    db.commit()
+
+    build.copy_build_references(db, source_build, test_build)
+
+    assert {_.id for _ in test_build.package_builds} == {
+        _.id for _ in source_build.package_builds
+    }
+    conda_pack_artifacts = api.list_build_artifacts(
+        db,
+        build_id=test_build.id,
+        included_artifact_types=[schema.BuildArtifactType.CONDA_PACK],
+    ).all()
+    # the archive is downloaded from the object of the source build, the
+    # build's own conda_pack_key is never written
+    assert [_.key for _ in conda_pack_artifacts] == [source_build.conda_pack_key]
+    assert (
+        conda_store.storage.get(
+            conda_store.storage.resolve_key(db, conda_pack_artifacts[0].key)
+        )
+        == b"testing-conda-package"
+    )
+
+    # the archive is not generated again
+    with mock.patch.object(build.action, "action_generate_conda_pack") as conda_pack:
+        build.build_conda_pack(db, conda_store, test_build)
+    conda_pack.assert_not_called()
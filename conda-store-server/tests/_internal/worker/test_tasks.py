@@ -0,0 +1,49 @@
+# Copyright (c) conda-store development team. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import os
+from unittest import mock
+
+from conda_store_server import api
+from conda_store_server._internal import schema
+from conda_store_server._internal.worker import tasks
+
+
+def test_delete_builds_artifacts(db, conda_store, seed_conda_store):
+    builds = api.list_builds(db).all()
+    conda_prefixes = [build.build_path(conda_store) for build in builds]
+    for conda_prefix in conda_prefixes:
+        os.makedirs(conda_prefix, exist_ok=True)
+    conda_pack_filenames = [
+        os.path.join(conda_store.storage.storage_path, build.conda_pack_key)
+        for build in builds
+    ]
+    assert all(os.path.exists(filename) for filename in conda_pack_filenames)
+
+    progress = mock.Mock()
+    with mock.patch.object(tasks, "DELETE_BATCH_SIZE", 3):
+        tasks.delete_builds_artifacts(db, conda_store, builds, progress=progress)
+
+    assert api.list_build_artifacts(db).all() == []
+    assert not any(os.path.exists(conda_prefix) for conda_prefix in conda_prefixes)
+    assert not any(os.path.exists(filename) for filename in conda_pack_filenames)
+    assert progress.call_args_list == [mock.call(3, 4), mock.call(4, 4)]
+
+
+def test_delete_builds_artifacts_excluded(db, conda_store, seed_conda_store):
+    build = api.get_build(db, build_id=1)
+    os.makedirs(build.build_path(conda_store), exist_ok=True)
+
+    tasks.delete_builds_artifacts(
+        db,
+        conda_store,
+        [build],
+        excluded_artifact_types=[schema.BuildArtifactType.LOCKFILE],
+    )
+
+    artifact_types = {
+        build_artifact.artifact_type
+        for build_artifact in api.list_build_artifacts(db, build_id=build.id)
+    }
+    assert artifact_types == {schema.BuildArtifactType.LOCKFILE}
@@ -0,0 +1,101 @@
+# Copyright (c) conda-store development team. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import json
+import os
+import socket
+
+import pytest
+
+from conda_store_server import storage
+
+from .utils import format_results
+
+# Results of all benchmarks of the session, see pytest_terminal_summary
+RESULTS = []
+
+
+def pytest_collection_modifyitems(config, items):
+    # Benchmarks are slow and only meaningful when run on their own, so
+    # they only run when selected with ``-m benchmark``
+    if "benchmark" in (config.option.markexpr or ""):
+        return
+
+    skip = pytest.mark.skip(reason="benchmarks only run with -m benchmark")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not RESULTS:
+        return
+
+    terminalreporter.write_sep("=", "storage benchmarks")
+    terminalreporter.write_line(format_results(RESULTS))
+
+    # One json object per line, stable across runs so that CI can compare
+    # the output of two runs, e.g. before and after a dependency upgrade
+    output = os.environ.get("CONDA_STORE_BENCHMARK_OUTPUT")
+    if output:
+        with open(output, "w") as f:
+            for result in RESULTS:
+                f.write(json.dumps(result, sort_keys=True) + "\n")
+        terminalreporter.write_line(f"benchmark results written to {output}")
+
+
+@pytest.fixture
+def benchmark_results():
+    return RESULTS
+
+
+@pytest.fixture(scope="session")
+def s3_server():
+    """Local S3 compatible server, listening on the loopback interface"""
+    moto_server = pytest.importorskip("moto.server")
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    server = moto_server.ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+    yield f"127.0.0.1:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def local_storage(tmp_path):
+    store = storage.LocalStorage()
+    store.storage_path = str(tmp_path / "storage")
+    return store
+
+
+@pytest.fixture
+def s3_storage(s3_server):
+    import minio
+
+    bucket_name = "conda-store-benchmarks"
+    client = minio.Minio(
+        s3_server, access_key="testing", secret_key="testing", secure=False
+    )
+    if not client.bucket_exists(bucket_name):
+        client.make_bucket(bucket_name)
+
+    return storage.S3Storage(
+        internal_endpoint=s3_server,
+        external_endpoint=s3_server,
+        access_key="testing",
+        secret_key="testing",
+        internal_secure=False,
+        external_secure=False,
+        bucket_name=bucket_name,
+    )
+
+
+@pytest.fixture(params=["LocalStorage", "S3Storage"])
+def benchmark_storage(request):
+    if request.param == "LocalStorage":
+        return request.getfixturevalue("local_storage")
+    return request.getfixturevalue("s3_storage")
@@ -0,0 +1,136 @@
+# Copyright (c) conda-store development team. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+"""Throughput and latency benchmarks of the storage backends
+
+Run with ``pytest -m benchmark tests/benchmarks``. S3Storage runs against
+a local moto server, so no network access is needed. Results are printed
+at the end of the session and written as json lines to
+CONDA_STORE_BENCHMARK_OUTPUT when it is set.
+"""
+
+import os
+import shutil
+import time
+
+import pytest
+
+from conda_store_server._internal import schema
+
+from .utils import benchmark_sizes, format_size, iterations, measure, summarize
+
+# Sizes above this are only benchmarked through files and streams, since
+# set and get hold the whole artifact in memory
+MAX_IN_MEMORY_SIZE = 256 * 2**20
+
+pytestmark = pytest.mark.benchmark
+
+SIZES = benchmark_sizes()
+
+
+def _write_random_file(filename, size):
+    chunk = os.urandom(min(size, 2**20))
+    with open(filename, "wb") as f:
+        for offset in range(0, size, len(chunk)):
+            f.write(chunk[: size - offset])
+
+
+@pytest.mark.parametrize("size", SIZES, ids=format_size)
+def test_set_get_delete(db, benchmark_storage, benchmark_results, size):
+    if size > MAX_IN_MEMORY_SIZE:
+        pytest.skip("set and get hold the artifact in memory")
+
+    backend = type(benchmark_storage).__name__
+    value = os.urandom(size)
+    count = iterations(size)
+    keys = [f"benchmark/set-{i}" for i in range(count)]
+
+    def set_(i):
+        benchmark_storage.set(
+            db,
+            1,
+            keys[i],
+            value,
+            content_type="application/octet-stream",
+            artifact_type=schema.BuildArtifactType.YAML,
+        )
+
+    def get(i):
+        assert len(benchmark_storage.get(keys[i])) == size
+
+    def delete(i):
+        benchmark_storage.delete(db, 1, keys[i])
+
+    benchmark_results.append(summarize(backend, "set", size, measure(set_, count)))
+    benchmark_results.append(summarize(backend, "get", size, measure(get, count)))
+    benchmark_results.append(summarize(backend, "delete", 0, measure(delete, count)))
+
+
+@pytest.mark.parametrize("size", SIZES, ids=format_size)
+def test_fset_get_stream(db, tmp_path, benchmark_storage, benchmark_results, size):
+    backend = type(benchmark_storage).__name__
+    filename = str(tmp_path / "artifact.tar.gz")
+    _write_random_file(filename, size)
+    count = max(3, iterations(size) // 4)
+    keys = [f"benchmark/fset-{i}.tar.gz" for i in range(count)]
+
+    def fset(i):
+        with benchmark_storage.temporary_directory() as tmpdir:
+            # a fresh copy per iteration, LocalStorage may link the file
+            staged_filename = os.path.join(tmpdir, "artifact.tar.gz")
+            shutil.copyfile(filename, staged_filename)
+            start = time.perf_counter()
+            benchmark_storage.fset(
+                db,
+                1,
+                keys[i],
+                staged_filename,
+                content_type="application/gzip",
+                artifact_type=schema.BuildArtifactType.CONDA_PACK,
+            )
+            return time.perf_counter() - start
+
+    def get_stream(i):
+        assert (
+            sum(len(chunk) for chunk in benchmark_storage.get_stream(keys[i])) == size
+        )
+
+    benchmark_results.append(
+        summarize(backend, "fset", size, [fset(i) for i in range(count)])
+    )
+    benchmark_results.append(
+        summarize(backend, "get_stream", size, measure(get_stream, count))
+    )
+    for key in keys:
+        benchmark_storage.delete(db, 1, key)
+
+
+def test_append(db, benchmark_storage, benchmark_results):
+    backend = type(benchmark_storage).__name__
+    line = b"x" * 127 + b"\n"
+
+    def append(i):
+        benchmark_storage.append(
+            db,
+            1,
+            "benchmark/logs.log",
+            line,
+            content_type="text/plain",
+            artifact_type=schema.BuildArtifactType.LOGS,
+        )
+
+    benchmark_results.append(
+        summarize(backend, "append", len(line), measure(append, 200))
+    )
+    benchmark_storage.compact("benchmark/logs.log")
+    assert len(benchmark_storage.get("benchmark/logs.log")) == 200 * len(line)
+
+
+def test_get_url(benchmark_storage, benchmark_results):
+    backend = type(benchmark_storage).__name__
+
+    def get_url(i):
+        benchmark_storage.get_url(f"benchmark/url-{i}")
+
+    benchmark_results.append(summarize(backend, "get_url", 0, measure(get_url, 1000)))
@@ -0,0 +1,91 @@
+# Copyright (c) conda-store development team. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import math
+import os
+import re
+import time
+import typing
+
+SIZE_UNITS = {"B": 1, "KiB": 2**10, "MiB": 2**20, "GiB": 2**30}
+
+
+def parse_size(size: str) -> int:
+    match = re.fullmatch(r"(\d+)\s*(B|KiB|MiB|GiB)", size.strip())
+    if match is None:
+        raise ValueError(f"invalid size {size}, expected e.g. 64MiB")
+    return int(match.group(1)) * SIZE_UNITS[match.group(2)]
+
+
+def format_size(size: int) -> str:
+    for unit in ["GiB", "MiB", "KiB"]:
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f"{size // SIZE_UNITS[unit]}{unit}"
+    return f"{size}B"
+
+
+def benchmark_sizes() -> typing.List[int]:
+    """Artifact sizes to benchmark, from CONDA_STORE_BENCHMARK_SIZES
+
+    The defaults keep the suite fast, multi GB packs can be benchmarked
+    with e.g. CONDA_STORE_BENCHMARK_SIZES=1KiB,1MiB,64MiB,4GiB
+    """
+    sizes = os.environ.get("CONDA_STORE_BENCHMARK_SIZES", "1KiB,1MiB,64MiB")
+    return [parse_size(size) for size in sizes.split(",")]
+
+
+def iterations(size: int) -> int:
+    """Number of iterations moving about 256 MiB, between 3 and 50"""
+    return max(3, min(50, 256 * 2**20 // max(size, 1)))
+
+
+def percentile(values: typing.List[float], p: float) -> float:
+    """Nearest-rank percentile of ``values``"""
+    values = sorted(values)
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+def measure(function: typing.Callable[[int], None], count: int) -> typing.List[float]:
+    """Seconds taken by each of ``count`` calls of ``function(i)``"""
+    durations = []
+    for i in range(count):
+        start = time.perf_counter()
+        function(i)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def summarize(
+    backend: str, operation: str, size: int, durations: typing.List[float]
+) -> typing.Dict:
+    total = sum(durations)
+    return {
+        "backend": backend,
+        "operation": operation,
+        "size": format_size(size),
+        "iterations": len(durations),
+        "mb_per_s": round(size * len(durations) / 1e6 / total, 2)
+        if size and total
+        else None,
+        "p50_ms": round(percentile(durations, 50) * 1e3, 3),
+        "p99_ms": round(percentile(durations, 99) * 1e3, 3),
+    }
+
+
+def format_results(results: typing.List[typing.Dict]) -> str:
+    columns = [
+        "backend",
+        "operation",
+        "size",
+        "iterations",
+        "mb_per_s",
+        "p50_ms",
+        "p99_ms",
+    ]
+    rows = [columns] + [[str(result[c]) for c in columns] for result in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return "\n".join(
+        "  ".join(value.ljust(width) for value, width in zip(row, widths, strict=True))
+        for row in rows
+    )
@@ -2,9 +2,13 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import datetime
+
 import pytest
 
 from conda_store_server import api
+from conda_store_server._internal import orm
+from conda_store_server._internal.action import add_lockfile_packages
 from conda_store_server._internal.orm import NamespaceRoleMapping
 from conda_store_server.exception import BuildPathError
 
@@ -375,3 +379,70 @@ def test_build_path_too_long(db, conda_store, simple_specification):
         BuildPathError, match=r"build_path too long: must be <= 255 characters"
     ):
         build.build_path(conda_store)
+
+
+def test_create_or_ignore_conda_packages(
+    db, conda_store, simple_specification, simple_conda_lock
+):
+    packages = add_lockfile_packages.list_lockfile_packages(simple_conda_lock)
+    pypi_package = {**packages[0], "channel_id": "https://conda.anaconda.org/pypi"}
+
+    # a package build registered one at a time is reused by the bulk path
+    existing = api.create_or_ignore_conda_package(db, dict(packages[0]))
+    db.commit()
+
+    package_build_ids = api.create_or_ignore_conda_packages(
+        db, packages + [pypi_package]
+    )
+    db.commit()
+    assert len(package_build_ids) == len(packages)
+    assert package_build_ids[0] == existing.id
+
+    # registering the same packages again does not create new rows
+    num_package_builds = db.query(orm.CondaPackageBuild).count()
+    assert api.create_or_ignore_conda_packages(db, packages) == package_build_ids
+    assert db.query(orm.CondaPackageBuild).count() == num_package_builds
+
+    build_id = conda_store.register_environment(
+        db, specification=simple_specification, namespace="pytest"
+    )
+    api.add_build_conda_package_builds(db, build_id, package_build_ids)
+    api.add_build_conda_package_builds(db, build_id, package_build_ids)
+    db.commit()
+
+    build = api.get_build(db, build_id=build_id)
+    assert {_.id for _ in build.package_builds} == set(package_build_ids)
+
+
+def test_evict_solve_cache(db):
+    now = datetime.datetime.utcnow()
+    for i in range(5):
+        api.set_solve_cache(db, f"key-{i}", {"version": 1})
+        db.query(orm.SolveCache).filter(orm.SolveCache.key == f"key-{i}").update(
+            {"last_used_on": now - datetime.timedelta(minutes=i)}
+        )
+    db.commit()
+
+    api.evict_solve_cache(db, max_entries=3)
+    assert {entry.key for entry in db.query(orm.SolveCache)} == {
+        "key-0",
+        "key-1",
+        "key-2",
+    }
+
+    api.evict_solve_cache(db, max_entries=0)
+    assert db.query(orm.SolveCache).count() == 0
+
+
+def test_increment_solve_cache_metrics(db):
+    db.query(orm.CondaStoreConfiguration).delete()
+    db.commit()
+
+    # the configuration row is created by the first update
+    api.increment_solve_cache_metrics(db, hit=True)
+    api.increment_solve_cache_metrics(db, hit=False)
+    api.increment_solve_cache_metrics(db, hit=True)
+
+    configuration = orm.CondaStoreConfiguration.configuration(db)
+    assert configuration.solve_cache_hits == 2
+    assert configuration.solve_cache_misses == 1
@@ -2,6 +2,8 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import os
+from unittest import mock
 
 import pytest
 from celery.result import AsyncResult
@@ -9,7 +11,10 @@ from celery.result import AsyncResult
 from conda_store_server import api
 from conda_store_server._internal import action, conda_utils, schema
 from conda_store_server._internal.plugins.lock.conda_lock import conda_lock
-from conda_store_server.exception import CondaStorePluginNotFoundError
+from conda_store_server.exception import (
+    CondaStoreError,
+    CondaStorePluginNotFoundError,
+)
 
 
 @pytest.mark.long_running_test
@@ -189,3 +194,25 @@ def test_conda_store_get_lock_plugin_does_not_exist(conda_store):
     conda_store.config.lock_backend = lock_plugin_setting
     with pytest.raises(CondaStorePluginNotFoundError):
         conda_store.lock_plugin()
+
+
+def test_conda_store_pkgs_dir(tmp_path, conda_store, monkeypatch):
+    monkeypatch.delenv("CONDA_PKGS_DIRS", raising=False)
+    pkgs_dir = tmp_path / "pkgs"
+    conda_store.config.conda_pkgs_dir = str(pkgs_dir)
+
+    with mock.patch.object(conda_utils, "conda_root_package_dir") as root_package_dir:
+        assert conda_store.pkgs_dir == pkgs_dir
+        root_package_dir.assert_not_called()
+
+    conda_store.ensure_pkgs_dir()
+    assert pkgs_dir.is_dir()
+    assert os.environ["CONDA_PKGS_DIRS"] == str(pkgs_dir)
+
+
+def test_conda_store_pkgs_dir_not_writable(tmp_path, conda_store):
+    conda_store.config.conda_pkgs_dir = str(tmp_path / "pkgs")
+
+    with mock.patch.object(os, "access", return_value=False):
+        with pytest.raises(CondaStoreError, match="is not writable"):
+            conda_store.ensure_pkgs_dir()
@@ -1,11 +1,83 @@
+import base64
+import datetime
+import hashlib
 import os
+import shutil
+from unittest import mock
 
 import pytest
+import urllib3
+from minio.datatypes import Part
+from minio.error import S3Error
+from sqlalchemy import event
 
 from conda_store_server import api, storage
 from conda_store_server._internal import schema
 
 
+class FakeS3Client:
+    """In memory stand-in for the object operations of minio.Minio"""
+
+    def __init__(self):
+        self.objects = {}
+        self.writes = 0
+
+    def _missing(self, object_name):
+        return S3Error(
+            response=None,
+            code="NoSuchKey",
+            message="The specified key does not exist.",
+            resource=object_name,
+            request_id=None,
+            host_id=None,
+        )
+
+    def put_object(
+        self,
+        bucket_name,
+        object_name,
+        data,
+        length,
+        content_type="application/octet-stream",
+        metadata=None,
+    ):
+        self.writes += 1
+        self.objects[object_name] = (
+            data.read(),
+            {
+                "ETag": f'"{self.writes}"',
+                "Content-Type": content_type,
+                **{f"x-amz-meta-{k}": v for k, v in (metadata or {}).items()},
+            },
+        )
+
+    def get_object(self, bucket_name, object_name):
+        if object_name not in self.objects:
+            raise self._missing(object_name)
+        value, headers = self.objects[object_name]
+        response = mock.Mock(headers=headers)
+        response.read.return_value = value
+        return response
+
+    def stat_object(self, bucket_name, object_name):
+        if object_name not in self.objects:
+            raise self._missing(object_name)
+        _, headers = self.objects[object_name]
+        return mock.Mock(etag=headers["ETag"].strip('"'), metadata=headers)
+
+    def list_objects(self, bucket_name, prefix, recursive=False):
+        return [
+            mock.Mock(object_name=name)
+            for name in sorted(self.objects)
+            if name.startswith(prefix)
+        ]
+
+    def remove_objects(self, bucket_name, delete_object_list):
+        for delete_object in delete_object_list:
+            self.objects.pop(delete_object.name, None)
+        return iter([])
+
+
 @pytest.fixture
 def local_file_store(tmp_path):
     """Setup a tmp dir with 2 test files and a logs dir"""
@@ -39,6 +111,34 @@ class TestStorage:
         store.fset(db, artifact.build_id, artifact.key, "", artifact.artifact_type)
         assert len(api.list_build_artifacts(db).all()) == len(inital_artifacts)
 
+    def test_register_single_statement(self, db):
+        store = storage.Storage()
+        store.fset(db, 123, "logs/build.log", "", schema.BuildArtifactType.LOGS)
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.get_bind(), "before_cursor_execute", record)
+        try:
+            store.fset(db, 123, "logs/build.log", "", schema.BuildArtifactType.LOGS)
+        finally:
+            event.remove(db.get_bind(), "before_cursor_execute", record)
+
+        assert len(statements) == 1
+        assert statements[0].startswith("INSERT INTO build_artifact")
+        assert len(api.list_build_artifacts(db).all()) == 1
+
+    def test_register_updates_digest(self, db):
+        store = storage.Storage()
+        store.fset(db, 123, "key", "", schema.BuildArtifactType.YAML)
+        store.fset(db, 123, "key", "", schema.BuildArtifactType.YAML, digest="a" * 64)
+
+        build_artifacts = api.list_build_artifacts(db).all()
+        assert len(build_artifacts) == 1
+        assert build_artifacts[0].digest == "a" * 64
+
     def test_delete_existing_artifact(self, seed_conda_store):
         store = storage.Storage()
         db = seed_conda_store
@@ -49,6 +149,50 @@ class TestStorage:
         store.delete(db, artifact.build_id, artifact.key)
         assert len(api.list_build_artifacts(db).all()) == len(inital_artifacts) - 1
 
+    def test_append_default(self, db):
+        store = storage.Storage()
+        store.get = mock.Mock(side_effect=FileNotFoundError)
+
+        # the base class accepts the content type passed by append
+        store.append(
+            db,
+            123,
+            "logs/build.log",
+            b"line\n",
+            "text/plain",
+            schema.BuildArtifactType.LOGS,
+        )
+        assert len(api.list_build_artifacts(db).all()) == 1
+
+    def test_append_default_read_error(self, db):
+        store = storage.Storage()
+        store.get = mock.Mock(side_effect=OSError("connection reset"))
+
+        # a failed read must not replace the log with the appended value
+        with mock.patch.object(store, "set") as set_:
+            with pytest.raises(OSError):
+                store.append(
+                    db,
+                    123,
+                    "logs/build.log",
+                    b"line\n",
+                    "text/plain",
+                    schema.BuildArtifactType.LOGS,
+                )
+        set_.assert_not_called()
+
+    def test_set_stream_content_addressed(self, db):
+        store = storage.Storage(content_addressed=True)
+        store.set_stream(
+            db,
+            123,
+            "lockfile/build.json",
+            [b"{}"],
+            "application/json",
+            schema.BuildArtifactType.LOCKFILE,
+        )
+        assert len(api.list_build_artifacts(db).all()) == 1
+
 
 class TestLocalStorage:
     def test_fset_new_package(self, db, local_file_store):
@@ -86,6 +230,51 @@ class TestLocalStorage:
         target_content = open(target_file).read()
         assert target_content == "testfile1"
 
+    def test_fset_links_same_filesystem(self, db, local_file_store):
+        store = storage.LocalStorage()
+        store.storage_path = str(local_file_store)
+
+        with store.temporary_directory() as tmpdir:
+            filename = os.path.join(tmpdir, "environment.tar.gz")
+            with open(filename, "wb") as f:
+                f.write(b"archive")
+
+            with mock.patch.object(shutil, "copyfile") as copyfile:
+                store.fset(
+                    db,
+                    123,
+                    "archive/new_build_key.tar.gz",
+                    filename,
+                    "application/gzip",
+                    schema.BuildArtifactType.CONDA_PACK,
+                )
+            copyfile.assert_not_called()
+
+        assert store.get("archive/new_build_key.tar.gz") == b"archive"
+        assert os.listdir(local_file_store / "archive") == ["new_build_key.tar.gz"]
+
+    def test_set_stream_atomic(self, db, local_file_store):
+        store = storage.LocalStorage()
+        store.storage_path = str(local_file_store)
+
+        def failing_stream():
+            yield b"partial"
+            raise RuntimeError("connection lost")
+
+        with pytest.raises(RuntimeError):
+            store.set_stream(
+                db,
+                123,
+                "testfile1",
+                failing_stream(),
+                "text/plain",
+                schema.BuildArtifactType.YAML,
+            )
+
+        # the previous content is untouched and no staging file is left
+        assert store.get("testfile1") == b"testfile1"
+        assert not [f for f in os.listdir(local_file_store) if f.endswith(".tmp")]
+
     def test_set_new_package(self, db, local_file_store):
         store = storage.LocalStorage()
         store.storage_path = local_file_store
@@ -105,6 +294,24 @@ class TestLocalStorage:
         target_content = open(target_file).read()
         assert target_content == "somestuff"
 
+    def test_append(self, db, local_file_store):
+        store = storage.LocalStorage()
+        store.storage_path = local_file_store
+
+        for line in [b"line one\n", b"line two\n"]:
+            store.append(
+                db,
+                123,
+                "logs/new_build_key.log",
+                line,
+                "text/plain",
+                schema.BuildArtifactType.LOGS,
+            )
+        assert len(api.list_build_artifacts(db).all()) == 1
+
+        content = store.get("logs/new_build_key.log")
+        assert content == b"line one\nline two\n"
+
     def test_get(self, local_file_store):
         store = storage.LocalStorage()
         store.storage_path = local_file_store
@@ -112,6 +319,59 @@ class TestLocalStorage:
         content = store.get("testfile1")
         assert content == b"testfile1"
 
+    @pytest.mark.parametrize(
+        "start, end, chunk_size, expected",
+        [
+            (0, None, 4, [b"test", b"file", b"1"]),
+            (4, None, 1024, [b"file1"]),
+            (2, 6, 3, [b"stf", b"i"]),
+            (4, 4, 1024, []),
+            (20, None, 1024, []),
+        ],
+    )
+    def test_get_stream(self, local_file_store, start, end, chunk_size, expected):
+        store = storage.LocalStorage()
+        store.storage_path = local_file_store
+
+        chunks = store.get_stream("testfile1", start, end, chunk_size=chunk_size)
+        assert list(chunks) == expected
+        assert store.get_size("testfile1") == len(b"testfile1")
+
+    def test_set_stream(self, db, local_file_store):
+        store = storage.LocalStorage()
+        store.storage_path = local_file_store
+
+        store.set_stream(
+            db,
+            123,
+            "archive/new_build_key.tar.gz",
+            iter([b"chunk one ", b"chunk two"]),
+            "application/gzip",
+            schema.BuildArtifactType.CONDA_PACK,
+        )
+        assert len(api.list_build_artifacts(db).all()) == 1
+        assert store.get("archive/new_build_key.tar.gz") == b"chunk one chunk two"
+
+    @pytest.mark.parametrize(
+        "sendfile_header, expected",
+        [
+            (None, {}),
+            (
+                "X-Accel-Redirect",
+                {"X-Accel-Redirect": "/conda-store-storage/archive/build%201.tar.gz"},
+            ),
+            ("X-Sendfile", {"X-Sendfile": "{storage_path}/archive/build 1.tar.gz"}),
+        ],
+    )
+    def test_get_sendfile_headers(self, local_file_store, sendfile_header, expected):
+        store = storage.LocalStorage(sendfile_header=sendfile_header)
+        store.storage_path = str(local_file_store)
+
+        headers = store.get_sendfile_headers("archive/build 1.tar.gz")
+        assert headers == {
+            k: v.format(storage_path=local_file_store) for k, v in expected.items()
+        }
+
     def test_delete(self, seed_conda_store, local_file_store):
         store = storage.LocalStorage()
         store.storage_path = local_file_store
@@ -128,3 +388,493 @@ class TestLocalStorage:
         assert len(api.list_build_artifacts(db).all()) == len(inital_artifacts) - 1
 
         assert not os.path.exists(target_file)
+
+    def test_delete_many(self, seed_conda_store, local_file_store):
+        store = storage.LocalStorage()
+        store.storage_path = local_file_store
+        db = seed_conda_store
+
+        for build_id in [1, 2]:
+            store.set(
+                db,
+                build_id,
+                "shared.tar.gz",
+                b"archive",
+                artifact_type=schema.BuildArtifactType.CONDA_PACK,
+            )
+            store.set(
+                db,
+                build_id,
+                f"lockfile/{build_id}.json",
+                b"lockfile",
+                artifact_type=schema.BuildArtifactType.LOCKFILE,
+            )
+
+        # the key shared with build 2 is kept
+        store.delete_many(db, api.list_build_artifacts(db, build_id=1).all())
+        assert api.list_build_artifacts(db, build_id=1).all() == []
+        assert (local_file_store / "shared.tar.gz").exists()
+        assert not (local_file_store / "lockfile" / "1.json").exists()
+        assert (local_file_store / "lockfile" / "2.json").exists()
+
+        store.delete_many(db, api.list_build_artifacts(db, build_id=2).all())
+        assert not (local_file_store / "shared.tar.gz").exists()
+        assert not (local_file_store / "lockfile" / "2.json").exists()
+
+    def test_delete_shared(self, seed_conda_store, local_file_store):
+        store = storage.LocalStorage()
+        store.storage_path = local_file_store
+        db = seed_conda_store
+
+        store.set(
+            db,
+            1,
+            "shared.tar.gz",
+            b"archive",
+            artifact_type=schema.BuildArtifactType.CONDA_PACK,
+        )
+        store.set(
+            db,
+            2,
+            "shared.tar.gz",
+            b"archive",
+            artifact_type=schema.BuildArtifactType.CONDA_PACK,
+        )
+        target_file = local_file_store / "shared.tar.gz"
+
+        # the object is kept while another build references it
+        store.delete(db, 1, "shared.tar.gz")
+        assert target_file.exists()
+
+        store.delete(db, 2, "shared.tar.gz")
+        assert not target_file.exists()
+
+    def test_content_addressed(self, seed_conda_store, local_file_store):
+        store = storage.LocalStorage(content_addressed=True)
+        store.storage_path = local_file_store
+        db = seed_conda_store
+
+        for build_id in [1, 2]:
+            store.set(
+                db,
+                build_id,
+                f"lockfile/{build_id}.json",
+                b"identical lockfile",
+                artifact_type=schema.BuildArtifactType.LOCKFILE,
+            )
+        store.set_stream(
+            db,
+            3,
+            "lockfile/3.json",
+            iter([b"identical ", b"lockfile"]),
+            artifact_type=schema.BuildArtifactType.LOCKFILE,
+        )
+
+        digest = hashlib.sha256(b"identical lockfile").hexdigest()
+        blob_file = local_file_store / store.blob_key(digest)
+        assert blob_file.read_bytes() == b"identical lockfile"
+        assert not (local_file_store / "lockfile").exists()
+
+        for build_id in [1, 2, 3]:
+            key = store.resolve_key(db, f"lockfile/{build_id}.json")
+            assert key == store.blob_key(digest)
+            assert store.get(key) == b"identical lockfile"
+
+        # the blob is garbage collected with its last reference
+        store.delete(db, 1, "lockfile/1.json")
+        store.delete(db, 2, "lockfile/2.json")
+        assert blob_file.exists()
+
+        store.delete(db, 3, "lockfile/3.json")
+        assert not blob_file.exists()
+
+    def test_content_addressed_excludes_logs(self, db, local_file_store):
+        store = storage.LocalStorage(content_addressed=True)
+        store.storage_path = local_file_store
+
+        store.set(
+            db,
+            123,
+            "logs/new_build_key.log",
+            b"fake logs",
+            artifact_type=schema.BuildArtifactType.LOGS,
+        )
+        assert store.resolve_key(db, "logs/new_build_key.log") == (
+            "logs/new_build_key.log"
+        )
+        assert store.get("logs/new_build_key.log") == b"fake logs"
+
+
+class TestS3Storage:
+    @pytest.fixture
+    def s3_storage(self):
+        store = storage.S3Storage(multipart_part_size=5 * 2**20)
+        store._internal_client = mock.Mock()
+        store._internal_client._upload_part.side_effect = lambda *args: hashlib.md5(
+            args[2]
+        ).hexdigest()
+        return store
+
+    @pytest.fixture
+    def large_file(self, tmp_path):
+        filename = tmp_path / "environment.tar.gz"
+        filename.write_bytes(os.urandom(12 * 2**20))
+        return filename
+
+    def test_fset_multipart(self, db, s3_storage, large_file):
+        client = s3_storage._internal_client
+        client._list_multipart_uploads.return_value = mock.Mock(uploads=[])
+        client._create_multipart_upload.return_value = "upload-id"
+
+        s3_storage.fset(
+            db,
+            123,
+            "archive/new_build_key.tar.gz",
+            str(large_file),
+            content_type="application/gzip",
+            artifact_type=schema.BuildArtifactType.CONDA_PACK,
+        )
+
+        client.fput_object.assert_not_called()
+        assert client._upload_part.call_count == 3
+        for call in client._upload_part.call_args_list:
+            data, headers = call.args[2], call.args[3]
+            assert (
+                headers["Content-MD5"]
+                == base64.b64encode(hashlib.md5(data).digest()).decode()
+            )
+
+        (_, _, upload_id, parts), _ = client._complete_multipart_upload.call_args
+        assert upload_id == "upload-id"
+        assert [part.part_number for part in parts] == [1, 2, 3]
+        assert len(api.list_build_artifacts(db).all()) == 1
+
+    def test_fset_multipart_resume(self, db, s3_storage, large_file):
+        client = s3_storage._internal_client
+        data = large_file.read_bytes()
+        client._list_multipart_uploads.return_value = mock.Mock(
+            uploads=[
+                mock.Mock(
+                    object_name="archive/new_build_key.tar.gz",
+                    upload_id="upload-id",
+                    initiated_time=None,
+                )
+            ]
+        )
+        # the first part was uploaded, the second part is corrupted
+        client._list_parts.return_value = mock.Mock(
+            parts=[
+                Part(1, hashlib.md5(data[: 5 * 2**20]).hexdigest()),
+                Part(2, "corrupted"),
+            ],
+            is_truncated=False,
+        )
+
+        s3_storage.fset(
+            db,
+            123,
+            "archive/new_build_key.tar.gz",
+            str(large_file),
+            content_type="application/gzip",
+            artifact_type=schema.BuildArtifactType.CONDA_PACK,
+        )
+
+        client._create_multipart_upload.assert_not_called()
+        uploaded_parts = [call.args[5] for call in client._upload_part.call_args_list]
+        assert sorted(uploaded_parts) == [2, 3]
+        (_, _, upload_id, parts), _ = client._complete_multipart_upload.call_args
+        assert upload_id == "upload-id"
+        assert [part.part_number for part in parts] == [1, 2, 3]
+
+    def test_fset_multipart_stale(self, db, s3_storage, large_file):
+        client = s3_storage._internal_client
+        client._create_multipart_upload.return_value = "new-upload-id"
+        client._list_multipart_uploads.return_value = mock.Mock(
+            uploads=[
+                mock.Mock(
+                    object_name="archive/new_build_key.tar.gz",
+                    upload_id="stale-upload-id",
+                    initiated_time=datetime.datetime.now(datetime.timezone.utc)
+                    - datetime.timedelta(days=2),
+                )
+            ]
+        )
+
+        s3_storage.fset(
+            db,
+            123,
+            "archive/new_build_key.tar.gz",
+            str(large_file),
+            content_type="application/gzip",
+            artifact_type=schema.BuildArtifactType.CONDA_PACK,
+        )
+
+        client._abort_multipart_upload.assert_called_once_with(
+            s3_storage.bucket_name, "archive/new_build_key.tar.gz", "stale-upload-id"
+        )
+        client._list_parts.assert_not_called()
+        (_, _, upload_id, _), _ = client._complete_multipart_upload.call_args
+        assert upload_id == "new-upload-id"
+
+    @pytest.mark.parametrize(
+        "error, aborted",
+        [
+            (
+                S3Error(
+                    response=mock.Mock(status=403),
+                    code="AccessDenied",
+                    message="Access Denied",
+                    resource="archive/new_build_key.tar.gz",
+                    request_id=None,
+                    host_id=None,
+                ),
+                True,
+            ),
+            (OSError("file removed"), True),
+            (urllib3.exceptions.ProtocolError("connection reset"), False),
+            (
+                S3Error(
+                    response=mock.Mock(status=503),
+                    code="SlowDown",
+                    message="Please reduce your request rate",
+                    resource="archive/new_build_key.tar.gz",
+                    request_id=None,
+                    host_id=None,
+                ),
+                False,
+            ),
+        ],
+    )
+    def test_fset_multipart_failure(self, db, s3_storage, large_file, error, aborted):
+        client = s3_storage._internal_client
+        client._list_multipart_uploads.return_value = mock.Mock(uploads=[])
+        client._create_multipart_upload.return_value = "upload-id"
+        client._upload_part.side_effect = error
+
+        with pytest.raises(type(error)):
+            s3_storage.fset(
+                db,
+                123,
+                "archive/new_build_key.tar.gz",
+                str(large_file),
+                content_type="application/gzip",
+                artifact_type=schema.BuildArtifactType.CONDA_PACK,
+            )
+
+        # uploads interrupted by transient errors are kept to be resumed
+        if aborted:
+            client._abort_multipart_upload.assert_called_once_with(
+                s3_storage.bucket_name, "archive/new_build_key.tar.gz", "upload-id"
+            )
+        else:
+            client._abort_multipart_upload.assert_not_called()
+
+    def test_fset_small_file(self, db, s3_storage, local_file_store):
+        client = s3_storage._internal_client
+
+        s3_storage.fset(
+            db,
+            123,
+            "lockfile/new_build_key.json",
+            str(local_file_store / "testfile1"),
+            content_type="application/json",
+            artifact_type=schema.BuildArtifactType.LOCKFILE,
+        )
+
+        client.fput_object.assert_called_once()
+        client._create_multipart_upload.assert_not_called()
+
+    @pytest.fixture
+    def s3_append_storage(self):
+        store = storage.S3Storage(append_compact_interval=3600)
+        store._internal_client = FakeS3Client()
+        return store
+
+    def _append(self, db, store, value):
+        store.append(
+            db,
+            123,
+            "logs/build.log",
+            value,
+            "text/plain",
+            schema.BuildArtifactType.LOGS,
+        )
+
+    def test_compact(self, db, s3_append_storage):
+        client = s3_append_storage._internal_client
+        for line in [b"one\n", b"two\n", b"three\n"]:
+            self._append(db, s3_append_storage, line)
+        assert len(client.objects) == 3
+
+        s3_append_storage.compact("logs/build.log")
+        assert list(client.objects) == ["logs/build.log"]
+        assert s3_append_storage.get("logs/build.log") == b"one\ntwo\nthree\n"
+
+        self._append(db, s3_append_storage, b"four\n")
+        s3_append_storage.compact("logs/build.log")
+        assert list(client.objects) == ["logs/build.log"]
+        assert s3_append_storage.get("logs/build.log") == b"one\ntwo\nthree\nfour\n"
+
+    def test_compact_interrupted(self, db, s3_append_storage):
+        client = s3_append_storage._internal_client
+        for line in [b"one\n", b"two\n"]:
+            self._append(db, s3_append_storage, line)
+
+        # the segments are left behind by a compaction which crashed after
+        # writing the object
+        with mock.patch.object(client, "remove_objects", return_value=iter([])):
+            s3_append_storage.compact("logs/build.log")
+        assert len(client.objects) == 3
+
+        self._append(db, s3_append_storage, b"three\n")
+        s3_append_storage.compact("logs/build.log")
+        assert list(client.objects) == ["logs/build.log"]
+        assert s3_append_storage.get("logs/build.log") == b"one\ntwo\nthree\n"
+
+    def test_compact_concurrent(self, db, s3_append_storage):
+        client = s3_append_storage._internal_client
+        other_storage = storage.S3Storage(append_compact_interval=3600)
+        other_storage._internal_client = client
+        for line in [b"one\n", b"two\n"]:
+            self._append(db, s3_append_storage, line)
+
+        # another worker appends and compacts while the segments are read
+        get_object = client.get_object
+
+        def concurrent_get_object(bucket_name, object_name):
+            if object_name.startswith("logs/build.log.segments/") and not hasattr(
+                client, "interleaved"
+            ):
+                client.interleaved = True
+                self._append(db, other_storage, b"three\n")
+                other_storage.compact("logs/build.log")
+            return get_object(bucket_name, object_name)
+
+        with mock.patch.object(client, "get_object", concurrent_get_object):
+            s3_append_storage.compact("logs/build.log")
+
+        assert list(client.objects) == ["logs/build.log"]
+        assert s3_append_storage.get("logs/build.log") == b"one\ntwo\nthree\n"
+
+    def test_get_url_cache(self, s3_storage):
+        s3_storage._external_client = mock.Mock()
+        presign = s3_storage._external_client.presigned_get_object
+        presign.side_effect = lambda *args: (
+            f"https://s3/{args[1]}?signature={presign.call_count}"
+        )
+
+        url = s3_storage.get_url("archive/build.tar.gz")
+        assert s3_storage.get_url("archive/build.tar.gz") == url
+        assert s3_storage.get_url("installer/build.sh") != url
+        assert presign.call_count == 2
+
+        s3_storage.presigned_url_cache_ttl = 0
+        assert s3_storage.get_url("archive/build.tar.gz") != url
+        assert presign.call_count == 3
+
+
+class TestCachedStorage:
+    @pytest.fixture
+    def cached_storage(self, tmp_path, local_file_store):
+        store = storage.CachedStorage(
+            backend_class=storage.LocalStorage,
+            cache_directory=str(tmp_path / "cache"),
+        )
+        store.backend.storage_path = str(local_file_store)
+        return store
+
+    def test_get_read_through(self, cached_storage):
+        backend_get = mock.Mock(wraps=cached_storage.backend.get)
+        with mock.patch.object(cached_storage.backend, "get", backend_get):
+            assert cached_storage.get("testfile1") == b"testfile1"
+            assert cached_storage.get("testfile1") == b"testfile1"
+            assert list(cached_storage.get_stream("testfile1", 4)) == [b"file1"]
+            assert cached_storage.get_size("testfile1") == len(b"testfile1")
+        backend_get.assert_called_once_with("testfile1")
+
+    def test_write_through_and_delete(self, db, cached_storage):
+        cached_storage.set(
+            db,
+            123,
+            "lockfile/new_build_key.json",
+            b"lockfile",
+            content_type="application/json",
+            artifact_type=schema.BuildArtifactType.LOCKFILE,
+        )
+        cache_filename = cached_storage._cache_filename("lockfile/new_build_key.json")
+        assert open(cache_filename, "rb").read() == b"lockfile"
+        assert cached_storage.backend.get("lockfile/new_build_key.json") == b"lockfile"
+
+        cached_storage.delete(db, 123, "lockfile/new_build_key.json")
+        assert not os.path.exists(cache_filename)
+        with pytest.raises(FileNotFoundError):
+            cached_storage.get("lockfile/new_build_key.json")
+
+    def test_logs_not_cached(self, db, cached_storage):
+        for line in [b"line one\n", b"line two\n"]:
+            cached_storage.append(
+                db,
+                123,
+                "logs/new_build_key.log",
+                line,
+                content_type="text/plain",
+                artifact_type=schema.BuildArtifactType.LOGS,
+            )
+            cached_storage.get("logs/new_build_key.log")
+
+        assert cached_storage.get("logs/new_build_key.log") == (b"line one\nline two\n")
+        assert not os.path.exists(
+            cached_storage._cache_filename("logs/new_build_key.log")
+        )
+
+    def test_evict_least_recently_used(self, db, cached_storage):
+        cached_storage.cache_max_size = 20
+        for i, key in enumerate(["one", "two", "three"]):
+            cached_storage.set(
+                db,
+                123,
+                key,
+                b"0123456789",
+                content_type="text/plain",
+                artifact_type=schema.BuildArtifactType.YAML,
+            )
+            # orders the cache entries without relying on clock resolution
+            os.utime(cached_storage._cache_filename(key), (i, i))
+
+        assert cached_storage._cached("one") is None
+        assert cached_storage._cached("two") is not None
+        assert cached_storage._cached("three") is not None
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_compression(db, local_file_store, compression):
+    store = storage.LocalStorage(compression=compression)
+    store.storage_path = str(local_file_store)
+    lockfile = b'{"package": []}' * 1000
+
+    store.set(
+        db,
+        123,
+        "lockfile/new_build_key.json",
+        lockfile,
+        content_type="application/json",
+        artifact_type=schema.BuildArtifactType.LOCKFILE,
+    )
+    store.set(
+        db,
+        123,
+        "logs/new_build_key.log",
+        b"fake logs",
+        content_type="text/plain",
+        artifact_type=schema.BuildArtifactType.LOGS,
+    )
+
+    stored = store.get("lockfile/new_build_key.json")
+    assert len(stored) < len(lockfile)
+    assert storage.decompress(stored, compression) == lockfile
+    assert store.get_content_encoding(db, "lockfile/new_build_key.json") == compression
+    assert store.get_artifact(db, "lockfile/new_build_key.json") == lockfile
+
+    # logs are tailed by offset and stay uncompressed
+    assert store.get_content_encoding(db, "logs/new_build_key.log") is None
+    assert store.get("logs/new_build_key.log") == b"fake logs"